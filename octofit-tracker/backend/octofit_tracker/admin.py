@@ -1,15 +1,20 @@
 from django.contrib import admin
-from .models import User, Team, Activity, Leaderboard, Workout
+from django.contrib.auth import get_permission_codename
+from . import jobs
+from .changelist import LargeCollectionAdmin
+from .models import User, Team, Activity, Leaderboard, Workout, Job
 
 
 @admin.register(User)
-class UserAdmin(admin.ModelAdmin):
+class UserAdmin(LargeCollectionAdmin):
     """Admin interface for User model"""
     list_display = ('name', 'alias', 'email', 'team', 'fitness_level', 'total_points', 'created_at')
     list_filter = ('team', 'fitness_level', 'created_at')
     search_fields = ('name', 'email', 'alias')
+    search_prefix_fields = ('alias', 'name')
     ordering = ('-total_points',)
     readonly_fields = ('_id', 'created_at')
+    actions = ['recalculate_points']
     
     fieldsets = (
         ('Basic Information', {
@@ -22,28 +27,38 @@ class UserAdmin(admin.ModelAdmin):
             'fields': ('created_at', 'last_active')
         }),
     )
+    
+    @admin.action(description='Recalculate total points from activities (background job)', permissions=['change'])
+    def recalculate_points(self, request, queryset):
+        """Queue a points recalculation for each selected user"""
+        queued = 0
+        for user_id in queryset.values_list('_id', flat=True):
+            jobs.enqueue('recalculate_user_points', user_id=str(user_id))
+            queued += 1
+        self.message_user(request, f'Queued points recalculation for {queued} users.')
 
 
 @admin.register(Team)
-class TeamAdmin(admin.ModelAdmin):
+class TeamAdmin(LargeCollectionAdmin):
     """Admin interface for Team model"""
     list_display = ('name', 'description', 'created_at', 'member_count')
     search_fields = ('name', 'description')
+    search_prefix_fields = ('name',)
     ordering = ('name',)
-    readonly_fields = ('_id', 'created_at')
+    readonly_fields = ('_id', 'created_at', 'member_count')
     
-    def member_count(self, obj):
-        """Display the number of members in the team"""
-        return len(obj.members) if obj.members else 0
-    member_count.short_description = 'Members'
+    def get_queryset(self, request):
+        # The change list shows member_count; the form loads members when it needs them
+        return super().get_queryset(request).defer('members')
 
 
 @admin.register(Activity)
-class ActivityAdmin(admin.ModelAdmin):
+class ActivityAdmin(LargeCollectionAdmin):
     """Admin interface for Activity model"""
     list_display = ('user_alias', 'activity_type', 'duration_minutes', 'points_earned', 'date')
     list_filter = ('activity_type', 'date', 'user_alias')
     search_fields = ('user_name', 'user_alias', 'activity_type', 'notes')
+    search_prefix_fields = ('user_alias',)
     ordering = ('-date',)
     readonly_fields = ('_id', 'date')
     
@@ -61,7 +76,7 @@ class ActivityAdmin(admin.ModelAdmin):
 
 
 @admin.register(Leaderboard)
-class LeaderboardAdmin(admin.ModelAdmin):
+class LeaderboardAdmin(LargeCollectionAdmin):
     """Admin interface for Leaderboard model"""
     list_display = ('rank', 'display_name', 'type', 'total_points', 'updated_at')
     list_filter = ('type', 'team', 'updated_at')
@@ -95,11 +110,12 @@ class LeaderboardAdmin(admin.ModelAdmin):
 
 
 @admin.register(Workout)
-class WorkoutAdmin(admin.ModelAdmin):
+class WorkoutAdmin(LargeCollectionAdmin):
     """Admin interface for Workout model"""
     list_display = ('name', 'difficulty', 'category', 'duration_minutes', 'created_at')
     list_filter = ('difficulty', 'category', 'created_at')
     search_fields = ('name', 'description', 'category')
+    search_prefix_fields = ('name',)
     ordering = ('difficulty', 'name')
     readonly_fields = ('_id', 'created_at')
     
@@ -116,6 +132,41 @@ class WorkoutAdmin(admin.ModelAdmin):
     )
 
 
+@admin.register(Job)
+class JobAdmin(LargeCollectionAdmin):
+    """Read-only view of the background job queue, with its depth in the title"""
+    list_display = ('name', 'status', 'attempts', 'run_after', 'locked_by', 'created_at', 'finished_at')
+    list_filter = ('status', 'name')
+    search_fields = ('name', 'key')
+    ordering = ('-created_at',)
+    actions = ['retry']
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+    
+    def has_retry_permission(self, request):
+        # The change form stays read-only, but requeueing still needs change rights
+        codename = get_permission_codename('change', self.opts)
+        return request.user.has_perm(f'{self.opts.app_label}.{codename}')
+    
+    def changelist_view(self, request, extra_context=None):
+        depth = jobs.queue_depth()
+        title = 'Jobs: ' + ', '.join(f'{count} {status}' for status, count in depth.items())
+        return super().changelist_view(request, {**(extra_context or {}), 'title': title})
+    
+    @admin.action(description='Retry selected jobs now', permissions=['retry'])
+    def retry(self, request, queryset):
+        """Queue the selected failed or finished jobs again"""
+        retried = 0
+        for job in queryset.exclude(status__in=[jobs.QUEUED, jobs.RUNNING]):
+            jobs.enqueue(job.name, **job.args)
+            retried += 1
+        self.message_user(request, f'Queued {retried} jobs.')
+
+
 # Customize admin site headers
 admin.site.site_header = 'OctoFit Tracker Administration'
 admin.site.site_title = 'OctoFit Admin'
@@ -0,0 +1,10 @@
+from django.apps import AppConfig
+
+
+class OctofitTrackerConfig(AppConfig):
+    """App configuration for octofit_tracker"""
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'octofit_tracker'
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -2,6 +2,10 @@
 ASGI config for octofit_tracker project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Served by an ASGI server (e.g. ``uvicorn octofit_tracker.asgi:application``),
+the read endpoints under /api/async/ run on the event loop with motor instead
+of occupying a thread per request, and /api/stream/leaderboard/ is answered
+by the live leaderboard stream (SSE or WebSocket) rather than by Django.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/4.1/howto/deployment/asgi/
@@ -13,4 +17,13 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'octofit_tracker.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Imported once Django is set up
+from octofit_tracker.live import PATH as LIVE_PATH, leaderboard_stream  # noqa: E402
+
+
+async def application(scope, receive, send):
+    if scope['type'] in ('http', 'websocket') and scope['path'] == LIVE_PATH:
+        return await leaderboard_stream(scope, receive, send)
+    return await django_application(scope, receive, send)
@@ -0,0 +1,83 @@
+"""
+Async read endpoints for ASGI workers.
+
+DRF views are synchronous, so under ASGI each request holds a threadpool slot
+while it waits on MongoDB. These views serve the hot read paths (leaderboard,
+workouts and activity feeds) as native async Django views on motor, so a
+single worker can keep thousands of slow clients in flight. They mirror the
+DRF list and retrieve endpoints of the ViewSet they wrap: same filterset
+fields, ordering fields, cursor pagination and serializer output.
+"""
+from collections import OrderedDict
+
+from django.conf import settings
+from django.http import HttpResponse
+from django.views import View
+from rest_framework.exceptions import ValidationError
+
+from .db import get_async_db
+from .pagination import list_ordering
+from .renderers import dumps
+from .repositories import repository_for, decode_cursor
+from .serializers import requested_fields, model_fields, lean_data
+
+
+def json_response(data, status=200):
+    return HttpResponse(dumps(data), status=status, content_type='application/json')
+
+
+class AsyncReadView(View):
+    """List (keyset paginated) and retrieve for one router ViewSet"""
+    viewset = None
+    http_method_names = ['get', 'head', 'options']
+
+    def page_size(self, request):
+        try:
+            size = int(request.GET['page_size'])
+        except (KeyError, ValueError):
+            return settings.REST_FRAMEWORK['PAGE_SIZE']
+        return min(size, settings.API_MAX_PAGE_SIZE) if size > 0 else settings.REST_FRAMEWORK['PAGE_SIZE']
+
+    async def get(self, request, pk=None):
+        repository = repository_for(self.viewset.queryset.model)
+        db = get_async_db()
+        serializer_class = self.viewset.serializer_class
+        context = {'request': request, 'listing': pk is None}
+        try:
+            selected = requested_fields(request, serializer_class, listing=pk is None)
+        except ValidationError as exc:
+            return json_response(exc.detail, status=400)
+        ordering = list_ordering(self.viewset, request.GET.get('ordering')) if pk is None else ()
+        projection = None
+        if selected is not None:
+            names = model_fields(serializer_class, selected) | {name.lstrip('-') for name in ordering}
+            projection = dict.fromkeys(names, 1)
+
+        if pk is not None:
+            record = await repository.aget(db, pk, projection)
+            if record is None:
+                return json_response({'detail': 'Not found.'}, status=404)
+            return json_response(serializer_class(record, context=context).data)
+
+        lookups = {
+            name: request.GET[name]
+            for name in getattr(self.viewset, 'filterset_fields', [])
+            if name in request.GET
+        }
+        token = request.GET.get('cursor')
+        try:
+            cursor = decode_cursor(token) if token else None
+        except ValueError:
+            return json_response({'detail': 'Invalid cursor'}, status=404)
+
+        records, has_more = await repository.apage(
+            db, lookups, ordering, cursor, self.page_size(request), projection
+        )
+        next_link, previous_link = repository.page_links(
+            request.build_absolute_uri(), records, ordering, cursor, has_more
+        )
+        return json_response(OrderedDict([
+            ('next', next_link),
+            ('previous', previous_link),
+            ('results', lean_data(serializer_class(records, many=True, context=context), records)),
+        ]))
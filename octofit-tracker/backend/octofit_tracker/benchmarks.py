@@ -0,0 +1,335 @@
+"""
+API benchmark harness.
+
+Routes are discovered from the DRF router in urls.py: for every registered
+ViewSet the list and retrieve endpoints, a search and each ordering field,
+and every GET custom @action. Each route is requested in-process through the
+full middleware stack with django.test.Client and measured for latency
+percentiles, throughput, MongoDB round trips, ORM queries and peak memory.
+
+run_asgi() and run_wsgi() compare the async read views served by asgi.py with
+their DRF counterparts served by wsgi.py under concurrent load, optionally
+with clients that are slow to read their responses.
+
+measure_encodings() prices a route's payload under each renderer and
+content coding: CPU time to encode it and bytes on the wire.
+"""
+import asyncio
+import re
+import statistics
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+from dataclasses import dataclass, field, asdict
+
+from django.core.cache import caches
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.test.client import RequestFactory
+from django.urls import reverse
+from rest_framework.renderers import JSONRenderer
+
+from . import compression, exports, renderers
+from .db import command_stats, get_db
+from .response_cache import CACHE_ALIAS
+
+# Query params for actions that need more than the bare URL
+ACTION_PARAMS = {
+    'workout-recommend': lambda samples: {'user_id': samples.get('user')},
+    'activity-stats': lambda samples: {'activity_type': 'running'},
+}
+
+# URL kwargs for each route of actions whose url_path takes arguments, by
+# action url_name; such actions without an entry are not benchmarked
+ACTION_KWARGS = {
+    'export': lambda: [
+        {'export_format': name} for name, (_type, _encoder, available) in exports.FORMATS.items() if available()
+    ],
+}
+
+
+@dataclass
+class Route:
+    name: str
+    path: str
+    params: dict = field(default_factory=dict)
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a non-empty list"""
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def sample_documents(registry):
+    """One stored document per ViewSet basename, used to build detail URLs"""
+    db = get_db()
+    samples = {}
+    for _prefix, viewset, basename in registry:
+        document = db[viewset.queryset.model._meta.db_table].find_one()
+        if document is not None:
+            samples[basename] = document
+    return samples
+
+
+def search_term(viewset, document):
+    """A short prefix of the first searchable field of a sample document"""
+    for name in getattr(viewset, 'search_fields', []):
+        value = document.get(name.lstrip('^=@$')) if document else None
+        if isinstance(value, str) and value.strip():
+            return value.split()[0][:4]
+    return None
+
+
+def discover_routes(registry):
+    """Every benchmarkable GET route registered on the router"""
+    samples = sample_documents(registry)
+    sample_ids = {basename: str(doc['_id']) for basename, doc in samples.items()}
+
+    for _prefix, viewset, basename in registry:
+        document = samples.get(basename)
+        pk = sample_ids.get(basename)
+
+        yield Route(f'{basename}-list', reverse(f'{basename}-list'))
+        if pk:
+            yield Route(f'{basename}-detail', reverse(f'{basename}-detail', args=[pk]))
+
+        term = search_term(viewset, document)
+        if term:
+            yield Route(f'{basename}-search', reverse(f'{basename}-list'), {'search': term})
+        for name in getattr(viewset, 'ordering_fields', []):
+            yield Route(f'{basename}-ordering-{name}', reverse(f'{basename}-list'), {'ordering': f'-{name}'})
+
+        for extra in viewset.get_extra_actions():
+            if 'get' not in extra.mapping:
+                continue
+            url_name = f'{basename}-{extra.url_name}'
+            if extra.detail and not pk:
+                continue
+            if re.search(r'\(\?P<', extra.url_path):
+                if extra.url_name not in ACTION_KWARGS:
+                    continue
+                variants = [
+                    (f'{url_name}-{"-".join(kwargs.values())}', kwargs) for kwargs in ACTION_KWARGS[extra.url_name]()
+                ]
+            else:
+                variants = [(url_name, {})]
+            params = ACTION_PARAMS.get(url_name, lambda _samples: {})({'user': sample_ids.get('user')})
+            params = {key: value for key, value in params.items() if value}
+            for name, kwargs in variants:
+                if extra.detail:
+                    kwargs = {**kwargs, viewset.lookup_url_kwarg or viewset.lookup_field: pk}
+                yield Route(name, reverse(url_name, kwargs=kwargs), params)
+
+
+def measure(route, iterations=50, warmup=5, cold_cache=False, client=None):
+    """Time one route and return its result row"""
+    client = client or Client()
+    cache = caches[CACHE_ALIAS]
+    cache.clear()
+
+    def request():
+        if cold_cache:
+            cache.clear()
+        return client.get(route.path, route.params, HTTP_ACCEPT='application/json')
+
+    for _ in range(warmup):
+        request()
+
+    latencies, commands, queries = [], [], []
+    status_code = size = None
+    started = time.perf_counter()
+    for _ in range(iterations):
+        command_stats.reset()
+        with CaptureQueriesContext(connection) as captured:
+            begin = time.perf_counter()
+            response = request()
+            latencies.append((time.perf_counter() - begin) * 1000)
+        commands.append(command_stats.snapshot()[0])
+        queries.append(len(captured.captured_queries))
+        status_code, size = response.status_code, len(response.content)
+    elapsed = time.perf_counter() - started
+
+    # Memory is traced in a separate pass so tracing does not skew latency
+    tracemalloc.start()
+    request()
+    _current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        **asdict(route),
+        'status': status_code,
+        'response_bytes': size,
+        'iterations': iterations,
+        'latency_ms': {
+            'min': min(latencies),
+            'mean': statistics.fmean(latencies),
+            'p50': percentile(latencies, 50),
+            'p90': percentile(latencies, 90),
+            'p99': percentile(latencies, 99),
+            'max': max(latencies),
+        },
+        'throughput_rps': iterations / elapsed if elapsed else None,
+        'mongo_commands': max(commands),
+        'orm_queries': max(queries),
+        'peak_memory_kb': peak / 1024,
+    }
+
+
+def encoding_renderers():
+    """Renderers to price, DRF's stock JSON encoder first as the baseline"""
+    available = {'json': JSONRenderer()}
+    if renderers.orjson is not None:
+        available['orjson'] = renderers.ORJSONRenderer()
+    if renderers.msgpack is not None:
+        available['msgpack'] = renderers.MessagePackRenderer()
+    return available
+
+
+def measure_encodings(route, iterations=20, client=None):
+    """
+    CPU time (process time, ms per response) and bytes of one route's data
+    under each renderer and content coding. The data is fetched once and
+    re-encoded, so only encoding is measured.
+    """
+    client = client or Client()
+    response = client.get(route.path, route.params, HTTP_ACCEPT='application/json')
+    data = getattr(response, 'data', None)
+    if response.status_code != 200 or data is None:
+        return []
+
+    rows = []
+    for renderer_name, renderer in encoding_renderers().items():
+        for encoding in ('identity',) + compression.available_encodings():
+            started = time.process_time()
+            for _ in range(iterations):
+                body = renderer.render(data)
+                if encoding != 'identity':
+                    body = compression.compress_bytes(body, encoding)
+            rows.append({
+                'renderer': renderer_name,
+                'encoding': encoding,
+                'cpu_ms': (time.process_time() - started) * 1000 / iterations,
+                'bytes': len(body),
+            })
+    return rows
+
+
+def compare(current, previous, threshold=0.1):
+    """
+    Pair up rows from two runs by (dataset, route) and flag p50 regressions.
+
+    Returns rows of (dataset, route, previous p50, current p50, relative change, regressed).
+    """
+    before = {(row['dataset'], row['name']): row for row in previous['results']}
+    rows = []
+    for row in current['results']:
+        old = before.get((row['dataset'], row['name']))
+        if old is None:
+            continue
+        old_p50, new_p50 = old['latency_ms']['p50'], row['latency_ms']['p50']
+        change = (new_p50 - old_p50) / old_p50 if old_p50 else 0.0
+        rows.append((row['dataset'], row['name'], old_p50, new_p50, change, change > threshold))
+    return rows
+
+
+def async_route_pairs(names=None):
+    """(name, async path, WSGI path) for each async read endpoint"""
+    from .urls import async_urlpatterns
+
+    for pattern in async_urlpatterns:
+        if not pattern.name.endswith('-list'):
+            continue
+        name = pattern.name[len('async-'):]
+        if names and not any(wanted in name for wanted in names):
+            continue
+        yield name, reverse(pattern.name), reverse(name)
+
+
+def latency_summary(latencies, elapsed, statuses):
+    return {
+        'requests': len(latencies),
+        'errors': sum(1 for code in statuses if code >= 400),
+        'latency_ms': {
+            'p50': percentile(latencies, 50),
+            'p90': percentile(latencies, 90),
+            'p99': percentile(latencies, 99),
+            'max': max(latencies),
+        },
+        'throughput_rps': len(latencies) / elapsed if elapsed else None,
+    }
+
+
+def run_asgi(app, path, params, requests, concurrency, client_delay=0.0):
+    """
+    Issue `requests` GETs to an ASGI app on one event loop with at most
+    `concurrency` in flight. Each client takes `client_delay` seconds to
+    read its response, which costs an async server nothing but a coroutine.
+    """
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1',
+        'method': 'GET', 'scheme': 'http', 'path': path, 'raw_path': path.encode(),
+        'query_string': urlencode(params).encode(), 'root_path': '',
+        'headers': [(b'host', b'testserver'), (b'accept', b'application/json')],
+        'client': ('127.0.0.1', 0), 'server': ('testserver', 80),
+    }
+
+    async def main():
+        semaphore = asyncio.Semaphore(concurrency)
+        latencies, statuses = [], []
+
+        async def one():
+            async with semaphore:
+                sent = {}
+
+                async def receive():
+                    return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+                async def send(message):
+                    if message['type'] == 'http.response.start':
+                        sent['status'] = message['status']
+                    elif not message.get('more_body') and client_delay:
+                        await asyncio.sleep(client_delay)
+
+                begin = time.perf_counter()
+                await app(dict(scope), receive, send)
+                latencies.append((time.perf_counter() - begin) * 1000)
+                statuses.append(sent.get('status', 500))
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(requests)))
+        return latency_summary(latencies, time.perf_counter() - started, statuses)
+
+    return asyncio.run(main())
+
+
+def run_wsgi(app, path, params, requests, concurrency, client_delay=0.0):
+    """
+    Issue `requests` GETs to a WSGI app from `concurrency` threads, as a
+    threaded WSGI server would. A slow client holds its thread while it
+    reads the response.
+    """
+    factory = RequestFactory()
+
+    def one(_index):
+        environ = factory.get(path, params, HTTP_ACCEPT='application/json').environ
+        status = []
+        begin = time.perf_counter()
+        body = app(environ, lambda code, headers, exc_info=None: status.append(int(code.split()[0])))
+        try:
+            for _chunk in body:
+                pass
+        finally:
+            getattr(body, 'close', lambda: None)()
+        if client_delay:
+            time.sleep(client_delay)
+        return (time.perf_counter() - begin) * 1000, status[0] if status else 500
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(one, range(requests)))
+    elapsed = time.perf_counter() - started
+    return latency_summary([latency for latency, _ in results], elapsed, [code for _, code in results])
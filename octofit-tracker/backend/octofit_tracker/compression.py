@@ -0,0 +1,156 @@
+"""
+Response compression for the API routes.
+
+compress_response() wraps a view and compresses its response with brotli
+(when the brotli package is installed and the client accepts it) or gzip.
+Bodies under COMPRESS_MIN_SIZE bytes are sent as they are, since on those
+the CPU costs more than the bytes saved. Streaming responses (exports) are
+compressed chunk by chunk with a flush after each, so they keep streaming.
+Only data types are compressed; HTML is left alone because the browsable
+API embeds the CSRF token (BREACH).
+"""
+import asyncio
+import re
+import zlib
+from functools import wraps
+
+from django.conf import settings
+from django.urls import URLPattern
+from django.utils.cache import patch_vary_headers
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE = re.compile(r'^(application/(json|msgpack|x-ndjson)|text/(csv|plain))\b')
+
+
+class GzipCompressor:
+    def __init__(self):
+        self._compressor = zlib.compressobj(settings.COMPRESS_GZIP_LEVEL, zlib.DEFLATED, 31)
+
+    def chunk(self, data):
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def whole(self, data):
+        return self._compressor.compress(data) + self._compressor.flush()
+
+    def finish(self):
+        return self._compressor.flush()
+
+
+class BrotliCompressor:
+    def __init__(self):
+        self._compressor = brotli.Compressor(quality=settings.COMPRESS_BROTLI_QUALITY)
+
+    def chunk(self, data):
+        return self._compressor.process(data) + self._compressor.flush()
+
+    def whole(self, data):
+        return self._compressor.process(data) + self._compressor.finish()
+
+    def finish(self):
+        return self._compressor.finish()
+
+
+def available_encodings():
+    """Content codings this server can produce, preferred first"""
+    return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+COMPRESSORS = {'br': BrotliCompressor, 'gzip': GzipCompressor}
+
+
+def compress_bytes(data, encoding):
+    return COMPRESSORS[encoding]().whole(data)
+
+
+def accepted_encoding(request):
+    """The preferred coding the client accepts, or None"""
+    weights = {}
+    for item in request.META.get('HTTP_ACCEPT_ENCODING', '').split(','):
+        name, _, params = item.strip().partition(';')
+        quality = 1.0
+        match = re.search(r'q=([0-9.]+)', params)
+        if match:
+            try:
+                quality = float(match.group(1))
+            except ValueError:
+                quality = 0.0
+        weights[name.strip().lower()] = quality
+    for encoding in available_encodings():
+        if weights.get(encoding, weights.get('*', 0)) > 0:
+            return encoding
+    return None
+
+
+def _stream(chunks, encoding):
+    compressor = COMPRESSORS[encoding]()
+    for chunk in chunks:
+        data = compressor.chunk(chunk)
+        if data:
+            yield data
+    yield compressor.finish()
+
+
+def compress(request, response):
+    """Compress a rendered response in place if it is worth it"""
+    if response.has_header('Content-Encoding'):
+        return response
+    if not COMPRESSIBLE.match(response.get('Content-Type', '')):
+        return response
+    # Varies whether or not this response ends up compressed
+    patch_vary_headers(response, ('Accept-Encoding',))
+    if not response.streaming and len(response.content) < settings.COMPRESS_MIN_SIZE:
+        return response
+    encoding = accepted_encoding(request)
+    if encoding is None:
+        return response
+
+    if response.streaming:
+        response.streaming_content = _stream(response.streaming_content, encoding)
+        del response['Content-Length']
+    else:
+        compressed = compress_bytes(response.content, encoding)
+        if len(compressed) >= len(response.content):
+            return response
+        response.content = compressed
+        response['Content-Length'] = str(len(compressed))
+
+    etag = response.get('ETag')
+    if etag and etag.startswith('"'):
+        # The bytes differ from the uncompressed representation's
+        response['ETag'] = 'W/' + etag
+    response['Content-Encoding'] = encoding
+    return response
+
+
+def _finish(request, response):
+    if hasattr(response, 'render') and callable(response.render) and not response.is_rendered:
+        response.add_post_render_callback(lambda rendered: compress(request, rendered))
+        return response
+    return compress(request, response)
+
+
+def compress_response(view):
+    """Decorate a sync or async view to compress its responses"""
+    if asyncio.iscoroutinefunction(view):
+        @wraps(view)
+        async def async_wrapper(request, *args, **kwargs):
+            return _finish(request, await view(request, *args, **kwargs))
+        return async_wrapper
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        return _finish(request, view(request, *args, **kwargs))
+    return wrapper
+
+
+def compressed(patterns):
+    """`patterns` with every view wrapped in compress_response()"""
+    return [
+        URLPattern(pattern.pattern, compress_response(pattern.callback), pattern.default_args, pattern.name)
+        if isinstance(pattern, URLPattern) else pattern
+        for pattern in patterns
+    ]
@@ -0,0 +1,140 @@
+"""
+Conditional GET for the API's read endpoints.
+
+Validators come from cheap queries rather than the rendered body:
+
+- the newest value of a field every write to the collection moves (one
+  index-backed find sorted on it, limit 1; for a detail route the object's
+  own value), and
+- the response_cache versions of the namespaces the model's writes
+  invalidate, which also catch updates and deletes that leave that field
+  alone.
+
+Each GET gets a weak ETag over those, the path, the query string and the
+rendered format, and a Last-Modified from the newest of the field value and
+the namespaces' last invalidation. A matching If-None-Match (or, without
+one, If-Modified-Since) is answered with an empty 304 before the view
+queries or serializes anything. Last-Modified has whole-second resolution,
+so it is left out while the newest change is in the current second.
+
+The namespace versions only catch writes made anywhere when every process
+reads them from one cache, so validation is skipped unless API_CACHE_SHARED
+is set (see settings); a per-process cache would answer 304 for data another
+worker has since changed.
+
+Successful GETs also get the Cache-Control policy CACHE_CONTROL sets for
+their route.
+"""
+import calendar
+import hashlib
+import json
+import time
+from functools import wraps
+
+from bson import ObjectId
+from django.conf import settings
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+from pymongo import DESCENDING
+
+from . import response_cache
+from .db import read_collection
+from .leaderboard import id_variants
+
+
+def epoch(value):
+    """Epoch seconds of a stored timestamp (naive datetimes are UTC) or ObjectId"""
+    if isinstance(value, ObjectId):
+        value = value.generation_time
+    return calendar.timegm(value.utctimetuple())
+
+
+def newest(view, kwargs):
+    """
+    (found, value): the view's `conditional_field` on the requested object,
+    or its newest value in the whole collection for non-detail routes.
+    """
+    field = view.conditional_field
+    collection = read_collection(view.queryset.model._meta.db_table)
+    lookup = view.lookup_url_kwarg or view.lookup_field
+    if lookup in kwargs:
+        document = collection.find_one({'_id': {'$in': id_variants(kwargs[lookup])}}, {field: 1})
+        if document is None:
+            return False, None
+    else:
+        document = collection.find_one({}, {field: 1}, sort=[(field, DESCENDING)]) or {}
+    return True, document.get(field)
+
+
+def validators(view, request, kwargs):
+    """(ETag, Last-Modified epoch seconds), or None when there is nothing to validate"""
+    found, value = newest(view, kwargs)
+    if not found:
+        return None
+    namespaces = view.conditional_namespaces
+    renderer = getattr(request, 'accepted_renderer', None)
+    raw = json.dumps([
+        [response_cache.get_version(namespace) for namespace in namespaces],
+        str(value),
+        request.path,
+        sorted(request.query_params.lists()),
+        getattr(renderer, 'format', None),
+    ])
+    etag = 'W/' + quote_etag(hashlib.md5(raw.encode()).hexdigest())
+    stamps = [response_cache.changed_at(namespace) for namespace in namespaces]
+    if value is not None:
+        stamps.append(epoch(value))
+    return etag, max(stamps, default=0)
+
+
+def conditional(view_method):
+    """
+    Validate a GET view method with the view's `conditional_field` and
+    `conditional_namespaces`, answering fresh clients with a 304.
+    """
+    @wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        if (request.method not in ('GET', 'HEAD') or self.conditional_field is None
+                or not settings.API_CACHE_SHARED):
+            return view_method(self, request, *args, **kwargs)
+        found = validators(self, request, kwargs)
+        if found is None:
+            return view_method(self, request, *args, **kwargs)
+        etag, last_modified = found
+        if last_modified >= int(time.time()):
+            # Another write this second would get the same whole-second
+            # Last-Modified, so only the ETag validates until the second ends
+            last_modified = None
+
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = view_method(self, request, *args, **kwargs)
+        if response.status_code in (200, 304):
+            # Replaces the body ETag a cached_response action sets
+            response['ETag'] = etag
+            if last_modified is not None:
+                response['Last-Modified'] = http_date(last_modified)
+        return response
+    return wrapper
+
+
+def cache_control(view):
+    """The CACHE_CONTROL policy for a view's route"""
+    policies = settings.CACHE_CONTROL
+    route = f'{view.basename}-{view.action.replace("_", "-")}' if view.action else view.basename
+    for key in (route, view.basename):
+        if key in policies:
+            return policies[key]
+    return policies.get('default')
+
+
+def add_cache_headers(view, request, response):
+    """Cache-Control and Vary on a successful or not-modified GET"""
+    if request.method not in ('GET', 'HEAD') or response.status_code not in (200, 304):
+        return response
+    policy = cache_control(view)
+    if policy and not response.has_header('Cache-Control'):
+        response['Cache-Control'] = policy
+    # The same URL renders as JSON or the browsable API
+    patch_vary_headers(response, ['Accept'])
+    return response
@@ -0,0 +1,192 @@
+"""
+Process-wide MongoDB client.
+
+djongo (through the ``octofit_tracker.mongo`` engine), management commands
+and the native query modules all borrow the one ``MongoClient`` returned by
+get_client(), so a worker holds a single connection pool sized by the
+``CLIENT`` options in ``DATABASES``. Async views use the motor client from
+get_async_client(), configured from the same options.
+"""
+import asyncio
+import os
+import threading
+import weakref
+from collections import OrderedDict, defaultdict
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connection
+from pymongo import MongoClient, ReadPreference, monitoring
+
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+_async_clients = weakref.WeakKeyDictionary()
+
+
+class PoolStatsListener(monitoring.ConnectionPoolListener):
+    """Counts connection pool events per server address"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stats = defaultdict(lambda: defaultdict(int))
+
+    def _count(self, event, *counters, delta=1):
+        address = '%s:%s' % event.address
+        with self._lock:
+            for counter in counters:
+                self.stats[address][counter] += delta
+
+    def snapshot(self):
+        with self._lock:
+            return {address: dict(counters) for address, counters in self.stats.items()}
+
+    def pool_created(self, event):
+        self._count(event, 'pools_created')
+
+    def pool_cleared(self, event):
+        self._count(event, 'pools_cleared')
+
+    def pool_closed(self, event):
+        self._count(event, 'pools_closed')
+
+    def connection_created(self, event):
+        self._count(event, 'connections_created', 'open')
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self._count(event, 'connections_closed')
+        self._count(event, 'open', delta=-1)
+
+    def connection_check_out_started(self, event):
+        self._count(event, 'check_outs_started')
+
+    def connection_check_out_failed(self, event):
+        self._count(event, 'check_out_failures')
+
+    def connection_checked_out(self, event):
+        self._count(event, 'check_outs', 'in_use')
+
+    def connection_checked_in(self, event):
+        self._count(event, 'in_use', delta=-1)
+
+
+class CommandStatsListener(monitoring.CommandListener):
+    """
+    Counts MongoDB commands and their server time per execution context.
+
+    pymongo reports command events on the thread that issued the command, and
+    the counters live in a context variable, so a request (or benchmark) can
+    reset them, run, and read back only its own round trips. asgiref carries
+    the context into the worker thread of a sync view served over ASGI.
+    """
+
+    def __init__(self):
+        self._counters = ContextVar('mongo_command_stats', default=None)
+
+    def reset(self):
+        self._counters.set([0, 0.0])
+
+    def snapshot(self):
+        """(commands, milliseconds) since the last reset in this context"""
+        counters = self._counters.get()
+        return (counters[0], counters[1]) if counters is not None else (0, 0.0)
+
+    def _record(self, event):
+        counters = self._counters.get()
+        if counters is None:
+            counters = [0, 0.0]
+            self._counters.set(counters)
+        counters[0] += 1
+        counters[1] += event.duration_micros / 1000
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self._record(event)
+
+    def failed(self, event):
+        self._record(event)
+
+
+pool_stats = PoolStatsListener()
+command_stats = CommandStatsListener()
+
+
+def client_options():
+    """MongoClient keyword arguments from DATABASES['default']['CLIENT']"""
+    options = dict(settings.DATABASES['default'].get('CLIENT', {}))
+    options['document_class'] = OrderedDict
+    options['event_listeners'] = [pool_stats, command_stats]
+    return options
+
+
+def get_client():
+    """
+    Return the MongoClient shared by everything in this process.
+
+    A forked child (gunicorn workers, multiprocessing) gets its own client,
+    since pymongo clients must not cross a fork.
+    """
+    global _client, _client_pid
+    if _client is None or _client_pid != os.getpid():
+        with _client_lock:
+            if _client is None or _client_pid != os.getpid():
+                _client = MongoClient(connect=False, **client_options())
+                _client_pid = os.getpid()
+    return _client
+
+
+def get_async_client():
+    """
+    Return the motor client for the running event loop.
+
+    motor clients are bound to the loop they first run on, so each loop
+    (normally one per ASGI worker) gets its own. motor is only imported here,
+    so WSGI workers and management commands do not need it.
+    """
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = _async_clients[loop] = AsyncIOMotorClient(io_loop=loop, **client_options())
+    return client
+
+
+def get_async_db():
+    """The motor database behind the default connection settings"""
+    return get_async_client()[connection.settings_dict['NAME']]
+
+
+def get_db():
+    """Return the pymongo database behind the default djongo connection"""
+    connection.ensure_connection()
+    return connection.connection
+
+
+def read_collection(name, db=None):
+    """
+    Collection handle for reads, with the read preference configured for it.
+
+    MONGO_READ_PREFERENCES maps collection names to pymongo ReadPreference
+    names (e.g. 'SECONDARY_PREFERRED'); unlisted collections read primary.
+    """
+    db = db if db is not None else get_db()
+    mode = getattr(settings, 'MONGO_READ_PREFERENCES', {}).get(name)
+    if mode is None:
+        return db[name]
+    return db.get_collection(name, read_preference=getattr(ReadPreference, mode))
+
+
+def pool_statistics():
+    """Pool options and event counters for this process"""
+    options = settings.DATABASES['default'].get('CLIENT', {})
+    return {
+        'pid': os.getpid(),
+        'options': {key: value for key, value in options.items() if key not in ('username', 'password')},
+        'servers': pool_stats.snapshot(),
+    }
@@ -0,0 +1,122 @@
+"""
+Streaming exports of list endpoints as NDJSON, CSV or Parquet.
+
+An export walks one MongoDB cursor in EXPORT_BATCH_SIZE batches (see
+Repository.batches) and encodes each batch as it arrives, so a response
+holds at most one batch in memory however many rows it covers. Parquet
+output writes one row group per batch and requires pyarrow.
+"""
+import csv
+import io
+
+from rest_framework import serializers
+
+from .renderers import dumps
+
+
+def encode_json(value):
+    return dumps(value).decode()
+
+
+def flat(value):
+    """A cell value for formats without nested types"""
+    if isinstance(value, (list, dict)):
+        return encode_json(value)
+    return value
+
+
+def ndjson_chunks(fields, rows):
+    for batch in rows:
+        yield b''.join(dumps(row) + b'\n' for row in batch)
+
+
+def csv_chunks(fields, rows):
+    names = list(fields)
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(names)
+    for batch in rows:
+        writer.writerows([flat(row[name]) for name in names] for row in batch)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+class _Sink(io.RawIOBase):
+    """Write-only file that hands back whatever was written since last drained"""
+
+    def __init__(self):
+        self.chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data, self.chunks = b''.join(self.chunks), []
+        return data
+
+
+def arrow_type(field):
+    import pyarrow
+
+    if isinstance(field, serializers.BooleanField):
+        return pyarrow.bool_()
+    if isinstance(field, serializers.IntegerField):
+        return pyarrow.int64()
+    if isinstance(field, serializers.FloatField):
+        return pyarrow.float64()
+    return pyarrow.string()
+
+
+def parquet_chunks(fields, rows):
+    import pyarrow
+    import pyarrow.parquet
+
+    schema = pyarrow.schema([(name, arrow_type(field)) for name, field in fields.items()])
+    strings = [name for name, field in fields.items() if schema.field(name).type == pyarrow.string()]
+    sink = _Sink()
+    writer = pyarrow.parquet.ParquetWriter(sink, schema)
+    try:
+        for batch in rows:
+            for row in batch:
+                for name in strings:
+                    if row[name] is not None:
+                        row[name] = str(flat(row[name]))
+            writer.write_table(pyarrow.Table.from_pylist(batch, schema=schema))
+            yield sink.drain()
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+def parquet_available():
+    try:
+        import pyarrow.parquet  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+# format -> (content type, chunk encoder, available)
+FORMATS = {
+    'ndjson': ('application/x-ndjson', ndjson_chunks, lambda: True),
+    'csv': ('text/csv', csv_chunks, lambda: True),
+    'parquet': ('application/vnd.apache.parquet', parquet_chunks, parquet_available),
+}
+
+
+def stream(export_format, fields, rows):
+    """
+    Encoded chunks of an export.
+
+    `fields` maps output column names to their serializer fields, and `rows`
+    yields lists of serialized rows (one per database batch).
+    """
+    _content_type, encoder, _available = FORMATS[export_format]
+    return encoder(fields, rows)
@@ -0,0 +1,169 @@
+"""
+Declarative MongoDB indexes.
+
+Models list the indexes their queries need in a ``mongo_indexes`` attribute,
+using Django's ordering syntax for key direction::
+
+    mongo_indexes = [Index('user_id', '-date', '-_id')]
+
+djongo ignores ``Meta.indexes`` outside migrations, so these are built by the
+``sync_indexes`` management command (and by ensure_indexes() where code needs
+them to exist). audit() derives the query shapes each ViewSet can issue from
+its filters, orderings and pagination, and reports those that no declared
+index supports.
+"""
+from pymongo import ASCENDING, DESCENDING, IndexModel
+
+from .pagination import list_ordering
+from .timeseries import ensure_collection
+
+
+class Index:
+    """One compound index declared on a model"""
+
+    def __init__(self, *fields, name=None, unique=False, partial=None):
+        self.fields = fields
+        self.unique = unique
+        self.partial = partial
+        self.name = name or '_'.join(
+            f'{field.lstrip("-")}_{-1 if field.startswith("-") else 1}' for field in fields
+        )
+
+    def __repr__(self):
+        return f'Index({", ".join(map(repr, self.fields))})'
+
+    @property
+    def keys(self):
+        """[(field, direction)] as pymongo expects them"""
+        return [
+            (field[1:], DESCENDING) if field.startswith('-') else (field, ASCENDING)
+            for field in self.fields
+        ]
+
+    def model(self, background=True, timeseries=False):
+        options = {'name': self.name, 'background': background}
+        # Time-series collections cannot hold unique indexes
+        if self.unique and not timeseries:
+            options['unique'] = True
+        if self.partial:
+            options['partialFilterExpression'] = self.partial
+        return IndexModel(self.keys, **options)
+
+    def supports(self, equality, sort):
+        """
+        Whether this index serves an equality match on `equality` followed by
+        `sort` ([(field, direction)]) without an in-memory sort.
+
+        The equality fields must form the index prefix, in any order, and the
+        sort keys must follow them either in the index's direction or fully
+        reversed.
+        """
+        if self.partial:
+            return False
+        keys = self.keys
+        equality = set(equality)
+        if {field for field, _direction in keys[:len(equality)]} != equality:
+            return False
+        sort = [(field, direction) for field, direction in sort if field not in equality]
+        rest = keys[len(equality):len(equality) + len(sort)]
+        if [field for field, _direction in rest] != [field for field, _direction in sort]:
+            return False
+        same = all(a == b for (_f, a), (_g, b) in zip(rest, sort))
+        flipped = all(a == -b for (_f, a), (_g, b) in zip(rest, sort))
+        return same or flipped
+
+
+def declared(model):
+    return getattr(model, 'mongo_indexes', [])
+
+
+def ensure_indexes(db, *models, background=True):
+    """
+    Create the declared indexes of `models` that do not exist yet, by name
+    or by key pattern, first creating a time-series model's collection as
+    one (see timeseries.py).
+
+    Returns the names of the indexes created.
+    """
+    created = []
+    for model in models:
+        collection = db[model._meta.db_table]
+        timeseries = ensure_collection(db, model)
+        existing = collection.index_information()
+        names = set(existing)
+        keys = {tuple(info['key']) for info in existing.values()}
+        missing = [
+            index for index in declared(model)
+            if index.name not in names and tuple(index.keys) not in keys
+        ]
+        if missing:
+            created.extend(collection.create_indexes([index.model(background, timeseries) for index in missing]))
+    return created
+
+
+def sort_keys(ordering):
+    """Django/DRF ordering strings -> [(field, direction)]"""
+    return [
+        (name[1:], DESCENDING) if name.startswith('-') else (name, ASCENDING)
+        for name in ordering
+    ]
+
+
+def query_shapes(viewset):
+    """
+    The (equality fields, sort) pairs a ViewSet's list endpoint issues.
+
+    Covers the default ordering unfiltered and under each filterset field,
+    plus each ordering field on its own, each as list_ordering() applies it
+    at query time (with the `_id` tiebreaker).
+    """
+    default = list_ordering(viewset)
+    shapes = [((), sort_keys(default))]
+    for name in getattr(viewset, 'filterset_fields', []):
+        shapes.append(((name,), sort_keys(default)))
+    for name in getattr(viewset, 'ordering_fields', []):
+        ordering = list_ordering(viewset, f'-{name}')
+        if ordering != default:
+            shapes.append(((), sort_keys(ordering)))
+    return shapes
+
+
+# MongoDB indexes _id on every collection
+ID_INDEX = Index('_id', name='_id_')
+
+
+def audit(registry):
+    """
+    Yield (basename, model, equality, sort, supporting index or None) for
+    every query shape of every ViewSet registered on the router.
+    """
+    for _prefix, viewset, basename in registry:
+        model = viewset.queryset.model
+        candidates = [*declared(model), ID_INDEX]
+        for equality, sort in query_shapes(viewset):
+            index = next((index for index in candidates if index.supports(equality, sort)), None)
+            yield basename, model, equality, sort, index
+
+
+def explain(collection, query, sort, limit):
+    """
+    Execution stats for one query: winning plan stages, whether it sorted in
+    memory, keys and documents examined, documents returned and time taken.
+    """
+    plan = collection.find(query).sort(sort).limit(limit).explain()
+    stats = plan.get('executionStats', {})
+    stages = []
+    node = plan.get('queryPlanner', {}).get('winningPlan', {})
+    while node:
+        stages.append(node.get('stage'))
+        if 'indexName' in node:
+            stages[-1] += f'({node["indexName"]})'
+        node = node.get('inputStage') or (node.get('inputStages') or [None])[0]
+    return {
+        'plan': ' <- '.join(stage for stage in stages if stage),
+        'in_memory_sort': 'SORT' in stages,
+        'keys_examined': stats.get('totalKeysExamined'),
+        'docs_examined': stats.get('totalDocsExamined'),
+        'returned': stats.get('nReturned'),
+        'millis': stats.get('executionTimeMillis'),
+    }
@@ -0,0 +1,97 @@
+"""
+Bulk activity ingestion for wearable sync.
+
+A validated batch is written with a single ``insert_many`` and the points it
+carries are applied to users, the leaderboard and the rollups once for the
+whole batch. Activities written here bypass the model signals, so this
+module does the work those receivers would otherwise do per row.
+"""
+from collections import defaultdict
+
+from pymongo.errors import BulkWriteError
+
+from . import leaderboard, rollups, timeseries
+from .db import get_db
+from .models import Activity
+from .timeseries import DUPLICATE_KEY
+
+
+def _documents(items):
+    """Build activity documents from validated rows, filling model defaults"""
+    fields = [field for field in Activity._meta.concrete_fields if field.name != '_id']
+    for item in items:
+        document = {field.name: item.get(field.name, field.get_default()) for field in fields}
+        document['user_id'] = str(document['user_id'])
+        if not document.get('idempotency_key'):
+            document.pop('idempotency_key', None)
+        yield document
+
+
+def ingest_activities(items, db=None):
+    """
+    Insert a batch of validated activities.
+
+    Rows whose idempotency key is repeated within the batch or already stored
+    are skipped. Returns (inserted ids, number of duplicates skipped).
+
+    The unique idempotency_key index settles races between concurrent
+    batches; time-series storage has none, so there the keys are claimed
+    first (see timeseries.claim_keys()).
+    """
+    db = db if db is not None else get_db()
+    documents = list(_documents(items))
+
+    keys = [doc['idempotency_key'] for doc in documents if 'idempotency_key' in doc]
+    seen = set()
+    if keys:
+        seen.update(
+            row['idempotency_key']
+            for row in db.activities.find({'idempotency_key': {'$in': keys}}, {'idempotency_key': 1})
+        )
+    batch = []
+    for doc in documents:
+        key = doc.get('idempotency_key')
+        if key is not None:
+            if key in seen:
+                continue
+            seen.add(key)
+        batch.append(doc)
+
+    claimed = set()
+    if keys and timeseries.is_timeseries(db.activities):
+        claimed = timeseries.claim_keys(db, [doc['idempotency_key'] for doc in batch if 'idempotency_key' in doc])
+        batch = [doc for doc in batch if 'idempotency_key' not in doc or doc['idempotency_key'] in claimed]
+
+    # One users query fills team_id for every row that did not carry one
+    user_ids = {doc['user_id'] for doc in batch if not doc.get('team_id')}
+    if user_ids:
+        variants = [variant for user_id in user_ids for variant in leaderboard.id_variants(user_id)]
+        teams = {
+            str(user['_id']): user.get('team') or ''
+            for user in db.users.find({'_id': {'$in': variants}}, {'team': 1})
+        }
+        for doc in batch:
+            if not doc.get('team_id'):
+                doc['team_id'] = teams.get(doc['user_id'], '')
+
+    inserted = batch
+    if batch:
+        try:
+            db.activities.insert_many(batch, ordered=False)
+        except BulkWriteError as exc:
+            # A concurrent batch stored the same key first; anything else is real
+            errors = exc.details.get('writeErrors', [])
+            failed = {error['index'] for error in errors}
+            if any(error['code'] != DUPLICATE_KEY for error in errors):
+                # Free the keys of rows not stored so a retry can write them
+                timeseries.release_unstored(db.activities, 'idempotency_key', claimed)
+                raise
+            inserted = [doc for index, doc in enumerate(batch) if index not in failed]
+
+    deltas = defaultdict(int)
+    for doc in inserted:
+        deltas[doc['user_id']] += doc.get('points_earned') or 0
+    leaderboard.apply_deltas(deltas, db)
+    rollups.apply(added=inserted, db=db)
+
+    return [str(doc['_id']) for doc in inserted], len(documents) - len(inserted)
@@ -0,0 +1,274 @@
+"""
+Per-request instrumentation.
+
+The middleware records, for every request, the MongoDB round trips and their
+server time (db.command_stats), the time spent serializing (serializers
+report it through timed()), the response size and the total latency. Each
+response carries them as a ``Server-Timing`` header, and /metrics exposes the
+per-view totals in the Prometheus text format. Counters are per process, so
+each worker is scraped separately.
+
+With PROFILE_SAMPLE_RATE above zero, that fraction of sync requests also runs
+under cProfile; /metrics/profile/ prints the aggregated hottest functions
+(staff or DEBUG only). Async views are timed but not profiled, and round trips
+motor makes from its own thread pool are not attributed to a request.
+"""
+import asyncio
+import cProfile
+import io
+import pstats
+import random
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+from django.utils.decorators import sync_and_async_middleware
+
+from .db import command_stats
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+DB_COMMAND_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+_current = ContextVar('request_timings', default=None)
+
+
+class RequestTimings:
+    """Phase durations (ms) accumulated while one request is handled"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = defaultdict(float)
+        command_stats.reset()
+
+    def add(self, phase, seconds):
+        self.phases[phase] += seconds * 1000
+
+    def finish(self, response):
+        """Final measurements as a dict, and the Server-Timing header on `response`"""
+        db_commands, db_ms = command_stats.snapshot()
+        total_ms = (time.perf_counter() - self.started) * 1000
+        serialize_ms = self.phases['serialize']
+        if response.streaming:
+            size = int(response.get('Content-Length', 0))
+        else:
+            size = len(response.content)
+        response['Server-Timing'] = ', '.join([
+            f'db;dur={db_ms:.1f};desc="{db_commands} round trips"',
+            f'serialize;dur={serialize_ms:.1f}',
+            f'total;dur={total_ms:.1f}',
+        ])
+        return {
+            'db_commands': db_commands,
+            'db_ms': db_ms,
+            'serialize_ms': serialize_ms,
+            'total_ms': total_ms,
+            'response_bytes': size,
+        }
+
+
+def current():
+    """The timings of the request being handled, or None"""
+    return _current.get()
+
+
+@contextmanager
+def timed(phase):
+    """Add the time spent in the block to `phase` of the current request"""
+    timings = _current.get()
+    if timings is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(phase, time.perf_counter() - started)
+
+
+class Histogram:
+    """Cumulative Prometheus histogram buckets with a sum and count"""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def lines(self, name, labels):
+        cumulative = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            cumulative += count
+            yield f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}'
+        yield f'{name}_sum{{{labels}}} {self.sum:.6f}'
+        yield f'{name}_count{{{labels}}} {cumulative}'
+
+
+class Metrics:
+    """Per-view request metrics for this process"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.requests = defaultdict(int)
+            self.latency = {}
+            self.db_commands = {}
+            self.totals = defaultdict(lambda: defaultdict(float))
+
+    def observe(self, view, method, status, measured):
+        with self._lock:
+            self.requests[view, method, status] += 1
+            if view not in self.latency:
+                self.latency[view] = Histogram(LATENCY_BUCKETS)
+                self.db_commands[view] = Histogram(DB_COMMAND_BUCKETS)
+            self.latency[view].observe(measured['total_ms'] / 1000)
+            self.db_commands[view].observe(measured['db_commands'])
+            totals = self.totals[view]
+            totals['db_seconds'] += measured['db_ms'] / 1000
+            totals['serialize_seconds'] += measured['serialize_ms'] / 1000
+            totals['response_bytes'] += measured['response_bytes']
+
+    def render(self):
+        """The metrics in the Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            lines += ['# HELP octofit_requests_total Requests handled.',
+                      '# TYPE octofit_requests_total counter']
+            for (view, method, status), count in sorted(self.requests.items()):
+                lines.append(f'octofit_requests_total{{view="{view}",method="{method}",status="{status}"}} {count}')
+
+            lines += ['# HELP octofit_request_duration_seconds Time from first middleware to response.',
+                      '# TYPE octofit_request_duration_seconds histogram']
+            for view, histogram in sorted(self.latency.items()):
+                lines += histogram.lines('octofit_request_duration_seconds', f'view="{view}"')
+
+            lines += ['# HELP octofit_db_commands_per_request MongoDB round trips per request.',
+                      '# TYPE octofit_db_commands_per_request histogram']
+            for view, histogram in sorted(self.db_commands.items()):
+                lines += histogram.lines('octofit_db_commands_per_request', f'view="{view}"')
+
+            for total, help_text in (
+                ('db_seconds', 'MongoDB server time spent on requests.'),
+                ('serialize_seconds', 'Time spent serializing responses.'),
+                ('response_bytes', 'Response body bytes (excluding streamed bodies without a length).'),
+            ):
+                name = f'octofit_{total}_total'
+                lines += [f'# HELP {name} {help_text}', f'# TYPE {name} counter']
+                for view, totals in sorted(self.totals.items()):
+                    lines.append(f'{name}{{view="{view}"}} {totals[total]:.6f}')
+        return '\n'.join(lines) + '\n'
+
+
+class Profiles:
+    """cProfile statistics aggregated over the sampled requests"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.stats = None
+            self.samples = 0
+
+    def add(self, profile):
+        profile.create_stats()
+        with self._lock:
+            if self.stats is None:
+                self.stats = pstats.Stats(profile)
+            else:
+                self.stats.add(profile)
+            self.samples += 1
+
+    def dump(self, sort='cumulative', limit=40):
+        """The `limit` hottest functions by `sort`, with their callers"""
+        with self._lock:
+            if self.stats is None:
+                return 'No requests profiled yet.\n'
+            out = io.StringIO()
+            self.stats.stream = out
+            out.write(f'{self.samples} sampled requests\n')
+            self.stats.sort_stats(sort).print_stats(limit)
+            self.stats.print_callers(limit)
+            return out.getvalue()
+
+
+metrics = Metrics()
+profiles = Profiles()
+
+
+def view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match is not None else 'unmatched'
+
+
+def record(request, response, timings):
+    measured = timings.finish(response)
+    metrics.observe(view_name(request), request.method, response.status_code, measured)
+    return response
+
+
+@sync_and_async_middleware
+def instrumentation_middleware(get_response):
+    """Time every request; profile a sample of sync ones"""
+    if asyncio.iscoroutinefunction(get_response):
+        async def middleware(request):
+            timings = RequestTimings()
+            token = _current.set(timings)
+            try:
+                response = await get_response(request)
+            finally:
+                _current.reset(token)
+            return record(request, response, timings)
+        return middleware
+
+    def middleware(request):
+        timings = RequestTimings()
+        token = _current.set(timings)
+        try:
+            if settings.PROFILE_SAMPLE_RATE and random.random() < settings.PROFILE_SAMPLE_RATE:
+                profile = cProfile.Profile()
+                response = profile.runcall(get_response, request)
+                profiles.add(profile)
+            else:
+                response = get_response(request)
+        finally:
+            _current.reset(token)
+        return record(request, response, timings)
+    return middleware
+
+
+def metrics_view(request):
+    """Prometheus scrape endpoint"""
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+def profile_view(request):
+    """
+    Aggregated profile of the sampled requests as pstats text.
+    ?sort= is a pstats sort key (default cumulative), ?limit= the number of
+    functions and ?reset=1 clears the samples after printing.
+    """
+    if not (settings.DEBUG or request.user.is_staff):
+        return HttpResponseForbidden()
+    sort = request.GET.get('sort', 'cumulative')
+    if sort not in pstats.Stats.sort_arg_dict_default:
+        sort = 'cumulative'
+    try:
+        limit = int(request.GET.get('limit', 40))
+    except ValueError:
+        limit = 40
+    text = profiles.dump(sort, limit)
+    if request.GET.get('reset'):
+        profiles.reset()
+    return HttpResponse(text, content_type='text/plain; charset=utf-8')
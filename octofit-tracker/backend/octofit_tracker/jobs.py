@@ -0,0 +1,281 @@
+"""
+Background jobs persisted in MongoDB.
+
+Recomputes that are too heavy for a request (leaderboard rebuilds, rollup
+rebuilds, recalculating users' total_points) are enqueued as documents in the
+``jobs`` collection and run by ``run_jobs`` workers, each a pool of threads
+claiming jobs with find_one_and_update.
+
+- Deduplication: a queued job carries its ``pending_key`` (name + arguments)
+  under a unique partial index, so enqueueing work that is already queued
+  returns the existing job. Enqueueing with a delay therefore coalesces a
+  burst of writes into one run.
+- Retries: a failing job is requeued with exponential backoff until
+  ``max_attempts``, then marked failed.
+- Leases: a claimed job is locked for JOB_LEASE_SECONDS and the lease is
+  renewed while it runs, so only a job whose worker died is claimed again
+  once its lease expires.
+"""
+import json
+import logging
+import os
+import socket
+import threading
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from pymongo import ASCENDING, ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+from . import leaderboard, rollups
+from .db import get_db
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+COLLECTION = Job._meta.db_table
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+SUPERSEDED = 'superseded'  # failed, but an identical job was queued meanwhile
+STATUSES = (QUEUED, RUNNING, DONE, FAILED, SUPERSEDED)
+
+TASKS = {}
+
+
+def task(name):
+    """Register a function as the job `name`; it is called as fn(db, **args)"""
+    def register(fn):
+        TASKS[name] = fn
+        return fn
+    return register
+
+
+def job_key(name, args):
+    return f'{name}:{json.dumps(args, sort_keys=True, separators=(",", ":"))}'
+
+
+def enqueue(name, delay=0, max_attempts=None, db=None, **args):
+    """
+    Queue job `name` with keyword `args` to run after `delay` seconds.
+    Returns the id of the queued job, which is an existing one when the same
+    job is already waiting.
+    """
+    if name not in TASKS:
+        raise KeyError(f'Unknown job: {name}')
+    db = db if db is not None else get_db()
+    now = timezone.now()
+    key = job_key(name, args)
+    document = {
+        'name': name,
+        'args': args,
+        'key': key,
+        'pending_key': key,
+        'status': QUEUED,
+        'attempts': 0,
+        'max_attempts': max_attempts or settings.JOB_MAX_ATTEMPTS,
+        'run_after': now + timedelta(seconds=delay),
+        'locked_by': '',
+        'locked_until': None,
+        'last_error': '',
+        'created_at': now,
+        'finished_at': None,
+    }
+    try:
+        return db[COLLECTION].insert_one(document).inserted_id
+    except DuplicateKeyError:
+        existing = db[COLLECTION].find_one({'pending_key': key}, {'_id': 1})
+        if existing is None:
+            # Claimed between the insert and the lookup: queue it again
+            return enqueue(name, delay, max_attempts, db, **args)
+        return existing['_id']
+
+
+def claim(worker, db=None):
+    """Lock the next due job for `worker`, or return None"""
+    db = db if db is not None else get_db()
+    now = timezone.now()
+    return db[COLLECTION].find_one_and_update(
+        {'$or': [
+            {'status': QUEUED, 'run_after': {'$lte': now}},
+            # Lease expired: the worker died. Give up once out of attempts.
+            {'status': RUNNING, 'locked_until': {'$lt': now}, '$expr': {'$lt': ['$attempts', '$max_attempts']}},
+        ]},
+        {
+            '$set': {
+                'status': RUNNING,
+                'locked_by': worker,
+                'locked_until': now + timedelta(seconds=settings.JOB_LEASE_SECONDS),
+            },
+            '$unset': {'pending_key': ''},
+            '$inc': {'attempts': 1},
+        },
+        sort=[('run_after', ASCENDING)],
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+def heartbeat(job, db, stopping):
+    """Renew a running job's lease every third of JOB_LEASE_SECONDS until `stopping` is set"""
+    lease = timedelta(seconds=settings.JOB_LEASE_SECONDS)
+    while not stopping.wait(settings.JOB_LEASE_SECONDS / 3):
+        try:
+            db[COLLECTION].update_one(
+                {'_id': job['_id'], 'status': RUNNING, 'locked_by': job['locked_by']},
+                {'$set': {'locked_until': timezone.now() + lease}}
+            )
+        except Exception:
+            logger.exception('Could not renew the lease of job %s', job['_id'])
+
+
+def run(job, db=None):
+    """Run a claimed job and record its outcome; returns the final status"""
+    db = db if db is not None else get_db()
+    jobs = db[COLLECTION]
+    stopping = threading.Event()
+    renewer = threading.Thread(
+        target=heartbeat, args=(job, db, stopping), name=f'job-lease-{job["_id"]}', daemon=True
+    )
+    renewer.start()
+    try:
+        TASKS[job['name']](db, **job['args'])
+    except Exception:
+        error = traceback.format_exc()
+        logger.exception('Job %s (%s) failed', job['_id'], job['name'])
+        if job['attempts'] >= job['max_attempts']:
+            jobs.update_one({'_id': job['_id']}, {'$set': {
+                'status': FAILED, 'last_error': error, 'finished_at': timezone.now(),
+            }})
+            return FAILED
+        backoff = settings.JOB_RETRY_DELAY * 2 ** (job['attempts'] - 1)
+        try:
+            jobs.update_one({'_id': job['_id']}, {'$set': {
+                'status': QUEUED, 'pending_key': job['key'], 'last_error': error,
+                'run_after': timezone.now() + timedelta(seconds=backoff),
+            }})
+        except DuplicateKeyError:
+            jobs.update_one({'_id': job['_id']}, {'$set': {
+                'status': SUPERSEDED, 'last_error': error, 'finished_at': timezone.now(),
+            }})
+            return SUPERSEDED
+        return QUEUED
+    finally:
+        stopping.set()
+        renewer.join()
+    jobs.update_one({'_id': job['_id']}, {'$set': {
+        'status': DONE, 'last_error': '', 'finished_at': timezone.now(),
+    }})
+    return DONE
+
+
+def run_pending(worker='inline', db=None):
+    """Run due jobs on this thread until none are left; returns how many ran"""
+    count = 0
+    while True:
+        job = claim(worker, db)
+        if job is None:
+            return count
+        run(job, db)
+        count += 1
+
+
+def queue_depth(db=None):
+    """Job counts by status, plus the number of queued jobs already due"""
+    db = db if db is not None else get_db()
+    # One index count per status rather than a $group over every job ever run
+    depth = {status: db[COLLECTION].count_documents({'status': status}) for status in STATUSES}
+    depth['due'] = db[COLLECTION].count_documents(
+        {'status': QUEUED, 'run_after': {'$lte': timezone.now()}}
+    )
+    return depth
+
+
+class WorkerPool:
+    """Threads in this process that claim and run jobs until stopped"""
+
+    def __init__(self, size, poll_interval=None, burst=False):
+        self.size = size
+        self.poll_interval = poll_interval if poll_interval is not None else settings.JOB_POLL_INTERVAL
+        self.burst = burst
+        self.stopping = threading.Event()
+        self.threads = []
+        self.name = f'{socket.gethostname()}:{os.getpid()}'
+
+    def work(self, index):
+        worker = f'{self.name}:{index}'
+        while not self.stopping.is_set():
+            try:
+                job = claim(worker)
+            except Exception:
+                logger.exception('Could not claim a job')
+                job = None
+            if job is not None:
+                run(job)
+                continue
+            if self.burst:
+                return
+            self.stopping.wait(self.poll_interval)
+
+    def start(self):
+        for index in range(self.size):
+            thread = threading.Thread(target=self.work, args=(index,), name=f'job-worker-{index}', daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self):
+        self.stopping.set()
+
+    def join(self):
+        for thread in self.threads:
+            while thread.is_alive():
+                thread.join(0.5)
+
+
+@task('rebuild_leaderboard')
+def rebuild_leaderboard(db):
+    leaderboard.rebuild(db)
+
+
+@task('rebuild_rollups')
+def rebuild_rollups(db, since=None):
+    rollups.rebuild(db, since=parse_date(since) if since else None)
+
+
+@task('recalculate_user_points')
+def recalculate_user_points(db, user_id=None, batch_size=1000):
+    """
+    Reset total_points to the sum of each user's activity points, then queue
+    a leaderboard rebuild if any user changed.
+    """
+    match = {'user_id': {'$in': leaderboard.id_variants(user_id)}} if user_id else {}
+    totals = {
+        row['_id']: row['points']
+        for row in db.activities.aggregate([
+            {'$match': match},
+            {'$group': {'_id': {'$toString': '$user_id'}, 'points': {'$sum': '$points_earned'}}},
+        ])
+    }
+    users = db.users.find(
+        {'_id': {'$in': leaderboard.id_variants(user_id)}} if user_id else {},
+        {'total_points': 1}
+    )
+    updates = []
+    changed = 0
+    for user in users:
+        points = totals.get(str(user['_id']), 0)
+        if user.get('total_points') != points:
+            updates.append(UpdateOne({'_id': user['_id']}, {'$set': {'total_points': points}}))
+        if len(updates) >= batch_size:
+            changed += db.users.bulk_write(updates, ordered=False).modified_count
+            updates = []
+    if updates:
+        changed += db.users.bulk_write(updates, ordered=False).modified_count
+    if changed:
+        enqueue('rebuild_leaderboard', db=db)
+    return changed
+
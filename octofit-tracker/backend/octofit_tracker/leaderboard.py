@@ -0,0 +1,325 @@
+"""
+Incrementally maintained leaderboard.
+
+Activity writes are reduced to per-user point deltas. Each delta is applied to
+the user with ``$inc`` and only the leaderboard rows whose rank actually moves
+are shifted, so a write costs one range update instead of a full recompute.
+"""
+import threading
+import time
+import uuid
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import timedelta, timezone as dt_timezone
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from django.conf import settings
+from django.utils import timezone
+from pymongo import DESCENDING, ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from . import indexes, queries, response_cache
+from .pubsub import get_pubsub
+from .db import get_db
+from .models import Leaderboard, User
+
+INDIVIDUAL = 'individual'
+TEAM = 'team'
+
+# Pub/sub channel told which boards a write changed (see live.py)
+CHANNEL = 'leaderboard'
+
+# Rank shifts read and then move neighbouring rows, so writers on the same
+# board must not interleave: within a process they take _lock, and across
+# processes (web workers, run_jobs, commands) the lease in LOCKS.
+_lock = threading.Lock()
+
+LOCKS = 'leaderboard_locks'
+LOCK_ID = 'boards'
+# Users and teams written while a rebuild runs, settled before it swaps in
+TOUCHED = 'leaderboard_touched'
+# Prefix of the collection each rebuild writes the new boards to
+REBUILD_COLLECTION = 'leaderboard_rebuild'
+
+
+def id_variants(value):
+    """Return every form an id may be stored as (string and ObjectId)"""
+    variants = [str(value)]
+    try:
+        variants.append(ObjectId(str(value)))
+    except (InvalidId, TypeError):
+        pass
+    return variants
+
+
+def _move(collection, board, key_field, key, delta, defaults, total):
+    """
+    Apply delta to one row of a board and shift only the rows it passes.
+
+    A missing row is created from `total()`, the key's real total with the
+    delta already in it, and placed after every row with at least as many
+    points.
+    """
+    query = {'type': board, key_field: {'$in': id_variants(key)}}
+    row = collection.find_one(query, {'rank': 1, 'total_points': 1})
+    now = timezone.now()
+    if row is None:
+        points = total()
+        new_rank = collection.count_documents({'type': board, 'total_points': {'$gte': points}}) + 1
+        # Rows with fewer points now rank below the new one
+        collection.update_many({'type': board, 'total_points': {'$lt': points}}, {'$inc': {'rank': 1}})
+        collection.insert_one({
+            **defaults, 'type': board, key_field: str(key),
+            'total_points': points, 'rank': new_rank, 'updated_at': now,
+        })
+        return
+
+    old_rank = row['rank']
+    old_points = row.get('total_points', 0)
+    new_points = old_points + delta
+    new_rank = old_rank
+    if new_points > old_points:
+        # Rows ranked above us that we now overtake drop one place
+        shifted = collection.update_many(
+            {'type': board, 'rank': {'$lt': old_rank}, 'total_points': {'$lt': new_points}},
+            {'$inc': {'rank': 1}}
+        )
+        new_rank -= shifted.modified_count
+    elif new_points < old_points:
+        # Rows ranked below us that now overtake us climb one place
+        shifted = collection.update_many(
+            {'type': board, 'rank': {'$gt': old_rank}, 'total_points': {'$gt': new_points}},
+            {'$inc': {'rank': -1}}
+        )
+        new_rank += shifted.modified_count
+
+    collection.update_one({'_id': row['_id']}, {'$set': {
+        'total_points': new_points, 'rank': new_rank, 'updated_at': now,
+    }})
+
+
+@contextmanager
+def board_lock(db):
+    """
+    Hold the cross-process board lock; yields whether a rebuild is running.
+
+    The lock is a lease, so a holder that dies frees it after
+    LEADERBOARD_LOCK_SECONDS.
+    """
+    owner = uuid.uuid4().hex
+    lease = timedelta(seconds=settings.LEADERBOARD_LOCK_SECONDS)
+    deadline = time.monotonic() + settings.LEADERBOARD_LOCK_SECONDS
+    while True:
+        now = timezone.now()
+        try:
+            lock = db[LOCKS].find_one_and_update(
+                {'_id': LOCK_ID, '$or': [{'owner': None}, {'until': {'$lt': now}}]},
+                {'$set': {'owner': owner, 'until': now + lease}},
+                upsert=True, return_document=ReturnDocument.AFTER
+            )
+            break
+        except DuplicateKeyError:
+            # Held by someone else: the upsert collided with the existing lock
+            if time.monotonic() > deadline:
+                raise TimeoutError('Timed out waiting for the leaderboard lock')
+            time.sleep(0.01)
+    until = lock.get('rebuilding_until')
+    if until is not None and timezone.is_naive(until):
+        until = timezone.make_aware(until, dt_timezone.utc)
+    try:
+        yield until is not None and until > now
+    finally:
+        db[LOCKS].update_one({'_id': LOCK_ID, 'owner': owner}, {'$set': {'owner': None}})
+
+
+def notify(*boards):
+    """Tell live streams that these boards changed"""
+    get_pubsub().publish(CHANNEL, {'boards': list(boards)})
+
+
+def apply_deltas(deltas, db=None, increment_users=True):
+    """
+    Apply a mapping of user id -> points delta to users and both boards.
+
+    Deltas are summed per team so a batch touching many members of one team
+    moves that team's row once. With increment_users=False the users'
+    total_points already include the deltas and only the boards move.
+    """
+    deltas = {str(user_id): delta for user_id, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    db = db if db is not None else get_db()
+
+    team_deltas = defaultdict(int)
+    touched = []
+    with _lock, board_lock(db) as rebuilding:
+        for user_id, delta in deltas.items():
+            query = {'_id': {'$in': id_variants(user_id)}}
+            projection = {'name': 1, 'alias': 1, 'team': 1, 'total_points': 1}
+            if increment_users:
+                user = db.users.find_one_and_update(
+                    query, {'$inc': {'total_points': delta}},
+                    projection=projection, return_document=ReturnDocument.AFTER
+                )
+            else:
+                user = db.users.find_one(query, projection)
+            if user is None:
+                # Activity logged against an unknown user: nothing to rank
+                continue
+            _move(db.leaderboard, INDIVIDUAL, 'user_id', user['_id'], delta, {
+                'user_name': user.get('name', ''),
+                'user_alias': user.get('alias', ''),
+                'team': user.get('team', ''),
+            }, lambda: user.get('total_points', 0))
+            touched.append({'type': INDIVIDUAL, 'key': user['_id']})
+            if user.get('team'):
+                team_deltas[user['team']] += delta
+
+        for team_id, delta in team_deltas.items():
+            if not delta:
+                continue
+            touched.append({'type': TEAM, 'key': team_id})
+            team = db.teams.find_one({'_id': team_id}, {'name': 1, 'member_count': 1}) or {}
+            _move(db.leaderboard, TEAM, 'team_id', team_id, delta, {
+                'team_name': team.get('name', team_id),
+                'member_count': team.get('member_count', 0),
+            }, lambda: queries.team_total(team_id, db))
+        if rebuilding and touched:
+            db[TOUCHED].insert_many(touched, ordered=False)
+    response_cache.invalidate(response_cache.LEADERBOARD)
+    notify(INDIVIDUAL, *([TEAM] if any(team_deltas.values()) else []))
+
+
+def _individual_defaults(user):
+    return {
+        'user_name': user.get('name', ''),
+        'user_alias': user.get('alias', ''),
+        'team': user.get('team', ''),
+    }
+
+
+def _settle(db, collection, touched):
+    """Bring the rows of users and teams written during a rebuild up to date on `collection`"""
+    for board, key in {(entry['type'], entry['key']) for entry in touched}:
+        if board == INDIVIDUAL:
+            user = db.users.find_one({'_id': key}, {'name': 1, 'alias': 1, 'team': 1, 'total_points': 1})
+            if user is None:
+                continue
+            key_field, truth, defaults = 'user_id', user.get('total_points', 0), _individual_defaults(user)
+        else:
+            team = db.teams.find_one({'_id': key}, {'name': 1, 'member_count': 1}) or {}
+            key_field, truth = 'team_id', queries.team_total(key, db)
+            defaults = {'team_name': team.get('name', key), 'member_count': team.get('member_count', 0)}
+        row = collection.find_one({'type': board, key_field: {'$in': id_variants(key)}}, {'total_points': 1})
+        if row is None or row.get('total_points', 0) != truth:
+            delta = truth - (row.get('total_points', 0) if row else 0)
+            _move(collection, board, key_field, key, delta, defaults, lambda: truth)
+
+
+def _renew(db, owner):
+    """Extend the lease of rebuild `owner`; False once another rebuild has taken over"""
+    until = timezone.now() + timedelta(seconds=settings.LEADERBOARD_REBUILD_LEASE_SECONDS)
+    renewed = db[LOCKS].update_one(
+        {'_id': LOCK_ID, 'rebuild_owner': owner}, {'$set': {'rebuilding_until': until}}
+    )
+    return renewed.matched_count == 1
+
+
+def rebuild(db=None, batch_size=5000):
+    """
+    Recompute both boards from users' total_points.
+
+    Used to seed the leaderboard and to repair it; regular writes go through
+    apply_deltas(). Users are streamed in rank order and written in batches
+    to a collection of this rebuild's own, so memory does not grow with the
+    number of users, and the finished boards replace the live ones in one
+    rename: readers never see a partial board. Writers keep going meanwhile
+    and note what they touch; those rows are settled on the new boards, under
+    the lock, just before the swap. Returns the number of rows written.
+
+    The rebuild holds a lease of LEADERBOARD_REBUILD_LEASE_SECONDS, renewed
+    with every batch, so one whose process died stops blocking the next
+    within that time. A rebuild that finds its lease taken over gives up
+    without swapping.
+    """
+    db = db if db is not None else get_db()
+    now = timezone.now()
+    written = 0
+    owner = uuid.uuid4().hex
+    target = db[f'{REBUILD_COLLECTION}_{owner}']
+
+    def flush(entries):
+        nonlocal written
+        if not _renew(db, owner):
+            raise RuntimeError('The leaderboard rebuild lease was taken over')
+        if entries:
+            target.insert_many(entries, ordered=False)
+            written += len(entries)
+            entries.clear()
+
+    # The rank stream below relies on these
+    indexes.ensure_indexes(db, User, Leaderboard)
+    with _lock, board_lock(db) as rebuilding:
+        if rebuilding:
+            # Raised in a job, this retries it with backoff
+            raise RuntimeError('A leaderboard rebuild is already running')
+        # Writes from here on are noted in TOUCHED
+        until = now + timedelta(seconds=settings.LEADERBOARD_REBUILD_LEASE_SECONDS)
+        db[LOCKS].update_one({'_id': LOCK_ID}, {'$set': {'rebuild_owner': owner, 'rebuilding_until': until}})
+        db[TOUCHED].delete_many({})
+    try:
+        # Boards left behind by rebuilds that died
+        for name in db.list_collection_names():
+            if name.startswith(f'{REBUILD_COLLECTION}_'):
+                db.drop_collection(name)
+        entries = []
+        users = db.users.find(
+            {}, {'name': 1, 'alias': 1, 'team': 1, 'total_points': 1}
+        ).sort([('total_points', DESCENDING), ('_id', DESCENDING)])
+        for rank, user in enumerate(users, start=1):
+            entries.append({
+                'user_id': str(user['_id']),
+                **_individual_defaults(user),
+                'total_points': user.get('total_points', 0),
+                'rank': rank,
+                'type': INDIVIDUAL,
+                'updated_at': now,
+            })
+            if len(entries) >= batch_size:
+                flush(entries)
+
+        for rank, totals in enumerate(queries.team_points(db), start=1):
+            team = db.teams.find_one({'_id': totals['_id']}, {'name': 1}) or {}
+            entries.append({
+                'team_id': totals['_id'],
+                'team_name': team.get('name', totals['_id']),
+                'total_points': totals['total_points'],
+                'rank': rank,
+                'type': TEAM,
+                'member_count': totals['member_count'],
+                'updated_at': now,
+            })
+        flush(entries)
+        target.create_indexes([index.model() for index in Leaderboard.mongo_indexes])
+
+        with _lock, board_lock(db):
+            if not _renew(db, owner):
+                raise RuntimeError('The leaderboard rebuild lease was taken over')
+            _settle(db, target, db[TOUCHED].find())
+            if written:
+                target.rename(Leaderboard._meta.db_table, dropTarget=True)
+            else:
+                db.leaderboard.delete_many({})
+    finally:
+        # A no-op once renamed
+        target.drop()
+        released = db[LOCKS].update_one(
+            {'_id': LOCK_ID, 'rebuild_owner': owner},
+            {'$set': {'rebuild_owner': None, 'rebuilding_until': None}}
+        )
+        if released.matched_count:
+            db[TOUCHED].delete_many({})
+    response_cache.invalidate(response_cache.LEADERBOARD)
+    notify(INDIVIDUAL, TEAM)
+    return written
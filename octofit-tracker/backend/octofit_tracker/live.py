@@ -0,0 +1,224 @@
+"""
+Live leaderboard over Server-Sent Events and WebSockets.
+
+Clients connect to /api/stream/leaderboard/?board=individual|team (an
+EventSource, or a WebSocket to the same path) instead of polling top_ten.
+They receive a ``snapshot`` of the top LIVE_LEADERBOARD_SIZE rows, then a
+``delta`` with only the rows whose rank or points changed, plus the ids that
+dropped out.
+
+Leaderboard writes publish the boards they touched on the pub/sub channel.
+Each worker keeps one feed per board: the first change after a quiet period
+is pushed straight away, and changes arriving within LIVE_LEADERBOARD_INTERVAL
+of a push are coalesced into the next one. The board is read once per push,
+however many clients are connected.
+
+This is a raw ASGI application mounted by asgi.py, so connections wait on the
+event loop rather than holding a thread each.
+"""
+import asyncio
+import json
+import weakref
+from urllib.parse import parse_qs
+
+from django.conf import settings
+from rest_framework.utils.encoders import JSONEncoder
+
+from .db import get_async_db, read_collection
+from .leaderboard import CHANNEL, INDIVIDUAL, TEAM
+from .pubsub import get_pubsub
+
+PATH = '/api/stream/leaderboard/'
+
+# board -> field identifying a row, field naming it
+ROW_KEYS = {
+    INDIVIDUAL: ('user_id', 'user_alias'),
+    TEAM: ('team_id', 'team_name'),
+}
+
+_feeds = weakref.WeakKeyDictionary()
+
+
+async def fetch(board):
+    """Top rows of a board as [{'id', 'name', 'rank', 'total_points'}]"""
+    key, name = ROW_KEYS[board]
+    collection = read_collection('leaderboard', get_async_db())
+    documents = await collection.find(
+        {'type': board}, {key: 1, name: 1, 'rank': 1, 'total_points': 1}
+    ).sort('rank', 1).limit(settings.LIVE_LEADERBOARD_SIZE).to_list(None)
+    return [
+        {
+            'id': str(document.get(key)),
+            'name': document.get(name, ''),
+            'rank': document['rank'],
+            'total_points': document.get('total_points', 0),
+        }
+        for document in documents
+    ]
+
+
+def diff(previous, current):
+    """
+    (changed rows, removed ids) between two snapshots.
+
+    Changed rows are the current rows that are new or whose rank, name or
+    points differ, each with its ``previous_rank`` (None when new).
+    """
+    before = {row['id']: row for row in previous}
+    changed = [
+        {**row, 'previous_rank': before[row['id']]['rank'] if row['id'] in before else None}
+        for row in current
+        if before.get(row['id']) != row
+    ]
+    current_ids = {row['id'] for row in current}
+    removed = [row_id for row_id in before if row_id not in current_ids]
+    return changed, removed
+
+
+class BoardFeed:
+    """The coalesced view of one board shared by this worker's clients"""
+
+    def __init__(self, board):
+        self.board = board
+        self.rows = []
+        self.version = 0
+        self.clients = set()
+        self._task = None
+        self._starting = asyncio.Lock()
+
+    def snapshot(self):
+        return {'event': 'snapshot', 'board': self.board, 'version': self.version, 'rows': self.rows}
+
+    async def connect(self):
+        """Register a client; returns the queue its messages arrive on"""
+        queue = asyncio.Queue(maxsize=100)
+        async with self._starting:
+            if self._task is None or self._task.done():
+                self.rows = await fetch(self.board)
+                self._task = asyncio.ensure_future(self._run())
+        self.clients.add(queue)
+        queue.put_nowait(self.snapshot())
+        return queue
+
+    def disconnect(self, queue):
+        self.clients.discard(queue)
+        if not self.clients and self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def broadcast(self, message):
+        for queue in self.clients:
+            try:
+                queue.put_nowait(message)
+            except asyncio.QueueFull:
+                # A client too slow to keep up skips to the current state
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(self.snapshot())
+
+    async def _run(self):
+        changed = asyncio.Event()
+
+        async def watch():
+            async for message in get_pubsub().listen(CHANNEL):
+                if self.board in message.get('boards', ()):
+                    changed.set()
+
+        watcher = asyncio.ensure_future(watch())
+        try:
+            while True:
+                await changed.wait()
+                changed.clear()
+                rows = await fetch(self.board)
+                updated, removed = diff(self.rows, rows)
+                if updated or removed:
+                    self.rows = rows
+                    self.version += 1
+                    self.broadcast({
+                        'event': 'delta', 'board': self.board, 'version': self.version,
+                        'rows': updated, 'removed': removed,
+                    })
+                await asyncio.sleep(settings.LIVE_LEADERBOARD_INTERVAL)
+        finally:
+            watcher.cancel()
+
+
+def get_feed(board):
+    """This event loop's feed for a board"""
+    feeds = _feeds.setdefault(asyncio.get_running_loop(), {})
+    if board not in feeds:
+        feeds[board] = BoardFeed(board)
+    return feeds[board]
+
+
+def encode(message):
+    return json.dumps(message, cls=JSONEncoder)
+
+
+async def pump(queue, emit, disconnected):
+    """Emit queued messages until `disconnected` resolves, with keepalives"""
+    while True:
+        get = asyncio.ensure_future(queue.get())
+        done, _pending = await asyncio.wait(
+            {get, disconnected}, timeout=settings.LIVE_KEEPALIVE, return_when=asyncio.FIRST_COMPLETED
+        )
+        if get in done:
+            await emit(get.result())
+        else:
+            get.cancel()
+        if disconnected in done:
+            return
+        if not done:
+            await emit(None)
+
+
+async def leaderboard_stream(scope, receive, send):
+    """ASGI application serving the stream over SSE (http) or WebSocket"""
+    board = parse_qs(scope.get('query_string', b'').decode()).get('board', [INDIVIDUAL])[0]
+
+    if scope['type'] == 'websocket':
+        await receive()  # websocket.connect
+        if board not in ROW_KEYS:
+            await send({'type': 'websocket.close', 'code': 4400})
+            return
+        await send({'type': 'websocket.accept'})
+
+        async def wait_for_close():
+            while (await receive())['type'] != 'websocket.disconnect':
+                pass
+
+        async def emit(message):
+            if message is not None:
+                await send({'type': 'websocket.send', 'text': encode(message)})
+    else:
+        headers = [(b'content-type', b'text/event-stream'), (b'cache-control', b'no-cache'),
+                   (b'x-accel-buffering', b'no')]
+        if getattr(settings, 'CORS_ALLOW_ALL_ORIGINS', False):
+            headers.append((b'access-control-allow-origin', b'*'))
+        await receive()  # http.request
+        if board not in ROW_KEYS:
+            await send({'type': 'http.response.start', 'status': 400,
+                        'headers': [(b'content-type', b'text/plain')]})
+            await send({'type': 'http.response.body', 'body': f'Unknown board: {board}'.encode()})
+            return
+        await send({'type': 'http.response.start', 'status': 200, 'headers': headers})
+
+        async def wait_for_close():
+            while (await receive())['type'] != 'http.disconnect':
+                pass
+
+        async def emit(message):
+            if message is None:
+                body = b': keepalive\n\n'
+            else:
+                body = f"event: {message['event']}\nid: {message['version']}\ndata: {encode(message)}\n\n".encode()
+            await send({'type': 'http.response.body', 'body': body, 'more_body': True})
+
+    feed = get_feed(board)
+    queue = await feed.connect()
+    disconnected = asyncio.ensure_future(wait_for_close())
+    try:
+        await pump(queue, emit, disconnected)
+    finally:
+        disconnected.cancel()
+        feed.disconnect(queue)
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+
+from octofit_tracker import indexes
+from octofit_tracker.db import get_db
+from octofit_tracker.leaderboard import id_variants
+from octofit_tracker.models import Activity
+
+
+class Command(BaseCommand):
+    help = 'Copy each user\'s team onto their activities as team_id'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all', action='store_true',
+            help='Overwrite team_id on every activity, not only those missing it'
+        )
+
+    def handle(self, *args, **options):
+        db = get_db()
+        missing = {} if options['all'] else {'team_id': {'$in': [None, '']}}
+
+        self.stdout.write('Indexing activities by team...')
+        indexes.ensure_indexes(db, Activity)
+
+        updated = 0
+        for user in db.users.find({'team': {'$nin': [None, '']}}, {'team': 1}):
+            result = db.activities.update_many(
+                {'user_id': {'$in': id_variants(user['_id'])}, **missing},
+                {'$set': {'team_id': user['team']}}
+            )
+            updated += result.modified_count
+
+        self.stdout.write(self.style.SUCCESS(f'Activities updated: {updated}'))
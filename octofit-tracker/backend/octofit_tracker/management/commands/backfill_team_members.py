@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from octofit_tracker import membership
+
+
+class Command(BaseCommand):
+    help = 'Recompute every team\'s members and member_count from users\' teams'
+
+    def handle(self, *args, **options):
+        updated = membership.refresh()
+        self.stdout.write(self.style.SUCCESS(f'Teams updated: {updated}'))
@@ -0,0 +1,168 @@
+import json
+import platform
+import subprocess
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+
+from octofit_tracker import benchmarks
+from octofit_tracker.urls import router
+
+SIZE_SUFFIXES = {'k': 1_000, 'm': 1_000_000}
+
+
+def parse_size(value):
+    """'10k' -> 10000, '1m' -> 1000000, '2500' -> 2500"""
+    value = value.strip().lower()
+    multiplier = SIZE_SUFFIXES.get(value[-1:], 1)
+    number = value[:-1] if multiplier != 1 else value
+    try:
+        return int(float(number) * multiplier)
+    except ValueError:
+        raise CommandError(f'Invalid dataset size: {value}')
+
+
+class Command(BaseCommand):
+    help = 'Benchmark every API route against seeded datasets and write JSON results'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes', default='10k,100k,1m',
+            help='Comma-separated activity counts to seed and benchmark (e.g. 10k,100k,1m)'
+        )
+        parser.add_argument('--activities-per-user', type=int, default=20)
+        parser.add_argument('--teams', type=int, default=20)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--workers', type=int, default=None, help='populate_db worker processes')
+        parser.add_argument('--iterations', type=int, default=50, help='Timed requests per route')
+        parser.add_argument('--warmup', type=int, default=5, help='Untimed requests per route')
+        parser.add_argument('--cold-cache', action='store_true', help='Clear the response cache before every request')
+        parser.add_argument(
+            '--encodings', action='store_true',
+            help='Also price each response under every renderer and content coding (CPU and bytes)'
+        )
+        parser.add_argument('--routes', default='', help='Only benchmark routes whose name contains this text')
+        parser.add_argument(
+            '--database', default='octofit_bench',
+            help='Scratch database to seed; it is wiped for every dataset size'
+        )
+        parser.add_argument('--skip-seed', action='store_true', help='Benchmark the data already in --database')
+        parser.add_argument('--output', default='benchmark-results.json', help='Where to write JSON results')
+        parser.add_argument('--compare', help='Previous results file to compare p50 latencies against')
+        parser.add_argument('--threshold', type=float, default=0.1, help='Relative p50 increase flagged as a regression')
+
+    def handle(self, *args, **options):
+        if options['database'] == connection.settings_dict['NAME'] and not options['skip_seed']:
+            raise CommandError('Refusing to seed (and wipe) the application database; pick another --database.')
+
+        connection.settings_dict['NAME'] = options['database']
+        connection.close()
+
+        if options['skip_seed']:
+            sizes = ['existing']
+        else:
+            sizes = [size.strip() for size in options['sizes'].split(',') if size.strip()]
+
+        results = []
+        with override_settings(ALLOWED_HOSTS=['*']):
+            for size in sizes:
+                if not options['skip_seed']:
+                    self.seed(parse_size(size), options)
+                results.extend(self.run_dataset(size, options))
+
+        report = {
+            'meta': self.meta(options),
+            'results': results,
+        }
+        with open(options['output'], 'w') as handle:
+            json.dump(report, handle, indent=2, default=str)
+        self.stdout.write(self.style.SUCCESS(f"\nResults written to {options['output']}"))
+
+        if options['compare']:
+            self.report_comparison(report, options)
+
+    def seed(self, activities, options):
+        users = max(1, activities // options['activities_per_user'])
+        self.stdout.write(f'\n=== Seeding {activities:,} activities ({users:,} users) ===')
+        seed_options = {
+            'users': users,
+            'activities_per_user': options['activities_per_user'],
+            'teams': options['teams'],
+            'seed': options['seed'],
+            'stdout': self.stdout,
+        }
+        if options['workers']:
+            seed_options['workers'] = options['workers']
+        call_command('populate_db', **seed_options)
+
+    def run_dataset(self, size, options):
+        self.stdout.write(f'\n=== Benchmarking dataset {size} ===')
+        self.stdout.write(f"{'route':45} {'p50':>9} {'p90':>9} {'p99':>9} {'rps':>8} {'mongo':>6} {'orm':>5} {'peakKB':>9}")
+        for route in benchmarks.discover_routes(router.registry):
+            if options['routes'] and options['routes'] not in route.name:
+                continue
+            row = benchmarks.measure(
+                route, iterations=options['iterations'], warmup=options['warmup'],
+                cold_cache=options['cold_cache']
+            )
+            row['dataset'] = size
+            latency = row['latency_ms']
+            self.stdout.write(
+                f"{route.name:45} {latency['p50']:9.2f} {latency['p90']:9.2f} {latency['p99']:9.2f} "
+                f"{row['throughput_rps'] or 0:8.1f} {row['mongo_commands']:6d} {row['orm_queries']:5d} "
+                f"{row['peak_memory_kb']:9.0f}"
+            )
+            if options['encodings']:
+                row['encodings'] = benchmarks.measure_encodings(route)
+                self.report_encodings(row['encodings'])
+            yield row
+
+    def report_encodings(self, rows):
+        if not rows:
+            return
+        baseline = rows[0]
+        for row in rows:
+            self.stdout.write(
+                f"    {row['renderer'] + '/' + row['encoding']:20} {row['cpu_ms']:8.3f} ms "
+                f"{row['bytes']:>10,} B  cpu {row['cpu_ms'] - baseline['cpu_ms']:+8.3f} ms "
+                f"bytes {row['bytes'] / baseline['bytes'] - 1 if baseline['bytes'] else 0:+.0%}"
+            )
+
+    def meta(self, options):
+        try:
+            commit = subprocess.run(
+                ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            commit = None
+        return {
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'commit': commit,
+            'python': platform.python_version(),
+            'native_reads': settings.API_NATIVE_READS,
+            'cold_cache': options['cold_cache'],
+            'renderers': list(benchmarks.encoding_renderers()),
+            'content_codings': list(benchmarks.compression.available_encodings()),
+            'iterations': options['iterations'],
+            'seed': options['seed'],
+        }
+
+    def report_comparison(self, report, options):
+        with open(options['compare']) as handle:
+            previous = json.load(handle)
+        rows = benchmarks.compare(report, previous, options['threshold'])
+        self.stdout.write('\n=== Comparison (p50 ms) ===')
+        regressions = 0
+        for dataset, name, old, new, change, regressed in rows:
+            line = f'{dataset:>6} {name:45} {old:9.2f} -> {new:9.2f} ({change:+.1%})'
+            if regressed:
+                regressions += 1
+                self.stdout.write(self.style.ERROR(line))
+            else:
+                self.stdout.write(line)
+        if regressions:
+            self.stdout.write(self.style.ERROR(f'{regressions} route(s) regressed by more than {options["threshold"]:.0%}'))
@@ -0,0 +1,58 @@
+import json
+
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+
+from octofit_tracker import benchmarks
+
+
+def parse_levels(value):
+    return [int(level) for level in value.split(',') if level.strip()]
+
+
+class Command(BaseCommand):
+    help = 'Compare the async read endpoints under ASGI with their DRF counterparts under WSGI'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--concurrency', default='1,10,100,1000',
+            help='Comma-separated numbers of requests in flight (WSGI threads) to test'
+        )
+        parser.add_argument('--requests', type=int, default=2000, help='Requests per route and concurrency level')
+        parser.add_argument(
+            '--client-delay-ms', type=float, default=0,
+            help='Time each simulated client takes to read its response (slow mobile clients)'
+        )
+        parser.add_argument('--routes', default='', help='Comma-separated route names to include (e.g. leaderboard)')
+        parser.add_argument('--params', default='{}', help='JSON query parameters sent with every request')
+        parser.add_argument('--output', default='benchmark-results-async.json', help='Where to write JSON results')
+
+    def handle(self, *args, **options):
+        from octofit_tracker.asgi import application as asgi_application
+        from octofit_tracker.wsgi import application as wsgi_application
+
+        params = json.loads(options['params'])
+        delay = options['client_delay_ms'] / 1000
+        names = [name.strip() for name in options['routes'].split(',') if name.strip()]
+
+        self.stdout.write(f"{'route':20} {'server':6} {'conc':>5} {'p50':>9} {'p99':>9} {'rps':>9} {'errors':>6}")
+        results = []
+        with override_settings(ALLOWED_HOSTS=['*']):
+            for name, async_path, wsgi_path in benchmarks.async_route_pairs(names):
+                for concurrency in parse_levels(options['concurrency']):
+                    for server, run, app, path in (
+                        ('asgi', benchmarks.run_asgi, asgi_application, async_path),
+                        ('wsgi', benchmarks.run_wsgi, wsgi_application, wsgi_path),
+                    ):
+                        row = run(app, path, params, options['requests'], concurrency, delay)
+                        row.update(name=name, server=server, path=path, concurrency=concurrency)
+                        results.append(row)
+                        latency = row['latency_ms']
+                        self.stdout.write(
+                            f"{name:20} {server:6} {concurrency:5d} {latency['p50']:9.2f} "
+                            f"{latency['p99']:9.2f} {row['throughput_rps'] or 0:9.1f} {row['errors']:6d}"
+                        )
+
+        with open(options['output'], 'w') as handle:
+            json.dump({'client_delay_ms': options['client_delay_ms'], 'results': results}, handle, indent=2)
+        self.stdout.write(self.style.SUCCESS(f"\nResults written to {options['output']}"))
@@ -0,0 +1,55 @@
+from django.core.management.base import BaseCommand
+from pymongo import ASCENDING, TEXT
+
+from octofit_tracker.db import get_db
+from octofit_tracker.search import PREFIX_COLLATION, TEXT_INDEX_NAME, TextSearchFilter, prefix_index_name
+from octofit_tracker.timeseries import is_timeseries
+from octofit_tracker.urls import router
+
+
+class Command(BaseCommand):
+    help = 'Create the MongoDB text and prefix indexes used by API search'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--language', default='english',
+            help='Default language of the text indexes (use "none" to disable stemming)'
+        )
+
+    def handle(self, *args, **options):
+        db = get_db()
+        for prefix, viewset, _basename in router.registry:
+            if TextSearchFilter not in getattr(viewset, 'filter_backends', []):
+                continue
+            collection = db[viewset.queryset.model._meta.db_table]
+            fields = [name.lstrip('^=@$') for name in viewset.search_fields]
+            weights = getattr(viewset, 'search_weights', {})
+
+            if is_timeseries(collection):
+                # No text indexes on time series; searches there fall back to regexes
+                self.stdout.write(f'{prefix}: time-series collection, no text index')
+            else:
+                # A collection holds one text index; replace any other definition
+                for name, info in collection.index_information().items():
+                    if any(kind == TEXT for _key, kind in info['key']):
+                        collection.drop_index(name)
+
+                self.stdout.write(f'{prefix}: text index on {", ".join(fields)}')
+                collection.create_index(
+                    [(name, TEXT) for name in fields],
+                    name=TEXT_INDEX_NAME,
+                    weights={name: weights.get(name, 1) for name in fields},
+                    default_language=options['language'],
+                    background=True,
+                )
+            for name in getattr(viewset, 'search_prefix_fields', []):
+                # Earlier versions built a plain index, which case-insensitive prefixes cannot use
+                if f'{name}_1' in collection.index_information():
+                    collection.drop_index(f'{name}_1')
+                self.stdout.write(f'{prefix}: case-insensitive prefix index on {name}')
+                collection.create_index(
+                    [(name, ASCENDING)], name=prefix_index_name(name),
+                    collation=PREFIX_COLLATION, background=True,
+                )
+
+        self.stdout.write(self.style.SUCCESS('Search indexes created'))
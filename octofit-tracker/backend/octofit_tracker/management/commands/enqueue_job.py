@@ -0,0 +1,24 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from octofit_tracker import jobs
+
+
+class Command(BaseCommand):
+    help = 'Queue a background job for run_jobs workers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('name', choices=sorted(jobs.TASKS), help='Job to queue')
+        parser.add_argument('--args', default='{}', help='JSON object of keyword arguments for the job')
+        parser.add_argument('--delay', type=float, default=0, help='Seconds to wait before the job may run')
+
+    def handle(self, *args, **options):
+        try:
+            job_args = json.loads(options['args'])
+        except ValueError as exc:
+            raise CommandError(f'--args is not valid JSON: {exc}')
+        if not isinstance(job_args, dict):
+            raise CommandError('--args must be a JSON object')
+        job_id = jobs.enqueue(options['name'], delay=options['delay'], **job_args)
+        self.stdout.write(self.style.SUCCESS(f"Queued {options['name']} as {job_id}"))
@@ -0,0 +1,120 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import OperationFailure
+
+from octofit_tracker import indexes, timeseries
+from octofit_tracker.db import get_db
+from octofit_tracker.models import Activity
+
+# Where the plain collection is kept once its documents are copied
+SOURCE_COLLECTION = 'activities_plain'
+
+
+def storage_size(db, name):
+    """Bytes on disk for a collection, or None where the server will not say"""
+    try:
+        return db.command({'collStats': name}).get('storageSize')
+    except OperationFailure:
+        return None
+
+
+class Command(BaseCommand):
+    help = (
+        'Move activities from a plain collection into a time-series collection '
+        '(set ACTIVITY_STORAGE=timeseries first). The plain collection is renamed '
+        f'{SOURCE_COLLECTION} and a time-series collection is created in its place '
+        'before the copy, so writes made during the copy land in the new storage. '
+        'Reads miss the activities not yet copied until it ends. The idempotency '
+        'keys of the plain collection are claimed before it is renamed, so a write '
+        'repeating one during the copy is skipped. An interrupted run can be '
+        'started again; it skips what is already copied.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000, help='Activities copied per insert')
+        parser.add_argument(
+            '--drop-source', action='store_true',
+            help=f'Drop {SOURCE_COLLECTION} once every activity is copied (it is kept for rollback otherwise)'
+        )
+
+    def handle(self, *args, **options):
+        if settings.ACTIVITY_STORAGE != timeseries.TIMESERIES:
+            raise CommandError('Set ACTIVITY_STORAGE=timeseries (on every server) before migrating')
+
+        db = get_db()
+        name = Activity._meta.db_table
+        names = set(db.list_collection_names())
+
+        if name in names and not timeseries.is_timeseries(db[name]):
+            if SOURCE_COLLECTION in names:
+                raise CommandError(
+                    f'Both {name} and {SOURCE_COLLECTION} are plain collections; '
+                    'move the activities written to one into the other, then run again'
+                )
+            # Writers only look up keys in the new collection once it is renamed
+            self.stdout.write('Claiming idempotency keys...')
+            self.claim_keys(db, db[name], options['batch_size'])
+            self.stdout.write(f'Renaming {name} to {SOURCE_COLLECTION}...')
+            db[name].rename(SOURCE_COLLECTION)
+        elif SOURCE_COLLECTION not in names:
+            timeseries.ensure_collection(db, Activity)
+            self.stdout.write(self.style.SUCCESS(f'{name} is already a time-series collection'))
+            return
+
+        # Creates the time-series collection, with the _id index the copy looks up
+        self.stdout.write(f'Creating time-series {name} and its indexes...')
+        indexes.ensure_indexes(db, Activity)
+
+        source, target = db[SOURCE_COLLECTION], db[name]
+        # Keys written between the claim above and the rename, or left by an interrupted run
+        self.claim_keys(db, source, options['batch_size'])
+        total = source.estimated_document_count()
+        copied = skipped = 0
+        # Each user's activities in date order fill their buckets one after
+        # another; the order reverses the user_id/-date/-_id index
+        cursor = source.find({}, batch_size=options['batch_size']).sort(
+            [('user_id', DESCENDING), ('date', ASCENDING), ('_id', ASCENDING)]
+        )
+        batch = []
+        for document in cursor:
+            batch.append(document)
+            if len(batch) >= options['batch_size']:
+                copied, skipped = self.copy(target, batch, copied, skipped, total)
+                batch = []
+        if batch:
+            copied, skipped = self.copy(target, batch, copied, skipped, total)
+
+        self.stdout.write(self.style.SUCCESS(f'Activities copied: {copied} ({skipped} already there)'))
+        before, after = storage_size(db, SOURCE_COLLECTION), storage_size(db, name)
+        if before is not None and after is not None:
+            self.stdout.write(f'Storage: {before / 2 ** 20:,.1f} MB -> {after / 2 ** 20:,.1f} MB')
+
+        if options['drop_source']:
+            self.stdout.write(f'Dropping {SOURCE_COLLECTION}...')
+            source.drop()
+
+    def claim_keys(self, db, collection, batch_size):
+        """Claim every idempotency key stored in `collection`; returns how many were new"""
+        claimed = 0
+        keys = []
+        cursor = collection.find({'idempotency_key': {'$gt': ''}}, {'idempotency_key': 1}, batch_size=batch_size)
+        for document in cursor:
+            keys.append(document['idempotency_key'])
+            if len(keys) >= batch_size:
+                claimed += len(timeseries.claim_keys(db, keys))
+                keys = []
+        return claimed + len(timeseries.claim_keys(db, keys))
+
+    def copy(self, target, batch, copied, skipped, total):
+        """Insert the documents of `batch` not yet in `target`; returns the running totals"""
+        present = {
+            document['_id']
+            for document in target.find({'_id': {'$in': [document['_id'] for document in batch]}}, {'_id': 1})
+        }
+        missing = [document for document in batch if document['_id'] not in present]
+        if missing:
+            target.insert_many(missing, ordered=False)
+        copied, skipped = copied + len(missing), skipped + len(present)
+        self.stdout.write(f'  {copied + skipped:,} / {total:,}')
+        return copied, skipped
@@ -1,29 +1,182 @@
 from django.core.management.base import BaseCommand
-from pymongo import MongoClient
+from django.utils import timezone
+from collections import defaultdict
 from datetime import datetime, timedelta
+import multiprocessing
+import os
 import random
+import time
+
+from octofit_tracker import indexes, leaderboard, merge, response_cache, rollups, synthetic, timeseries
+from octofit_tracker.db import get_db
+from octofit_tracker.models import User, Team, Activity, ActivityRollup, Leaderboard, Workout
 
 
 class Command(BaseCommand):
     help = 'Populate the octofit_db database with test data'
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--users', type=int, default=0,
+            help='Generate this many synthetic users instead of the superhero roster'
+        )
+        parser.add_argument(
+            '--activities-per-user', type=int, default=20,
+            help='Mean number of activities per synthetic user'
+        )
+        parser.add_argument('--teams', type=int, default=10, help='Number of synthetic teams')
+        parser.add_argument('--seed', type=int, default=None, help='Random seed for reproducible data')
+        parser.add_argument('--days', type=int, default=90, help='Spread activities over this many days')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Documents per insert_many')
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count() or 1,
+            help='Worker processes generating user chunks'
+        )
+        parser.add_argument(
+            '--merge', action='store_true',
+            help='Upsert by natural key into the existing data instead of replacing it, '
+                 'updating only the derived data that changed (use --seed to make reruns no-ops)'
+        )
+        parser.add_argument(
+            '--max-deltas', type=int, default=1000,
+            help='With --merge, rebuild the leaderboard instead of shifting it when more users changed points'
+        )
+
     def handle(self, *args, **options):
-        # Connect to MongoDB
-        client = MongoClient('localhost', 27017)
-        db = client['octofit_db']
+        # Connect to MongoDB through the shared, pooled client
+        db = get_db()
+        started = time.monotonic()
+        if options['seed'] is not None:
+            random.seed(options['seed'])
+        
+        if options['merge']:
+            self.stdout.write('Merging into existing data...')
+            summary = merge.Summary(options['max_deltas'])
+        else:
+            # Clear existing data
+            self.stdout.write('Clearing existing data...')
+            db.users.delete_many({})
+            db.teams.delete_many({})
+            db.activities.delete_many({})
+            db[timeseries.KEYS_COLLECTION].delete_many({})
+            db.leaderboard.delete_many({})
+            db.workouts.delete_many({})
+            summary = None
+        
+        # Create the indexes declared on the models (merging matches on the unique ones)
+        self.stdout.write('Creating indexes...')
+        indexes.ensure_indexes(db, User, Team, Activity, ActivityRollup, Leaderboard, Workout)
+        
+        if options['users']:
+            self.populate_synthetic(db, options, summary)
+        else:
+            self.populate_heroes(db, summary)
+        
+        if summary is None:
+            # Create Leaderboard entries
+            self.stdout.write('Creating leaderboard...')
+            leaderboard.rebuild(db, batch_size=options['batch_size'])
+            self.stdout.write('Building activity rollups...')
+            rollups.rebuild(db)
+        else:
+            self.stdout.write('Updating derived data...')
+            outcome = summary.finish(db)
+            for collection, counts in summary.counts.items():
+                self.stdout.write(
+                    f"  {collection}: {counts['inserted']} inserted, {counts['changed']} changed, "
+                    f"{counts['unchanged']} unchanged"
+                )
+            self.stdout.write(f'  leaderboard: {outcome}')
+        # Writes above bypass the model signals
+        for namespace in (response_cache.LEADERBOARD, response_cache.WORKOUTS):
+            response_cache.invalidate(namespace)
+        elapsed = time.monotonic() - started
+        
+        # Print summary
+        activity_count = db.activities.count_documents({})
+        self.stdout.write(self.style.SUCCESS('\n=== Database Population Complete ==='))
+        self.stdout.write(self.style.SUCCESS(f'Teams created: {db.teams.count_documents({})}'))
+        self.stdout.write(self.style.SUCCESS(f'Users created: {db.users.count_documents({})}'))
+        self.stdout.write(self.style.SUCCESS(f'Activities created: {activity_count}'))
+        self.stdout.write(self.style.SUCCESS(f'Workouts created: {db.workouts.count_documents({})}'))
+        self.stdout.write(self.style.SUCCESS(f'Leaderboard entries: {db.leaderboard.count_documents({})}'))
+        self.stdout.write(self.style.SUCCESS(
+            f'Elapsed: {elapsed:.1f}s ({activity_count / max(elapsed, 1e-9):,.0f} activities/s)'
+        ))
         
-        # Clear existing data
-        self.stdout.write('Clearing existing data...')
-        db.users.delete_many({})
-        db.teams.delete_many({})
-        db.activities.delete_many({})
-        db.leaderboard.delete_many({})
-        db.workouts.delete_many({})
+        # Display top 3 heroes
+        self.stdout.write('\n=== Top 3 Heroes ===')
+        top_heroes = list(db.users.find().sort('total_points', -1).limit(3))
+        for i, hero in enumerate(top_heroes, start=1):
+            self.stdout.write(f'{i}. {hero["alias"]} ({hero["name"]}) - {hero["total_points"]} points')
         
-        # Create unique index on email field
-        self.stdout.write('Creating unique index on email field...')
-        db.users.create_index([('email', 1)], unique=True)
+        # Display team standings
+        self.stdout.write('\n=== Team Standings ===')
+        for entry in db.leaderboard.find({'type': leaderboard.TEAM}).sort('rank', 1).limit(10):
+            self.stdout.write(f'{entry["rank"]}. {entry["team_name"]}: {entry["total_points"]} points')
+
+    def populate_synthetic(self, db, options, summary=None):
+        """Generate users, teams and activities at scale across worker processes"""
+        seed = options['seed'] if options['seed'] is not None else random.randrange(2 ** 32)
+        self.stdout.write(
+            f"Generating {options['users']:,} users x ~{options['activities_per_user']} activities "
+            f"in {options['teams']} teams (seed {seed}, {options['workers']} workers)..."
+        )
+        if options['teams']:
+            self._write_teams(db, synthetic.make_teams(options['teams']), summary)
+        
+        chunk_options = {
+            'users': options['users'],
+            'activities_per_user': options['activities_per_user'],
+            'teams': options['teams'],
+            'seed': seed,
+            'days': options['days'],
+            'batch_size': options['batch_size'],
+            'max_deltas': options['max_deltas'],
+        }
+        chunks = synthetic.chunks(chunk_options)
+        generate = synthetic.generate_chunk if summary is None else synthetic.merge_chunk
+        
+        started = time.monotonic()
+        users = activities = 0
+        if options['workers'] > 1:
+            with multiprocessing.get_context().Pool(options['workers']) as pool:
+                results = pool.imap_unordered(generate, chunks)
+                for result in results:
+                    users, activities = self._add_chunk(result, summary, users, activities)
+                    self._progress(users, activities, started)
+        else:
+            for chunk in chunks:
+                users, activities = self._add_chunk(generate(chunk), summary, users, activities)
+                self._progress(users, activities, started)
         
+        self._populate_workouts(db, summary)
+
+    def _add_chunk(self, result, summary, users, activities):
+        """Running (users, activities) totals after one chunk's result"""
+        if summary is None:
+            chunk_users, chunk_activities = result
+        else:
+            summary.update(result)
+            chunk_users = sum(result.counts.get('users', {}).values())
+            chunk_activities = sum(result.counts.get('activities', {}).values())
+        return users + chunk_users, activities + chunk_activities
+
+    def _write_teams(self, db, teams, summary):
+        if summary is None:
+            db.teams.insert_many(teams)
+        else:
+            summary.teams_written(merge.upsert_many(db.teams, teams, '_id', ('created_at', 'members', 'member_count')))
+
+    def _progress(self, users, activities, started):
+        elapsed = max(time.monotonic() - started, 1e-9)
+        self.stdout.write(
+            f'  {users:,} users, {activities:,} activities '
+            f'({users / elapsed:,.0f} users/s, {activities / elapsed:,.0f} activities/s)'
+        )
+
+    def populate_heroes(self, db, summary=None):
+        """Seed the superhero roster with a handful of activities each"""
         # Create Teams
         self.stdout.write('Creating teams...')
         teams = [
@@ -32,17 +185,19 @@ class Command(BaseCommand):
                 'name': 'Team Marvel',
                 'description': 'Earth\'s Mightiest Heroes',
                 'created_at': datetime.now(),
-                'members': []
+                'members': [],
+                'member_count': 0,
             },
             {
                 '_id': 'dc',
                 'name': 'Team DC',
                 'description': 'Justice League Members',
                 'created_at': datetime.now(),
-                'members': []
+                'members': [],
+                'member_count': 0,
             }
         ]
-        db.teams.insert_many(teams)
+        self._write_teams(db, teams, summary)
         
         # Create Users (Superheroes)
         self.stdout.write('Creating superhero users...')
@@ -82,16 +237,68 @@ class Command(BaseCommand):
             }
             users.append(user)
         
-        result = db.users.insert_many(users)
-        user_ids = result.inserted_ids
+        if summary is None:
+            result = db.users.insert_many(users)
+            user_ids = result.inserted_ids
+            
+            # Update teams with member IDs
+            marvel_user_ids = [uid for uid, hero in zip(user_ids, all_heroes) if hero['team'] == 'marvel']
+            dc_user_ids = [uid for uid, hero in zip(user_ids, all_heroes) if hero['team'] == 'dc']
+            
+            db.teams.update_one({'_id': 'marvel'}, {'$set': {'members': marvel_user_ids, 'member_count': len(marvel_user_ids)}})
+            db.teams.update_one({'_id': 'dc'}, {'$set': {'members': dc_user_ids, 'member_count': len(dc_user_ids)}})
+        else:
+            # Member lists are refreshed by summary.finish()
+            result = merge.upsert_many(db.users, users, 'email', synthetic.USER_INSERT_ONLY)
+            summary.users(result)
+            user_ids = [result.ids[user['email']] for user in users]
         
-        # Update teams with member IDs
-        marvel_user_ids = [uid for uid, hero in zip(user_ids, all_heroes) if hero['team'] == 'marvel']
-        dc_user_ids = [uid for uid, hero in zip(user_ids, all_heroes) if hero['team'] == 'dc']
+        self._populate_workouts(db, summary)
         
-        db.teams.update_one({'_id': 'marvel'}, {'$set': {'members': marvel_user_ids}})
-        db.teams.update_one({'_id': 'dc'}, {'$set': {'members': dc_user_ids}})
+        # Create Activities
+        self.stdout.write('Creating activities...')
+        activity_types = ['running', 'cycling', 'swimming', 'weightlifting', 'yoga', 'martial arts', 'flying', 'web-slinging']
+        activities = []
+        totals = defaultdict(int)
+        now = datetime.now()
+        if summary is not None:
+            # Merged activities must come out the same on a rerun the same day
+            now = timezone.now().replace(hour=0, minute=0, second=0, microsecond=0)
         
+        for i, user_id in enumerate(user_ids):
+            # Create 5-10 activities per user
+            num_activities = random.randint(5, 10)
+            for number in range(num_activities):
+                days_ago = random.randint(1, 30)
+                activity = {
+                    'user_id': user_id,
+                    'user_name': all_heroes[i]['name'],
+                    'user_alias': all_heroes[i]['alias'],
+                    'team_id': all_heroes[i]['team'],
+                    'activity_type': random.choice(activity_types),
+                    'duration_minutes': random.randint(20, 120),
+                    'distance_km': round(random.uniform(1.0, 20.0), 2) if random.choice([True, False]) else None,
+                    'calories_burned': random.randint(100, 800),
+                    'points_earned': random.randint(10, 100),
+                    'date': now - timedelta(days=days_ago),
+                    'notes': f'Training session for {all_heroes[i]["alias"]}',
+                    'idempotency_key': f'seed:{all_heroes[i]["email"]}:{number}',
+                }
+                activities.append(activity)
+                totals[user_id] += activity['points_earned']
+        
+        if summary is not None:
+            summary.activities(merge.upsert_many(db.activities, activities, 'idempotency_key'), db)
+            return
+        
+        db.activities.insert_many(activities)
+        
+        # Update user total points, summed while the activities were built
+        self.stdout.write('Calculating user points...')
+        db.users.bulk_write(synthetic.total_points_updates(totals))
+
+    def _populate_workouts(self, db, summary=None):
+        """Insert the workout catalogue"""
         # Create Workouts
         self.stdout.write('Creating workout suggestions...')
         workouts = [
@@ -163,102 +370,7 @@ class Command(BaseCommand):
             }
         ]
         
-        db.workouts.insert_many(workouts)
-        
-        # Create Activities
-        self.stdout.write('Creating activities...')
-        activity_types = ['running', 'cycling', 'swimming', 'weightlifting', 'yoga', 'martial arts', 'flying', 'web-slinging']
-        activities = []
-        
-        for i, user_id in enumerate(user_ids):
-            # Create 5-10 activities per user
-            num_activities = random.randint(5, 10)
-            for _ in range(num_activities):
-                days_ago = random.randint(1, 30)
-                activity = {
-                    'user_id': user_id,
-                    'user_name': all_heroes[i]['name'],
-                    'user_alias': all_heroes[i]['alias'],
-                    'activity_type': random.choice(activity_types),
-                    'duration_minutes': random.randint(20, 120),
-                    'distance_km': round(random.uniform(1.0, 20.0), 2) if random.choice([True, False]) else None,
-                    'calories_burned': random.randint(100, 800),
-                    'points_earned': random.randint(10, 100),
-                    'date': datetime.now() - timedelta(days=days_ago),
-                    'notes': f'Training session for {all_heroes[i]["alias"]}'
-                }
-                activities.append(activity)
-        
-        db.activities.insert_many(activities)
-        
-        # Calculate and update user total points
-        self.stdout.write('Calculating user points...')
-        for user_id in user_ids:
-            user_activities = db.activities.find({'user_id': user_id})
-            total_points = sum(activity['points_earned'] for activity in user_activities)
-            db.users.update_one({'_id': user_id}, {'$set': {'total_points': total_points}})
-        
-        # Create Leaderboard entries
-        self.stdout.write('Creating leaderboard...')
-        leaderboard_entries = []
-        
-        # Individual leaderboard
-        all_users = list(db.users.find())
-        all_users.sort(key=lambda x: x['total_points'], reverse=True)
-        
-        for rank, user in enumerate(all_users, start=1):
-            leaderboard_entries.append({
-                'user_id': user['_id'],
-                'user_name': user['name'],
-                'user_alias': user['alias'],
-                'team': user['team'],
-                'total_points': user['total_points'],
-                'rank': rank,
-                'type': 'individual',
-                'updated_at': datetime.now()
-            })
-        
-        # Team leaderboard
-        marvel_points = sum(u['total_points'] for u in all_users if u['team'] == 'marvel')
-        dc_points = sum(u['total_points'] for u in all_users if u['team'] == 'dc')
-        
-        team_scores = [
-            {'team': 'marvel', 'points': marvel_points},
-            {'team': 'dc', 'points': dc_points}
-        ]
-        team_scores.sort(key=lambda x: x['points'], reverse=True)
-        
-        for rank, team_data in enumerate(team_scores, start=1):
-            team = db.teams.find_one({'_id': team_data['team']})
-            leaderboard_entries.append({
-                'team_id': team_data['team'],
-                'team_name': team['name'],
-                'total_points': team_data['points'],
-                'rank': rank,
-                'type': 'team',
-                'member_count': len(team['members']),
-                'updated_at': datetime.now()
-            })
-        
-        db.leaderboard.insert_many(leaderboard_entries)
-        
-        # Print summary
-        self.stdout.write(self.style.SUCCESS('\n=== Database Population Complete ==='))
-        self.stdout.write(self.style.SUCCESS(f'Teams created: {db.teams.count_documents({})}'))
-        self.stdout.write(self.style.SUCCESS(f'Users created: {db.users.count_documents({})}'))
-        self.stdout.write(self.style.SUCCESS(f'Activities created: {db.activities.count_documents({})}'))
-        self.stdout.write(self.style.SUCCESS(f'Workouts created: {db.workouts.count_documents({})}'))
-        self.stdout.write(self.style.SUCCESS(f'Leaderboard entries: {db.leaderboard.count_documents({})}'))
-        
-        # Display top 3 heroes
-        self.stdout.write('\n=== Top 3 Heroes ===')
-        top_heroes = list(db.users.find().sort('total_points', -1).limit(3))
-        for i, hero in enumerate(top_heroes, start=1):
-            self.stdout.write(f'{i}. {hero["alias"]} ({hero["name"]}) - {hero["total_points"]} points')
-        
-        # Display team standings
-        self.stdout.write('\n=== Team Standings ===')
-        self.stdout.write(f'1. Team Marvel: {marvel_points} points')
-        self.stdout.write(f'2. Team DC: {dc_points} points')
-        
-        client.close()
+        if summary is None:
+            db.workouts.insert_many(workouts)
+        else:
+            summary.count('workouts', merge.upsert_many(db.workouts, workouts, 'name', ('created_at',)))
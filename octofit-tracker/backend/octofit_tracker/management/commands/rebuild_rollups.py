@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from octofit_tracker import indexes, rollups
+from octofit_tracker.db import get_db
+from octofit_tracker.models import ActivityRollup
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the daily user, team and activity type rollups from activity history'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--since',
+            help='Only rebuild rollups from this date (YYYY-MM-DD) on; default rebuilds everything'
+        )
+
+    def handle(self, *args, **options):
+        since = None
+        if options['since']:
+            since = parse_date(options['since'])
+            if since is None:
+                raise CommandError(f"Invalid --since date: {options['since']}")
+
+        db = get_db()
+        indexes.ensure_indexes(db, ActivityRollup)
+
+        self.stdout.write('Rebuilding activity rollups...')
+        count = rollups.rebuild(db, since=since)
+        self.stdout.write(self.style.SUCCESS(
+            f'Activities rolled up: {count} ({db[rollups.COLLECTION].count_documents({})} rollup documents)'
+        ))
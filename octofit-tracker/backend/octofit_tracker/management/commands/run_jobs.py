@@ -0,0 +1,31 @@
+import signal
+
+from django.core.management.base import BaseCommand
+
+from octofit_tracker import indexes, jobs
+from octofit_tracker.db import get_db
+from octofit_tracker.models import Job
+
+
+class Command(BaseCommand):
+    help = 'Run background jobs (leaderboard, rollup and points recomputes) from the job queue'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=2, help='Worker threads in this process')
+        parser.add_argument('--poll-interval', type=float, default=None, help='Seconds to wait when the queue is empty')
+        parser.add_argument('--burst', action='store_true', help='Exit once no due jobs are left')
+
+    def handle(self, *args, **options):
+        # Deduplication relies on the unique pending_key index
+        indexes.ensure_indexes(get_db(), Job)
+
+        pool = jobs.WorkerPool(options['workers'], options['poll_interval'], burst=options['burst'])
+        if not options['burst']:
+            for signum in (signal.SIGINT, signal.SIGTERM):
+                signal.signal(signum, lambda *_args: pool.stop())
+
+        self.stdout.write(f"Queue: {jobs.queue_depth()}")
+        self.stdout.write(f"Starting {options['workers']} workers as {pool.name}...")
+        pool.start()
+        pool.join()
+        self.stdout.write(self.style.SUCCESS(f"Stopped. Queue: {jobs.queue_depth()}"))
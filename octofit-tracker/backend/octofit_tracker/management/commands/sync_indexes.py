@@ -0,0 +1,78 @@
+from django.apps import apps
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from octofit_tracker import indexes
+from octofit_tracker.db import get_db
+from octofit_tracker.urls import router
+
+
+def describe(equality, sort):
+    """'user_id = ? sort -date, _id' for one query shape"""
+    parts = [f'{name} = ?' for name in equality]
+    parts.append('sort ' + ', '.join(f'{"-" if direction < 0 else ""}{name}' for name, direction in sort))
+    return ' '.join(parts)
+
+
+class Command(BaseCommand):
+    help = 'Create the MongoDB indexes declared on the models and audit API query shapes against them'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--audit', action='store_true',
+            help='Only report which ViewSet query shapes lack a supporting index; build nothing'
+        )
+        parser.add_argument(
+            '--explain', action='store_true',
+            help='Run explain() for every query shape and report plan and execution stats'
+        )
+        parser.add_argument(
+            '--foreground', action='store_true',
+            help='Build indexes in the foreground (faster, but blocks writes on older servers)'
+        )
+        parser.add_argument(
+            '--strict', action='store_true',
+            help='Fail when any query shape has no supporting index'
+        )
+
+    def handle(self, *args, **options):
+        db = get_db()
+
+        if not options['audit']:
+            models = apps.get_app_config('octofit_tracker').get_models()
+            created = indexes.ensure_indexes(db, *models, background=not options['foreground'])
+            for name in created:
+                self.stdout.write(f'Created index {name}')
+            self.stdout.write(self.style.SUCCESS(f'Indexes created: {len(created)}'))
+
+        self.stdout.write('\n=== Query shape audit ===')
+        missing = 0
+        for basename, model, equality, sort, index in indexes.audit(router.registry):
+            shape = f'{basename:12} {describe(equality, sort)}'
+            if index is None:
+                missing += 1
+                self.stdout.write(self.style.WARNING(f'{shape:60} MISSING'))
+            else:
+                self.stdout.write(f'{shape:60} {index.name}')
+            if options['explain']:
+                self.explain(db, model, equality, sort)
+        self.stdout.write(f'Unsupported query shapes: {missing}')
+
+        if missing and options['strict']:
+            raise CommandError(f'{missing} query shape(s) have no supporting index')
+
+    def explain(self, db, model, equality, sort):
+        collection = db[model._meta.db_table]
+        query = {}
+        for name in equality:
+            sample = collection.find_one({name: {'$nin': [None, '']}}, {name: 1})
+            if sample is None:
+                self.stdout.write('    (no sample data)')
+                return
+            query[name] = sample[name]
+        stats = indexes.explain(collection, query, sort, settings.REST_FRAMEWORK['PAGE_SIZE'])
+        line = (
+            f"    {stats['plan']}: keys {stats['keys_examined']}, docs {stats['docs_examined']}, "
+            f"returned {stats['returned']}, {stats['millis']} ms"
+        )
+        self.stdout.write(self.style.ERROR(line + ', in-memory sort') if stats['in_memory_sort'] else line)
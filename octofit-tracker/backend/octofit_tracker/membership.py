@@ -0,0 +1,61 @@
+"""
+Team membership and its counter.
+
+A team stores its users' ids in ``members`` and the length of that list in
+``member_count``, so team lists, the admin and the team leaderboard read one
+integer instead of loading (or counting) every member. join() and leave()
+change both in a single-document update that only matches when the user is
+not yet (or still) a member, so concurrent or repeated calls keep the two in
+step without a read first. refresh() recomputes both from users, for bulk
+writes and repairs.
+"""
+from .db import get_db
+from .leaderboard import id_variants
+
+
+def join(team_id, user_id, db=None):
+    """Add a user to a team's members; no-op if already there"""
+    if not team_id:
+        return
+    db = db if db is not None else get_db()
+    db.teams.update_one(
+        {'_id': team_id, 'members': {'$nin': id_variants(user_id)}},
+        {'$push': {'members': user_id}, '$inc': {'member_count': 1}}
+    )
+
+
+def leave(team_id, user_id, db=None):
+    """Remove a user from a team's members; no-op if not there"""
+    if not team_id:
+        return
+    db = db if db is not None else get_db()
+    variants = id_variants(user_id)
+    db.teams.update_one(
+        {'_id': team_id, 'members': {'$in': variants}},
+        {'$pull': {'members': {'$in': variants}}, '$inc': {'member_count': -1}}
+    )
+
+
+def move(user_id, old_team, new_team, db=None):
+    if old_team == new_team:
+        return
+    leave(old_team, user_id, db)
+    join(new_team, user_id, db)
+
+
+def refresh(team_ids=None, db=None):
+    """
+    Recompute members and member_count from users, for `team_ids` or every
+    team. Returns the number of teams updated.
+    """
+    db = db if db is not None else get_db()
+    if team_ids is None:
+        team_ids = [team['_id'] for team in db.teams.find({}, {'_id': 1})]
+    updated = 0
+    for team_id in team_ids:
+        members = [user['_id'] for user in db.users.find({'team': team_id}, {'_id': 1})]
+        result = db.teams.update_one(
+            {'_id': team_id}, {'$set': {'members': members, 'member_count': len(members)}}
+        )
+        updated += result.modified_count
+    return updated
@@ -0,0 +1,202 @@
+"""
+Non-destructive seeding for ``populate_db --merge``.
+
+Documents are written by natural key (user email, team id, workout name,
+activity idempotency_key) with upsert_many(), which reads the stored
+documents for a batch of keys, skips those that already match and sends one
+bulk_write of upserting UpdateOnes for the rest. Nothing is deleted.
+
+Derived data then moves only for what changed: new and changed activities
+become rollup updates and per-user point deltas, and the leaderboard is
+shifted by those deltas. It is rebuilt only when changes it cannot shift
+(users moving team or being renamed, team renames) happened, or when more
+users changed than a full rebuild would cost.
+"""
+from collections import defaultdict
+
+import bson
+from pymongo import InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError
+
+from . import leaderboard, membership, rollups
+from .timeseries import claim_keys, is_timeseries, release_unstored
+
+
+class MergeResult:
+    """What upsert_many() did with one batch"""
+
+    def __init__(self):
+        self.ids = {}  # natural key -> _id of matched documents and of new ones given an _id
+        self.inserted = []  # new documents
+        self.changed = []  # (stored document, document after the update)
+        self.unchanged = 0
+
+
+def stored(value, codec_options):
+    """`value` as it reads back from MongoDB (millisecond, naive UTC datetimes)"""
+    return bson.decode(bson.encode({'v': value}, codec_options=codec_options), codec_options=codec_options)['v']
+
+
+def upsert_many(collection, documents, key, insert_only=('_id',)):
+    """
+    Upsert `documents` by their `key` field, skipping unchanged documents.
+
+    Fields in `insert_only` (ids, creation times, derived totals) are only
+    written when a document is created and are not compared. New documents
+    are plain inserts on a time-series collection, which takes no upserts,
+    made only for the keys claimed first (see timeseries.py); a key claimed
+    by another writer counts as unchanged.
+    """
+    documents = list(documents)
+    result = MergeResult()
+    if not documents:
+        return result
+    codec_options = collection.codec_options
+    upsert = not is_timeseries(collection)
+    existing = {
+        document[key]: document
+        for document in collection.find({key: {'$in': [document[key] for document in documents]}})
+    }
+    claimed, inserted_keys = None, []
+    if not upsert:
+        claimed = claim_keys(
+            collection.database, [document[key] for document in documents if document[key] not in existing]
+        )
+
+    operations = []
+    for document in documents:
+        fields = {
+            name: stored(value, codec_options)
+            for name, value in document.items()
+            if name not in insert_only and name != key
+        }
+        previous = existing.get(document[key])
+        if previous is None and claimed is not None:
+            # Another writer's key, or one already inserted from this batch
+            if document[key] not in claimed:
+                result.unchanged += 1
+                continue
+            claimed.discard(document[key])
+            inserted_keys.append(document[key])
+        if previous is None:
+            on_insert = {name: document[name] for name in insert_only if name in document and name != key}
+            if upsert:
+                operations.append(UpdateOne(
+                    {key: document[key]}, {'$set': fields, '$setOnInsert': on_insert}, upsert=True
+                ))
+            else:
+                operations.append(InsertOne({**on_insert, key: document[key], **fields}))
+            result.inserted.append({**on_insert, key: document[key], **fields})
+            if '_id' in document:
+                result.ids[document[key]] = document['_id']
+            continue
+        result.ids[document[key]] = previous['_id']
+        changed = {name: value for name, value in fields.items() if previous.get(name) != value}
+        if changed:
+            operations.append(UpdateOne({'_id': previous['_id']}, {'$set': changed}))
+            result.changed.append((previous, {**previous, **changed}))
+        else:
+            result.unchanged += 1
+
+    if operations:
+        try:
+            collection.bulk_write(operations, ordered=False)
+        except BulkWriteError:
+            # Free the keys that were not stored so a rerun can write them
+            release_unstored(collection, key, inserted_keys)
+            raise
+    return result
+
+
+class Summary:
+    """Counts and derived-data work accumulated over a merge"""
+
+    def __init__(self, max_deltas):
+        self.max_deltas = max_deltas
+        self.counts = {}  # collection -> {'inserted': n, 'changed': n, 'unchanged': n}
+        self.deltas = defaultdict(int)
+        self.too_many_deltas = False
+        self.teams = set()  # teams whose member lists may be stale
+        self.rerank = False
+
+    def count(self, collection, result):
+        counts = self.counts.setdefault(collection, dict.fromkeys(('inserted', 'changed', 'unchanged'), 0))
+        counts['inserted'] += len(result.inserted)
+        counts['changed'] += len(result.changed)
+        counts['unchanged'] += result.unchanged
+
+    def users(self, result):
+        """Note membership and leaderboard changes from a users batch"""
+        self.count('users', result)
+        for user in result.inserted:
+            self.teams.add(user.get('team'))
+        for previous, current in result.changed:
+            if previous.get('team') != current.get('team'):
+                self.teams.update((previous.get('team'), current.get('team')))
+                self.rerank = True
+            if (previous.get('name'), previous.get('alias')) != (current.get('name'), current.get('alias')):
+                self.rerank = True
+        self.teams.discard('')
+        self.teams.discard(None)
+
+    def teams_written(self, result):
+        self.count('teams', result)
+        if any(previous.get('name') != current.get('name') for previous, current in result.changed):
+            self.rerank = True
+
+    def activities(self, result, db):
+        """Move rollups and users' total_points for a batch of activity changes"""
+        self.count('activities', result)
+        added = result.inserted + [current for _previous, current in result.changed]
+        removed = [previous for previous, _current in result.changed]
+        rollups.apply(added=added, removed=removed, db=db)
+
+        deltas = defaultdict(int)
+        for activity in added:
+            deltas[str(activity['user_id'])] += activity.get('points_earned') or 0
+        for activity in removed:
+            deltas[str(activity['user_id'])] -= activity.get('points_earned') or 0
+        deltas = {user_id: delta for user_id, delta in deltas.items() if delta}
+        if deltas:
+            db.users.bulk_write([
+                UpdateOne({'_id': {'$in': leaderboard.id_variants(user_id)}}, {'$inc': {'total_points': delta}})
+                for user_id, delta in deltas.items()
+            ], ordered=False)
+        self.add_deltas(deltas)
+
+    def add_deltas(self, deltas):
+        if self.too_many_deltas:
+            return
+        for user_id, delta in deltas.items():
+            self.deltas[user_id] += delta
+        if len(self.deltas) > self.max_deltas:
+            self.too_many_deltas = True
+            self.deltas.clear()
+
+    def update(self, other):
+        """Fold in the summary of a chunk merged in another process"""
+        for collection, counts in other.counts.items():
+            mine = self.counts.setdefault(collection, dict.fromkeys(counts, 0))
+            for name, value in counts.items():
+                mine[name] += value
+        self.teams |= other.teams
+        self.rerank = self.rerank or other.rerank
+        if other.too_many_deltas:
+            self.too_many_deltas = True
+            self.deltas.clear()
+        else:
+            self.add_deltas(other.deltas)
+
+    def finish(self, db):
+        """
+        Bring team member lists and the leaderboard up to date. Returns
+        'rebuilt', 'shifted' or 'unchanged' for the leaderboard.
+        """
+        membership.refresh(self.teams, db)
+        if self.rerank or self.too_many_deltas:
+            leaderboard.rebuild(db)
+            return 'rebuilt'
+        if self.deltas:
+            leaderboard.apply_deltas(self.deltas, db, increment_users=False)
+            return 'shifted'
+        return 'unchanged'
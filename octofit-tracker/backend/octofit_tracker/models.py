@@ -1,6 +1,10 @@
 from djongo import models
 from django.utils import timezone
 
+from .indexes import Index
+
+DIFFICULTY_LEVELS = ['beginner', 'intermediate', 'advanced', 'super-hero']
+
 
 class User(models.Model):
     """User model for fitness app users"""
@@ -14,6 +18,14 @@ class User(models.Model):
     created_at = models.DateTimeField(default=timezone.now)
     last_active = models.DateTimeField(default=timezone.now)
 
+    mongo_indexes = [
+        Index('email', unique=True),
+        Index('-total_points', '-_id'),
+        Index('team', '-total_points', '-_id'),
+        Index('fitness_level', '-total_points', '-_id'),
+        Index('-last_active'),  # conditional GET validator
+    ]
+
     class Meta:
         db_table = 'users'
         ordering = ['-total_points']
@@ -29,6 +41,12 @@ class Team(models.Model):
     description = models.TextField(blank=True)
     created_at = models.DateTimeField(default=timezone.now)
     members = models.JSONField(default=list)
+    member_count = models.IntegerField(default=0)  # len(members), kept in step by membership.py
+
+    mongo_indexes = [
+        Index('name', '_id'),
+        Index('-created_at', '-_id'),
+    ]
 
     class Meta:
         db_table = 'teams'
@@ -44,6 +62,7 @@ class Activity(models.Model):
     user_id = models.CharField(max_length=100)
     user_name = models.CharField(max_length=200)
     user_alias = models.CharField(max_length=200, blank=True)
+    team_id = models.CharField(max_length=100, blank=True)  # copied from the user's team on create
     activity_type = models.CharField(max_length=100)
     duration_minutes = models.IntegerField()
     distance_km = models.FloatField(null=True, blank=True)
@@ -51,6 +70,21 @@ class Activity(models.Model):
     points_earned = models.IntegerField()
     date = models.DateTimeField(default=timezone.now)
     notes = models.TextField(blank=True)
+    idempotency_key = models.CharField(max_length=100, null=True, blank=True)  # set by bulk sync clients
+
+    mongo_indexes = [
+        Index('-date', '-_id'),
+        Index('user_id', '-date', '-_id'),
+        Index('team_id', '-date', '-_id'),
+        Index('activity_type', '-date', '-_id'),
+        Index('user_alias', '-date', '-_id'),
+        # Idempotency keys are unique wherever a client supplied one
+        Index('idempotency_key', unique=True, partial={'idempotency_key': {'$type': 'string'}}),
+        # Already there on a plain collection; time-series collections have none
+        Index('_id'),
+    ]
+    # Used when ACTIVITY_STORAGE = 'timeseries' (see octofit_tracker/timeseries.py)
+    mongo_timeseries = {'timeField': 'date', 'metaField': 'user_id'}
 
     class Meta:
         db_table = 'activities'
@@ -76,6 +110,15 @@ class Leaderboard(models.Model):
     member_count = models.IntegerField(null=True, blank=True)
     updated_at = models.DateTimeField(default=timezone.now)
 
+    mongo_indexes = [
+        Index('rank', '_id'),
+        Index('type', 'rank', '_id'),
+        Index('type', 'user_id'),
+        Index('type', 'team_id'),
+        Index('team', 'rank', '_id'),
+        Index('-updated_at'),  # conditional GET validator
+    ]
+
     class Meta:
         db_table = 'leaderboard'
         ordering = ['rank']
@@ -97,9 +140,73 @@ class Workout(models.Model):
     category = models.CharField(max_length=100)
     created_at = models.DateTimeField(default=timezone.now)
 
+    mongo_indexes = [
+        Index('difficulty', 'name', '_id'),
+        Index('category', 'difficulty', 'name', '_id'),
+        Index('-created_at', '-_id'),
+    ]
+
     class Meta:
         db_table = 'workouts'
         ordering = ['difficulty', 'name']
 
     def __str__(self):
         return f"{self.name} ({self.difficulty})"
+
+
+class ActivityRollup(models.Model):
+    """Daily activity totals for one user, team or activity type"""
+    _id = models.CharField(primary_key=True, max_length=300)  # '<scope>:<key>:<YYYY-MM-DD>'
+    scope = models.CharField(max_length=20)  # 'user', 'team' or 'activity_type'
+    key = models.CharField(max_length=200)
+    day = models.DateTimeField()  # UTC midnight
+    activity_count = models.IntegerField(default=0)
+    total_points = models.IntegerField(default=0)
+    total_calories = models.IntegerField(default=0)
+    total_minutes = models.IntegerField(default=0)
+    total_distance_km = models.FloatField(default=0)
+
+    mongo_indexes = [
+        Index('scope', 'key', 'day'),
+        Index('day'),  # rebuild_rollups replaces whole days
+    ]
+
+    class Meta:
+        db_table = 'activity_rollups'
+        ordering = ['scope', 'key', 'day']
+
+    def __str__(self):
+        return f"{self.scope} {self.key} ({self.day.strftime('%Y-%m-%d')})"
+
+
+class Job(models.Model):
+    """A background job (see jobs.py); written by the queue, read by the admin"""
+    _id = models.ObjectIdField(primary_key=True)
+    name = models.CharField(max_length=100)
+    args = models.JSONField(default=dict)
+    key = models.CharField(max_length=300)  # name + args, identifies duplicate jobs
+    pending_key = models.CharField(max_length=300, null=True, blank=True)  # key while queued
+    status = models.CharField(max_length=20, default='queued')
+    attempts = models.IntegerField(default=0)
+    max_attempts = models.IntegerField(default=5)
+    run_after = models.DateTimeField(default=timezone.now)
+    locked_by = models.CharField(max_length=200, blank=True)
+    locked_until = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    mongo_indexes = [
+        Index('status', 'run_after'),
+        Index('status', 'locked_until'),
+        Index('name'),  # admin filter choices
+        Index('pending_key', unique=True, partial={'pending_key': {'$type': 'string'}}),
+        Index('-created_at', '-_id'),
+    ]
+
+    class Meta:
+        db_table = 'jobs'
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f'{self.name} ({self.status})'
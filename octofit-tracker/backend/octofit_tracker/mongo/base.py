@@ -0,0 +1,27 @@
+"""
+djongo engine that shares the process-wide MongoClient.
+
+Stock djongo closes its MongoClient whenever Django closes a connection
+(the end of every request by default) and each new connection reopens it,
+tearing down the pool that other threads are using. This wrapper borrows
+octofit_tracker.db.get_client() instead and never closes it.
+"""
+from djongo import base
+
+from octofit_tracker.db import get_client
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+
+    def get_new_connection(self, connection_params):
+        name = connection_params.pop('name')
+        enforce_schema = connection_params.pop('enforce_schema')
+
+        self.client_connection = get_client()
+        database = self.client_connection[name]
+        self.djongo_connection = base.DjongoClient(database, enforce_schema)
+        return database
+
+    def _close(self):
+        # The client and its pool belong to the process, not this connection
+        pass
@@ -0,0 +1,78 @@
+from django.conf import settings
+from rest_framework.filters import OrderingFilter
+from rest_framework.pagination import CursorPagination
+
+TIEBREAKER = '_id'
+
+
+def with_tiebreaker(ordering):
+    """
+    `ordering` as a tuple ending in the `_id` tiebreaker, which sorts the way
+    the first field does so a (field, _id) index serves either direction.
+    """
+    ordering = tuple(ordering)
+    if TIEBREAKER not in ordering and f'-{TIEBREAKER}' not in ordering:
+        descending = bool(ordering) and ordering[0].startswith('-')
+        ordering = ordering + (f'-{TIEBREAKER}' if descending else TIEBREAKER,)
+    return ordering
+
+
+def list_ordering(viewset, param=None):
+    """
+    The ordering a ViewSet's list applies for an ?ordering= value.
+
+    Allowed ?ordering= fields win, as with DRF's OrderingFilter; otherwise the
+    ViewSet's `ordering`, or its pagination class's when it has no
+    OrderingFilter. DRF pagination, the native and async reads and the index
+    audit all order through here, so they agree on rows and cursors.
+    """
+    if OrderingFilter not in getattr(viewset, 'filter_backends', []):
+        return with_tiebreaker(viewset.pagination_class.ordering)
+    allowed = set(getattr(viewset, 'ordering_fields', None) or ())
+    fields = [name.strip() for name in (param or '').split(',') if name.strip()]
+    fields = [name for name in fields if name.lstrip('-') in allowed]
+    return with_tiebreaker(fields or getattr(viewset, 'ordering', None) or viewset.pagination_class.ordering)
+
+
+class BoundedCursorPagination(CursorPagination):
+    """
+    Keyset pagination with a client-selectable page size and a hard cap.
+
+    The cursor seeks on the first ordering field; the `_id` tiebreaker is
+    appended to the ordering so rows sharing that value always come back in
+    the same order. Without a view (nested routes) the class's own ordering
+    applies.
+    """
+    page_size_query_param = 'page_size'
+    max_page_size = getattr(settings, 'API_MAX_PAGE_SIZE', 500)
+    ordering = ('_id',)
+
+    def get_ordering(self, request, queryset, view):
+        if view is None:
+            return with_tiebreaker(self.ordering)
+        return list_ordering(view, request.query_params.get(OrderingFilter.ordering_param))
+
+
+class UserCursorPagination(BoundedCursorPagination):
+    """Users ordered by points"""
+    ordering = ('-total_points',)
+
+
+class TeamCursorPagination(BoundedCursorPagination):
+    """Teams ordered by name"""
+    ordering = ('name',)
+
+
+class ActivityCursorPagination(BoundedCursorPagination):
+    """Activity feeds, newest first"""
+    ordering = ('-date', '-_id')
+
+
+class LeaderboardCursorPagination(BoundedCursorPagination):
+    """Leaderboard rows by rank"""
+    ordering = ('rank',)
+
+
+class WorkoutCursorPagination(BoundedCursorPagination):
+    """Workouts by difficulty then name"""
+    ordering = ('difficulty', 'name')
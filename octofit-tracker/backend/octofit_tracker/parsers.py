@@ -0,0 +1,38 @@
+import codecs
+import json
+
+from django.conf import settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+
+
+class NDJSONParser(BaseParser):
+    """
+    Parses newline-delimited JSON into a list of objects.
+
+    The body is decoded line by line from the request stream, so a batch is
+    never held as one raw string, and parsing stops as soon as it grows past
+    ACTIVITY_BULK_MAX_BATCH.
+    """
+    media_type = 'application/x-ndjson'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        max_items = settings.ACTIVITY_BULK_MAX_BATCH
+
+        items = []
+        if stream is None:
+            return items
+        reader = codecs.getreader(encoding)(stream)
+        for line_number, line in enumerate(reader, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            if len(items) >= max_items:
+                raise ParseError(f'Batch exceeds {max_items} items.')
+            try:
+                items.append(json.loads(line))
+            except ValueError as exc:
+                raise ParseError(f'NDJSON parse error on line {line_number} - {exc}')
+        return items
@@ -0,0 +1,90 @@
+"""
+Publish/subscribe backends for live updates.
+
+Publishers are ordinary (sync) code paths such as leaderboard writes;
+subscribers are coroutines on an ASGI worker's event loop. The backend is
+chosen by the PUBSUB_BACKEND setting: the in-memory backend only reaches
+subscribers in the publishing process, so deployments whose writes and
+streams run in different processes point PUBSUB_URL at Redis instead.
+
+A backend provides ``publish(channel, message)``, callable from any thread,
+and ``listen(channel)``, an async iterator of messages. Messages are
+JSON-serialisable dicts.
+"""
+import asyncio
+import json
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+_pubsub = None
+_pubsub_lock = threading.Lock()
+
+
+class InMemoryPubSub:
+    """Fan messages out to subscribers in this process"""
+
+    def __init__(self, url=None):
+        self._lock = threading.Lock()
+        self._subscribers = defaultdict(set)
+
+    def publish(self, channel, message):
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+        for loop, queue in subscribers:
+            try:
+                loop.call_soon_threadsafe(queue.put_nowait, message)
+            except RuntimeError:
+                # The subscriber's loop has closed
+                pass
+
+    async def listen(self, channel):
+        subscriber = (asyncio.get_running_loop(), asyncio.Queue())
+        with self._lock:
+            self._subscribers[channel].add(subscriber)
+        try:
+            while True:
+                yield await subscriber[1].get()
+        finally:
+            with self._lock:
+                self._subscribers[channel].discard(subscriber)
+
+
+class RedisPubSub:
+    """Redis PUBLISH/SUBSCRIBE, shared by every process; requires redis>=4.2"""
+
+    def __init__(self, url):
+        import redis
+
+        self.url = url
+        self._client = redis.Redis.from_url(url)
+
+    def publish(self, channel, message):
+        self._client.publish(channel, json.dumps(message))
+
+    async def listen(self, channel):
+        import redis.asyncio
+
+        client = redis.asyncio.Redis.from_url(self.url)
+        pubsub = client.pubsub()
+        await pubsub.subscribe(channel)
+        try:
+            async for message in pubsub.listen():
+                if message['type'] == 'message':
+                    yield json.loads(message['data'])
+        finally:
+            await pubsub.unsubscribe(channel)
+            await pubsub.close()
+            await client.close()
+
+
+def get_pubsub():
+    """The configured backend, created once per process"""
+    global _pubsub
+    if _pubsub is None:
+        with _pubsub_lock:
+            if _pubsub is None:
+                _pubsub = import_string(settings.PUBSUB_BACKEND)(settings.PUBSUB_URL)
+    return _pubsub
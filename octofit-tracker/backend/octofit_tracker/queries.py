@@ -0,0 +1,89 @@
+"""
+Team-level queries run as MongoDB aggregation pipelines.
+
+Activities carry a denormalised ``team_id``, so team questions are answered by
+a single pipeline over ``activities`` or ``users`` instead of loading members
+into Python and fanning out with ``$in``.
+"""
+from pymongo import ASCENDING, DESCENDING
+
+from .db import get_db
+
+
+def team_points(db=None):
+    """Total points and member count per team, highest total first"""
+    db = db if db is not None else get_db()
+    return list(db.users.aggregate([
+        {'$match': {'team': {'$nin': [None, '']}}},
+        {'$group': {
+            '_id': '$team',
+            'total_points': {'$sum': '$total_points'},
+            'member_count': {'$sum': 1},
+        }},
+        {'$sort': {'total_points': DESCENDING, '_id': ASCENDING}},
+    ]))
+
+
+def team_total(team_id, db=None):
+    """Sum of the members' total_points for one team"""
+    db = db if db is not None else get_db()
+    rows = list(db.users.aggregate([
+        {'$match': {'team': team_id}},
+        {'$group': {'_id': None, 'total_points': {'$sum': '$total_points'}}},
+    ]))
+    return rows[0]['total_points'] if rows else 0
+
+
+def team_member_counts(db=None):
+    """Mapping of team id -> number of users on that team"""
+    return {row['_id']: row['member_count'] for row in team_points(db)}
+
+
+def team_summary(team_id, db=None):
+    """Activity totals and per-activity-type breakdown for one team, or None if it does not exist"""
+    db = db if db is not None else get_db()
+    team = db.teams.find_one({'_id': team_id}, {'member_count': 1})
+    if team is None:
+        return None
+    result = next(db.activities.aggregate([
+        {'$match': {'team_id': team_id}},
+        {'$facet': {
+            'totals': [
+                {'$group': {
+                    '_id': None,
+                    'activity_count': {'$sum': 1},
+                    'total_points': {'$sum': '$points_earned'},
+                    'total_calories': {'$sum': '$calories_burned'},
+                    'total_minutes': {'$sum': '$duration_minutes'},
+                }},
+            ],
+            'by_activity_type': [
+                {'$group': {
+                    '_id': '$activity_type',
+                    'activity_count': {'$sum': 1},
+                    'total_points': {'$sum': '$points_earned'},
+                    'total_minutes': {'$sum': '$duration_minutes'},
+                }},
+                {'$sort': {'total_points': DESCENDING, '_id': ASCENDING}},
+            ],
+        }},
+    ]), {'totals': [], 'by_activity_type': []})
+
+    totals = result['totals'][0] if result['totals'] else {}
+    return {
+        'team_id': team_id,
+        'member_count': team.get('member_count', 0),
+        'activity_count': totals.get('activity_count', 0),
+        'total_points': totals.get('total_points', 0),
+        'total_calories': totals.get('total_calories', 0),
+        'total_minutes': totals.get('total_minutes', 0),
+        'by_activity_type': [
+            {
+                'activity_type': row['_id'],
+                'activity_count': row['activity_count'],
+                'total_points': row['total_points'],
+                'total_minutes': row['total_minutes'],
+            }
+            for row in result['by_activity_type']
+        ],
+    }
@@ -0,0 +1,160 @@
+"""
+Workout recommendations.
+
+Workouts are serialized once into an in-process index bucketed by difficulty
+level and category, each bucket read with its own index-backed query capped
+at MAX_PER_BUCKET, so neither a rebuild nor the scoring of a request grows
+with the catalogue. The index is tied to the ``workouts`` response-cache
+version, so a workout write (which bumps that version) makes the next
+request rebuild it. A per-process cache never sees the version bumps of
+other workers, so without API_CACHE_SHARED the index is also rebuilt once
+it is RECOMMENDATION_INDEX_SECONDS old.
+"""
+import heapq
+import threading
+import time
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from . import response_cache
+from .db import get_db
+from .leaderboard import id_variants
+from .models import Workout, DIFFICULTY_LEVELS
+from .serializers import WorkoutSerializer
+
+# Workout category each activity type trains
+ACTIVITY_CATEGORIES = {
+    'running': 'cardio',
+    'cycling': 'cardio',
+    'swimming': 'cardio',
+    'weightlifting': 'strength',
+    'yoga': 'flexibility',
+    'martial arts': 'agility',
+    'flying': 'power',
+    'web-slinging': 'agility',
+}
+
+HISTORY_DAYS = 30
+MAX_PER_BUCKET = 50
+LEVEL_SPREAD = 1
+
+DIFFICULTY_WEIGHT = 0.5
+CATEGORY_WEIGHT = 0.3
+DURATION_WEIGHT = 0.2
+
+_index = {'version': None, 'built_at': None, 'buckets': {}}
+_index_lock = threading.Lock()
+
+
+def level_of(difficulty):
+    """Numeric level of a difficulty name, beginner for unknown values"""
+    try:
+        return DIFFICULTY_LEVELS.index(difficulty)
+    except ValueError:
+        return 0
+
+
+def build_index():
+    """Bucket serialized workouts by (level, category), capped per bucket"""
+    buckets = {}
+    # distinct() and each bucket read walk the category/difficulty/name/_id index
+    for category in get_db().workouts.distinct('category'):
+        for level, difficulty in enumerate(DIFFICULTY_LEVELS):
+            workouts = Workout.objects.filter(category=category, difficulty=difficulty).order_by('name', '_id')
+            data = WorkoutSerializer(workouts[:MAX_PER_BUCKET], many=True).data
+            if data:
+                buckets[(level, category)] = [dict(row) for row in data]
+    return buckets
+
+
+def is_stale(version):
+    """Whether the index predates `version` or, with per-process caches, has aged out"""
+    if _index['version'] != version:
+        return True
+    return (
+        not settings.API_CACHE_SHARED
+        and time.monotonic() - _index['built_at'] > settings.RECOMMENDATION_INDEX_SECONDS
+    )
+
+
+def get_index():
+    """Return the workout index, rebuilding it if workouts changed"""
+    version = response_cache.get_version(response_cache.WORKOUTS)
+    if is_stale(version):
+        with _index_lock:
+            if is_stale(version):
+                _index['buckets'] = build_index()
+                _index['version'] = version
+                _index['built_at'] = time.monotonic()
+    return _index['buckets']
+
+
+def user_fitness_level(user_id, db=None):
+    """Stored fitness level of a user, or None if the user does not exist"""
+    db = db if db is not None else get_db()
+    user = db.users.find_one({'_id': {'$in': id_variants(user_id)}}, {'fitness_level': 1})
+    return user.get('fitness_level') if user else None
+
+
+def activity_profile(user_id, db=None):
+    """Share of recent activities per workout category and average duration"""
+    db = db if db is not None else get_db()
+    since = timezone.now() - timedelta(days=HISTORY_DAYS)
+    rows = db.activities.aggregate([
+        {'$match': {'user_id': {'$in': id_variants(user_id)}, 'date': {'$gte': since}}},
+        {'$group': {
+            '_id': '$activity_type',
+            'count': {'$sum': 1},
+            'minutes': {'$sum': '$duration_minutes'},
+        }},
+    ])
+
+    counts = defaultdict(int)
+    total = minutes = 0
+    for row in rows:
+        category = ACTIVITY_CATEGORIES.get(row['_id'])
+        if category:
+            counts[category] += row['count']
+        total += row['count']
+        minutes += row['minutes'] or 0
+
+    shares = {category: count / total for category, count in counts.items()} if total else {}
+    average_minutes = minutes / total if total else None
+    return shares, average_minutes
+
+
+def score(workout, user_level, shares, average_minutes):
+    """Score a workout for a user; higher is a better fit"""
+    distance = abs(level_of(workout['difficulty']) - user_level)
+    difficulty_fit = 1 - distance / (len(DIFFICULTY_LEVELS) - 1)
+    category_fit = shares.get(workout['category'], 0)
+    if average_minutes:
+        gap = abs(workout['duration_minutes'] - average_minutes) / average_minutes
+        duration_fit = 1 - min(gap, 1)
+    else:
+        duration_fit = 0
+    return (
+        DIFFICULTY_WEIGHT * difficulty_fit
+        + CATEGORY_WEIGHT * category_fit
+        + DURATION_WEIGHT * duration_fit
+    )
+
+
+def recommend(fitness_level, user_id=None, limit=5):
+    """Return up to `limit` serialized workouts ranked for the user"""
+    user_level = level_of(fitness_level)
+    shares, average_minutes = activity_profile(user_id) if user_id else ({}, None)
+
+    levels = range(user_level - LEVEL_SPREAD, user_level + LEVEL_SPREAD + 1)
+    candidates = (
+        workout
+        for (level, _category), bucket in get_index().items() if level in levels
+        for workout in bucket
+    )
+    return heapq.nlargest(
+        limit, candidates,
+        key=lambda workout: score(workout, user_level, shares, average_minutes)
+    )
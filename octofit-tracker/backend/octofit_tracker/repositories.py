@@ -0,0 +1,200 @@
+"""
+Native pymongo read path for the five API models.
+
+djongo translates every ORM query through generated SQL, which dominates the
+CPU cost of list endpoints. Repositories query the collections directly and
+hand the serializers ``__slots__`` records, which DRF reads by attribute just
+like model instances. Writes and the admin keep using the ORM.
+"""
+import base64
+
+from bson import json_util
+from pymongo import ASCENDING, DESCENDING
+from rest_framework.utils.urls import replace_query_param
+
+from .db import read_collection
+from .leaderboard import id_variants
+from .models import User, Team, Activity, Leaderboard, Workout
+
+
+def record_class(model):
+    """Build a lightweight read-only record type for a model"""
+    fields = {field.attname: field for field in model._meta.concrete_fields}
+    slots = tuple(fields)
+
+    def __init__(self, document):
+        for name in slots:
+            value = document[name] if name in document else fields[name].get_default()
+            setattr(self, name, value)
+
+    def __repr__(self):
+        return f'<{model.__name__}Record {getattr(self, "_id", None)}>'
+
+    return type(f'{model.__name__}Record', (), {
+        '__slots__': slots,
+        '__init__': __init__,
+        '__repr__': __repr__,
+        'model': model,
+    })
+
+
+def encode_cursor(position, reverse=False):
+    """Opaque cursor token for a keyset position"""
+    raw = json_util.dumps({'p': position, 'r': reverse})
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(token):
+    """Inverse of encode_cursor; raises ValueError on a malformed token"""
+    try:
+        data = json_util.loads(base64.urlsafe_b64decode(token.encode()).decode())
+        return list(data['p']), bool(data['r'])
+    except Exception as exc:
+        raise ValueError('Invalid cursor') from exc
+
+
+class Repository:
+    """Read access to one model's collection"""
+
+    def __init__(self, model):
+        self.model = model
+        self.collection_name = model._meta.db_table
+        self.record = record_class(model)
+        self.fields = {field.attname: field for field in model._meta.concrete_fields}
+
+    @property
+    def collection(self):
+        return read_collection(self.collection_name)
+
+    def match(self, filters):
+        """Translate exact-match filters into a Mongo query"""
+        query = {}
+        for name, value in filters.items():
+            if name == '_id' or name.endswith('_id'):
+                # Ids are stored as strings or ObjectIds depending on the writer
+                query[name] = {'$in': id_variants(value)}
+            else:
+                query[name] = self.fields[name].to_python(value)
+        return query
+
+    def exists(self, pk):
+        """Whether a document with this pk is stored (an _id index count, no document read)"""
+        return bool(self.collection.count_documents({'_id': {'$in': id_variants(pk)}}, limit=1))
+
+    def get(self, pk, projection=None):
+        document = self.collection.find_one({'_id': {'$in': id_variants(pk)}}, projection)
+        return self.record(document) if document is not None else None
+
+    def page(self, filters=None, ordering=('_id',), cursor=None, limit=50, projection=None):
+        """
+        Return (records, has_more) for one keyset page.
+
+        `ordering` is a sequence of field names, '-' prefixed for descending;
+        `_id` is appended as tiebreaker so every position is unique. When the
+        cursor is reversed the page before the position is returned.
+        """
+        query, keys, reverse = self.page_query(filters, ordering, cursor)
+        documents = list(
+            self.collection.find(query, projection).sort(keys).limit(limit + 1)
+        )
+        return self.page_records(documents, limit, reverse)
+
+    async def apage(self, db, filters=None, ordering=('_id',), cursor=None, limit=50, projection=None):
+        """page() through a motor database, for async views"""
+        query, keys, reverse = self.page_query(filters, ordering, cursor)
+        documents = await read_collection(self.collection_name, db).find(
+            query, projection
+        ).sort(keys).limit(limit + 1).to_list(None)
+        return self.page_records(documents, limit, reverse)
+
+    async def aget(self, db, pk, projection=None):
+        """get() through a motor database, for async views"""
+        document = await read_collection(self.collection_name, db).find_one(
+            {'_id': {'$in': id_variants(pk)}}, projection
+        )
+        return self.record(document) if document is not None else None
+
+    def batches(self, filters=None, ordering=('_id',), projection=None, batch_size=1000):
+        """
+        Yield every matching record in `ordering` as lists of at most
+        `batch_size`, read from a single cursor one batch at a time.
+        """
+        query, keys, _reverse = self.page_query(filters, ordering, None)
+        cursor = self.collection.find(query, projection, batch_size=batch_size).sort(keys)
+        try:
+            batch = []
+            for document in cursor:
+                batch.append(self.record(document))
+                if len(batch) == batch_size:
+                    yield batch
+                    batch = []
+            if batch:
+                yield batch
+        finally:
+            cursor.close()
+
+    def page_query(self, filters, ordering, cursor):
+        """(query, sort keys, reverse) for one keyset page"""
+        keys = [(name.lstrip('-'), DESCENDING if name.startswith('-') else ASCENDING) for name in ordering]
+        if '_id' not in [name for name, _direction in keys]:
+            keys.append(('_id', keys[0][1] if keys else ASCENDING))
+
+        position, reverse = cursor if cursor else (None, False)
+        if reverse:
+            keys = [(name, -direction) for name, direction in keys]
+
+        query = self.match(filters or {})
+        if position is not None:
+            query = {'$and': [query, self._after(keys, position)]}
+        return query, keys, reverse
+
+    def page_records(self, documents, limit, reverse):
+        """(records, has_more) from the limit + 1 documents fetched for a page"""
+        has_more = len(documents) > limit
+        documents = documents[:limit]
+        if reverse:
+            documents.reverse()
+        return [self.record(document) for document in documents], has_more
+
+    @staticmethod
+    def _after(keys, position):
+        """Query matching documents strictly after position in keys order"""
+        clauses = []
+        for index, (name, direction) in enumerate(keys):
+            clause = {keys[i][0]: position[i] for i in range(index)}
+            clause[name] = {'$gt' if direction == ASCENDING else '$lt': position[index]}
+            clauses.append(clause)
+        return {'$or': clauses}
+
+    def page_links(self, url, records, ordering, cursor, has_more):
+        """(next, previous) links around a page of records, or None at the ends"""
+        reverse = cursor[1] if cursor else False
+        has_next = True if reverse else has_more
+        has_previous = has_more if reverse else cursor is not None
+
+        next_link = previous_link = None
+        if records and has_next:
+            position = self.position(records[-1], ordering)
+            next_link = replace_query_param(url, 'cursor', encode_cursor(position))
+        if records and has_previous:
+            position = self.position(records[0], ordering)
+            previous_link = replace_query_param(url, 'cursor', encode_cursor(position, reverse=True))
+        return next_link, previous_link
+
+    @staticmethod
+    def position(record, ordering):
+        """Keyset position of a record for the given ordering"""
+        names = [name.lstrip('-') for name in ordering]
+        if '_id' not in names:
+            names.append('_id')
+        return [getattr(record, name) for name in names]
+
+
+REPOSITORIES = {
+    model: Repository(model)
+    for model in (User, Team, Activity, Leaderboard, Workout)
+}
+
+
+def repository_for(model):
+    return REPOSITORIES[model]
@@ -0,0 +1,128 @@
+"""
+Response cache for read-heavy endpoints.
+
+Cached responses live in the ``api`` cache (see ``CACHES`` in settings) under
+a key made of a namespace version, the request path, the query string and the
+rendered format. Writes never delete keys: they bump the namespace version so
+every older entry simply stops being looked up and ages out of the LRU.
+"""
+import hashlib
+import json
+import time
+from functools import wraps
+
+from django.core.cache import caches
+from django.utils.http import parse_etags, quote_etag
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+
+from .models import User, Team, Activity, Leaderboard, Workout
+
+CACHE_ALIAS = 'api'
+
+LEADERBOARD = 'leaderboard'
+WORKOUTS = 'workouts'
+
+# Namespaces made stale by a write to each model
+INVALIDATES = {
+    Activity: (LEADERBOARD,),
+    User: (LEADERBOARD,),
+    Team: (LEADERBOARD,),
+    Leaderboard: (LEADERBOARD,),
+    Workout: (WORKOUTS,),
+}
+
+
+def get_cache():
+    return caches[CACHE_ALIAS]
+
+
+def _version_key(namespace):
+    return f'{namespace}:version'
+
+
+def _changed_key(namespace):
+    return f'{namespace}:changed'
+
+
+def get_version(namespace):
+    """Return the current version of a namespace, starting one if needed"""
+    cache = get_cache()
+    version = cache.get(_version_key(namespace))
+    if version is None:
+        # Seed from the clock so an evicted counter never revives old entries
+        cache.add(_version_key(namespace), int(time.time() * 1000), timeout=None)
+        version = cache.get(_version_key(namespace))
+    return version
+
+
+def changed_at(namespace):
+    """Epoch seconds of the namespace's last invalidation"""
+    cache = get_cache()
+    changed = cache.get(_changed_key(namespace))
+    if changed is None:
+        # Unknown (evicted, or no write seen yet): assume it just changed
+        cache.add(_changed_key(namespace), int(time.time()), timeout=None)
+        changed = cache.get(_changed_key(namespace))
+    return changed
+
+
+def invalidate(namespace):
+    """Make every cached response in a namespace stale"""
+    get_cache().set(_changed_key(namespace), int(time.time()), timeout=None)
+    try:
+        get_cache().incr(_version_key(namespace))
+    except ValueError:
+        get_version(namespace)
+
+
+def cache_key(namespace, request):
+    """Key a response by namespace version, path, query params and format"""
+    query = sorted(request.query_params.lists())
+    renderer = getattr(request, 'accepted_renderer', None)
+    raw = json.dumps([request.path, query, getattr(renderer, 'format', None)])
+    digest = hashlib.md5(raw.encode()).hexdigest()
+    return f'{namespace}:{get_version(namespace)}:{digest}'
+
+
+def compute_etag(data):
+    """Strong ETag over the response data"""
+    body = json.dumps(data, cls=JSONEncoder, sort_keys=True)
+    return quote_etag(hashlib.md5(body.encode()).hexdigest())
+
+
+def etag_matches(request, etag):
+    """True if the request's If-None-Match already names this ETag"""
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if not if_none_match:
+        return False
+    etags = parse_etags(if_none_match)
+    return '*' in etags or etag.strip('"') in [tag.strip('"') for tag in etags]
+
+
+def cached_response(namespace):
+    """
+    Cache a successful GET action's data and serve it with an ETag.
+
+    Clients sending a matching If-None-Match get an empty 304.
+    """
+    def decorator(view_method):
+        @wraps(view_method)
+        def wrapper(self, request, *args, **kwargs):
+            cache = get_cache()
+            key = cache_key(namespace, request)
+            entry = cache.get(key)
+            if entry is None:
+                response = view_method(self, request, *args, **kwargs)
+                if response.status_code != status.HTTP_200_OK:
+                    return response
+                entry = {'data': response.data, 'etag': compute_etag(response.data)}
+                cache.set(key, entry)
+
+            headers = {'ETag': entry['etag']}
+            if etag_matches(request, entry['etag']):
+                return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+            return Response(entry['data'], headers=headers)
+        return wrapper
+    return decorator
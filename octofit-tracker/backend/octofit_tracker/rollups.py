@@ -0,0 +1,232 @@
+"""
+Pre-aggregated daily activity totals.
+
+Every activity adds to three daily rollup documents: one for its user, one for
+its team and one for its activity type. Stats over a date range then read one
+document per day instead of every activity in the range. Rollups are
+maintained with ``$inc`` upserts as activities are written (model signals and
+bulk ingestion) and can be rebuilt from history with ``rebuild_rollups``,
+which recomputes them in place while those writes go on.
+"""
+from collections import OrderedDict, defaultdict
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+
+from bson import ObjectId
+from pymongo import ASCENDING, DESCENDING, UpdateOne
+
+from .db import get_db, read_collection
+from .models import ActivityRollup
+
+COLLECTION = ActivityRollup._meta.db_table
+
+USER = 'user'
+TEAM = 'team'
+ACTIVITY_TYPE = 'activity_type'
+
+DAY = 'day'
+WEEK = 'week'
+
+# rollup measure -> activity field summed into it (None counts activities)
+MEASURES = OrderedDict([
+    ('activity_count', None),
+    ('total_points', 'points_earned'),
+    ('total_calories', 'calories_burned'),
+    ('total_minutes', 'duration_minutes'),
+    ('total_distance_km', 'distance_km'),
+])
+
+# Activity fields a rollup update needs
+FIELDS = ('user_id', 'team_id', 'activity_type', 'date', *filter(None, MEASURES.values()))
+
+
+def day_of(value):
+    """UTC midnight of a date or datetime, as the naive datetime MongoDB stores"""
+    if isinstance(value, datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(dt_timezone.utc)
+        value = value.date()
+    return datetime.combine(value, time.min)
+
+
+def rollup_id(scope, key, day):
+    return f'{scope}:{key}:{day:%Y-%m-%d}'
+
+
+def accumulate(activities, sign=1, totals=None):
+    """
+    Add each activity's measures (negated when sign is -1) to the rollups it
+    belongs to. Returns {(scope, key, day): {measure: increment}}.
+    """
+    totals = totals if totals is not None else defaultdict(lambda: defaultdict(int))
+    for activity in activities:
+        if not activity.get('date'):
+            continue
+        day = day_of(activity['date'])
+        increments = {
+            measure: sign * ((activity.get(field) or 0) if field else 1)
+            for measure, field in MEASURES.items()
+        }
+        for scope, key in ((USER, activity.get('user_id')), (TEAM, activity.get('team_id')),
+                           (ACTIVITY_TYPE, activity.get('activity_type'))):
+            if not key:
+                continue
+            row = totals[(scope, str(key), day)]
+            for measure, increment in increments.items():
+                row[measure] += increment
+    return totals
+
+
+def write(totals, db=None):
+    """Apply accumulated increments with one unordered bulk upsert"""
+    if not totals:
+        return
+    db = db if db is not None else get_db()
+    now = utcnow()
+    db[COLLECTION].bulk_write([
+        UpdateOne(
+            {'_id': rollup_id(scope, key, day)},
+            {
+                '$inc': dict(increments),
+                '$setOnInsert': {'scope': scope, 'key': key, 'day': day, 'inserted_at': now},
+            },
+            upsert=True,
+        )
+        for (scope, key, day), increments in totals.items()
+    ], ordered=False)
+
+
+def apply(added=(), removed=(), db=None):
+    """Add `added` activities to, and take `removed` ones off, their rollups"""
+    totals = accumulate(added)
+    accumulate(removed, sign=-1, totals=totals)
+    write(totals, db)
+
+
+def utcnow():
+    """The current time as the naive UTC datetime MongoDB stores"""
+    return datetime.now(dt_timezone.utc).replace(tzinfo=None)
+
+
+def left_over(stamp, started):
+    """Rollups the rebuild marked `stamp` did not write, and no live write created since `started`"""
+    return {
+        'rebuilt': {'$ne': stamp},
+        '$or': [{'inserted_at': {'$exists': False}}, {'inserted_at': {'$lt': started}}],
+    }
+
+
+def recompute_day(db, day, stamp):
+    """
+    Replace one day's rollups with totals aggregated from its activities.
+
+    A $merge swaps each rollup document for its recomputed version in place,
+    so reads never see a missing day and live $inc upserts keep landing on
+    the same documents. Rollups of the day the recompute did not produce
+    (their activities are gone) are deleted, unless a live write created
+    them after the recompute started.
+    """
+    started = utcnow()
+    db.activities.aggregate([
+        {'$match': {'date': {'$gte': day, '$lt': day + timedelta(days=1)}}},
+        {'$project': {
+            **{field: 1 for field in filter(None, MEASURES.values())},
+            'keys': [
+                {'scope': USER, 'key': {'$toString': '$user_id'}},
+                {'scope': TEAM, 'key': {'$toString': '$team_id'}},
+                {'scope': ACTIVITY_TYPE, 'key': {'$toString': '$activity_type'}},
+            ],
+        }},
+        {'$unwind': '$keys'},
+        {'$match': {'keys.key': {'$nin': [None, '']}}},
+        {'$group': {
+            '_id': {'scope': '$keys.scope', 'key': '$keys.key'},
+            **{measure: {'$sum': f'${field}' if field else 1} for measure, field in MEASURES.items()},
+        }},
+        {'$project': {
+            '_id': {'$concat': ['$_id.scope', ':', '$_id.key', f':{day:%Y-%m-%d}']},
+            'scope': '$_id.scope',
+            'key': '$_id.key',
+            'day': day,
+            **{measure: 1 for measure in MEASURES},
+            'rebuilt': stamp,
+        }},
+        {'$merge': {'into': COLLECTION, 'whenMatched': 'replace', 'whenNotMatched': 'insert'}},
+    ])
+    db[COLLECTION].delete_many({'day': day, **left_over(stamp, started)})
+
+
+def rebuild(db=None, since=None):
+    """
+    Recompute rollups from activities, one day at a time (see recompute_day()).
+
+    With `since`, only rollups from that day on are replaced. An activity
+    written while its own day is being recomputed can be counted twice or
+    missed until the next rebuild; every other write is kept. Returns the
+    number of activities read.
+    """
+    db = db if db is not None else get_db()
+    query, days = {}, {}
+    if since is not None:
+        since = day_of(since)
+        query, days = {'date': {'$gte': since}}, {'day': {'$gte': since}}
+    stamp, started = ObjectId(), utcnow()
+
+    last = db.activities.find_one(query, {'date': 1}, sort=[('date', DESCENDING)])
+    if last is None:
+        # No activities in the range: every rollup in it is left over
+        db[COLLECTION].delete_many({**days, **left_over(stamp, started)})
+        return 0
+    if since is None:
+        since = day_of(db.activities.find_one({}, {'date': 1}, sort=[('date', ASCENDING)])['date'])
+    end = max(day_of(last['date']), day_of(started))
+
+    day = since
+    while day <= end:
+        recompute_day(db, day, stamp)
+        day += timedelta(days=1)
+
+    # Rollups outside the recomputed days are left over from deleted activities
+    outside = [{'day': {'$gt': end}}] if days else [{'day': {'$gt': end}}, {'day': {'$lt': since}}]
+    db[COLLECTION].delete_many({'$and': [{'$or': outside}, left_over(stamp, started)]})
+    return db.activities.count_documents(query)
+
+
+def period_start(day, period):
+    return day - timedelta(days=day.weekday()) if period == WEEK else day
+
+
+def series(scope, key, start, end, period=DAY, db=None):
+    """
+    Totals for each day (or ISO week) from start to end inclusive, with
+    empty periods filled in, plus the totals for the whole range.
+    """
+    collection = read_collection(COLLECTION, db)
+    start, end = day_of(start), day_of(end)
+    rows = collection.find(
+        {'scope': scope, 'key': str(key), 'day': {'$gte': start, '$lte': end}},
+        {measure: 1 for measure in [*MEASURES, 'day']},
+    ).sort('day', ASCENDING)
+
+    empty = OrderedDict((measure, 0) for measure in MEASURES)
+    periods = OrderedDict()
+    day = period_start(start, period)
+    while day <= end:
+        periods[day] = empty.copy()
+        day += timedelta(days=7 if period == WEEK else 1)
+
+    totals = empty.copy()
+    for row in rows:
+        bucket = periods[period_start(row['day'], period)]
+        for measure in MEASURES:
+            bucket[measure] += row.get(measure, 0)
+            totals[measure] += row.get(measure, 0)
+
+    return {
+        'scope': scope,
+        'key': str(key),
+        'start': start.date(),
+        'end': end.date(),
+        'period': period,
+        'totals': totals,
+        'series': [OrderedDict(period_start=day.date(), **values) for day, values in periods.items()],
+    }
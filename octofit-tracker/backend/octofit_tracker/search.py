@@ -0,0 +1,170 @@
+"""
+Indexed search backed by MongoDB text indexes.
+
+DRF's SearchFilter becomes an ``icontains`` per field, which djongo turns into
+unanchored case-insensitive regexes that scan whole collections. Here the
+search string is matched against the collection's text index (built by the
+``create_search_indexes`` command from each ViewSet's ``search_fields``), and
+fields listed in ``search_prefix_fields`` are additionally matched as
+prefixes, so a partial alias such as "spid" still finds "Spider-Man".
+
+A case-insensitive regex cannot bound an index scan, so a prefix is matched
+as the range [query, query + U+FFFF) under PREFIX_COLLATION, against an
+index built with that collation. The collation compares case-insensitively,
+and CLDR gives U+FFFF the highest primary weight so the range holds exactly
+the strings starting with the query. Until the indexes exist, searches fall
+back to DRF's regex behaviour.
+"""
+from collections import OrderedDict
+
+from django.conf import settings
+from pymongo.errors import OperationFailure
+from rest_framework import filters
+from rest_framework.exceptions import NotFound
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+from .db import read_collection
+from .repositories import repository_for, encode_cursor, decode_cursor
+
+TEXT_INDEX_NAME = 'search_text'
+
+# A prefix hit ranks alongside a strong single-field text match
+PREFIX_SCORE = 1.0
+
+# Case-insensitive (strength 2) comparison for prefix ranges and their indexes
+PREFIX_COLLATION = {'locale': 'en', 'strength': 2}
+
+
+def prefix_index_name(field_name):
+    return f'{field_name}_prefix'
+
+
+def search_query(request):
+    """The raw search string, or '' when not searching"""
+    param = filters.SearchFilter.search_param
+    return request.query_params.get(param, '').replace('\x00', '').strip()
+
+
+def exact_lookups(view, request):
+    """The view's filterset fields present in the query string"""
+    return {
+        name: request.query_params[name]
+        for name in getattr(view, 'filterset_fields', [])
+        if name in request.query_params
+    }
+
+
+def ranked_ids(view, query, match=None, limit=None):
+    """
+    Ids matching query, best first, capped at SEARCH_MAX_RESULTS.
+
+    Raises OperationFailure when the collection has no text index.
+    """
+    return rank(
+        view.queryset.model._meta.db_table, query,
+        getattr(view, 'search_prefix_fields', []), match, limit
+    )
+
+
+def rank(collection_name, query, prefix_fields=(), match=None, limit=None):
+    """ranked_ids() for a collection and its prefix-matched fields"""
+    limit = limit or settings.SEARCH_MAX_RESULTS
+    match = match or {}
+    collection = read_collection(collection_name)
+
+    scores = {}
+    hits = collection.find(
+        {**match, '$text': {'$search': query}},
+        {'score': {'$meta': 'textScore'}}
+    ).sort([('score', {'$meta': 'textScore'})]).limit(limit)
+    for document in hits:
+        scores[document['_id']] = document['score']
+
+    prefix = {'$gte': query, '$lt': query + '\uffff'}
+    for name in prefix_fields:
+        # The hint raises OperationFailure (so searches fall back) until the index exists
+        hits = collection.find({**match, name: prefix}, {'_id': 1}).collation(PREFIX_COLLATION).hint(
+            prefix_index_name(name)
+        ).limit(limit)
+        for document in hits:
+            scores[document['_id']] = scores.get(document['_id'], 0) + PREFIX_SCORE
+
+    ranked = sorted(scores, key=scores.get, reverse=True)
+    return ranked[:limit]
+
+
+class TextSearchFilter(filters.SearchFilter):
+    """Drop-in SearchFilter that narrows the queryset using the text index"""
+
+    def filter_queryset(self, request, queryset, view):
+        query = search_query(request)
+        if not query:
+            return queryset
+        # Rank within the filtered rows, or the cap could fill up with others
+        match = repository_for(queryset.model).match(exact_lookups(view, request))
+        try:
+            ids = ranked_ids(view, query, match)
+        except OperationFailure:
+            return super().filter_queryset(request, queryset, view)
+        return queryset.filter(pk__in=ids)
+
+
+class RelevanceSearchMixin:
+    """
+    List search results in relevance order.
+
+    Applies to list requests that search without an explicit ?ordering=;
+    results are paged by offset through the bounded, ranked id list.
+    Searches with an ordering go through TextSearchFilter and the normal
+    cursor pagination instead.
+    """
+    relevance_params = {'search', 'cursor', 'page_size', 'fields', 'exclude'}
+
+    def use_relevance_search(self, request):
+        if not search_query(request) or 'ordering' in request.query_params:
+            return False
+        if TextSearchFilter not in getattr(self, 'filter_backends', []):
+            return False
+        allowed = self.relevance_params | set(getattr(self, 'filterset_fields', []))
+        return set(request.query_params) <= allowed
+
+    def list(self, request, *args, **kwargs):
+        if not self.use_relevance_search(request):
+            return super().list(request, *args, **kwargs)
+
+        repository = repository_for(self.queryset.model)
+        try:
+            ids = ranked_ids(self, search_query(request), repository.match(exact_lookups(self, request)))
+        except OperationFailure:
+            return super().list(request, *args, **kwargs)
+
+        token = request.query_params.get('cursor')
+        try:
+            offset = decode_cursor(token)[0][0] if token else 0
+        except (ValueError, IndexError):
+            raise NotFound('Invalid cursor')
+        page_size = self.paginator.get_page_size(request)
+        page_ids = ids[offset:offset + page_size]
+
+        names = self.load_fields(self.get_serializer_class())
+        documents = {
+            doc['_id']: doc
+            for doc in repository.collection.find(
+                {'_id': {'$in': page_ids}}, dict.fromkeys(names, 1) if names else None
+            )
+        }
+        records = [repository.record(documents[pk]) for pk in page_ids if pk in documents]
+
+        url = request.build_absolute_uri()
+        next_link = previous_link = None
+        if offset + page_size < len(ids):
+            next_link = replace_query_param(url, 'cursor', encode_cursor([offset + page_size]))
+        if offset > 0:
+            previous_link = replace_query_param(url, 'cursor', encode_cursor([max(0, offset - page_size)]))
+
+        return Response(OrderedDict([
+            ('next', next_link),
+            ('previous', previous_link),
+            ('results', self.serialize_list(records)),
+        ]))
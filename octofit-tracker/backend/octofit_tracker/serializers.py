@@ -1,8 +1,126 @@
+from functools import lru_cache
+from operator import attrgetter
+from time import perf_counter
+
 from rest_framework import serializers
+from .instrumentation import current, timed
 from .models import User, Team, Activity, Leaderboard, Workout
 
+SAFE_METHODS = ('GET', 'HEAD')
+
+
+def requested_fields(request, serializer_class, listing=False):
+    """
+    Field names picked by ?fields= and/or ?exclude= (comma-separated), in
+    declaration order, or None when the request selects every field.
+    Only reads are narrowed; unknown names raise ValidationError.
+
+    List reads (`listing`) also leave out the serializer's
+    ``Meta.list_exclude`` unless ?fields= names them.
+    """
+    if request is None or request.method not in SAFE_METHODS:
+        return None
+    params = getattr(request, 'query_params', request.GET)
+    list_exclude = getattr(serializer_class.Meta, 'list_exclude', ()) if listing else ()
+    if 'fields' not in params and 'exclude' not in params and not list_exclude:
+        return None
+
+    available = list(serializer_class.Meta.fields)
+    selected = [name for name in available if name not in list_exclude]
+    for param in ('fields', 'exclude'):
+        if param not in params:
+            continue
+        names = [name.strip() for name in params[param].split(',') if name.strip()]
+        unknown = [name for name in names if name not in available]
+        if unknown:
+            raise serializers.ValidationError({param: f'Unknown field(s): {", ".join(unknown)}'})
+        if param == 'fields':
+            selected = [name for name in available if name in names]
+        else:
+            selected = [name for name in selected if name not in names]
+    return selected
+
+
+@lru_cache(maxsize=None)
+def _bound_fields(serializer_class):
+    return serializer_class().fields
+
+
+def model_fields(serializer_class, names):
+    """
+    Model attributes to load from the database to render `names`.
+
+    Fields computed from the whole object (SerializerMethodField) list what
+    they read in ``Meta.field_sources``.
+    """
+    fields = _bound_fields(serializer_class)
+    needed = {'_id'}
+    sources = getattr(serializer_class.Meta, 'field_sources', {})
+    for name in names:
+        field = fields[name]
+        if field.source == '*':
+            needed.update(sources.get(name, ()))
+        else:
+            needed.add(field.source_attrs[0])
+    return needed
+
 
-class UserSerializer(serializers.ModelSerializer):
+def lean_data(serializer, instances):
+    """
+    The output of ``serializer.data`` for a many=True serializer, as plain
+    dicts built with field lookups resolved once per call instead of once
+    per row. For read-only list pages.
+    """
+    instances = list(instances)  # run any query before timing serialization
+    with timed('serialize'):
+        columns = []
+        for field in serializer.child._readable_fields:
+            if field.source == '*':
+                getter = None
+            elif type(field).get_attribute is serializers.Field.get_attribute:
+                getter = attrgetter('.'.join(field.source_attrs))
+            else:
+                # e.g. ModelField, which reads the model field itself
+                getter = field.get_attribute
+            columns.append((field.field_name, getter, field.to_representation))
+
+        rows = []
+        for instance in instances:
+            row = {}
+            for name, getter, to_representation in columns:
+                value = instance if getter is None else getter(instance)
+                row[name] = None if value is None else to_representation(value)
+            rows.append(row)
+        return rows
+
+
+class TimedMixin:
+    """Report representation time to the request's instrumentation"""
+
+    def to_representation(self, instance):
+        timings = current()
+        if timings is None:
+            return super().to_representation(instance)
+        started = perf_counter()
+        try:
+            return super().to_representation(instance)
+        finally:
+            timings.add('serialize', perf_counter() - started)
+
+
+class SparseFieldsMixin:
+    """Drop the fields a read did not ask for with ?fields= / ?exclude="""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        selected = requested_fields(self.context.get('request'), type(self), self.context.get('listing', False))
+        if selected is not None:
+            for name in list(self.fields):
+                if name not in selected:
+                    self.fields.pop(name)
+
+
+class UserSerializer(TimedMixin, SparseFieldsMixin, serializers.ModelSerializer):
     """Serializer for User model"""
     id = serializers.CharField(source='_id', read_only=True)
     
@@ -13,34 +131,31 @@ class UserSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'created_at']
 
 
-class TeamSerializer(serializers.ModelSerializer):
+class TeamSerializer(TimedMixin, SparseFieldsMixin, serializers.ModelSerializer):
     """Serializer for Team model"""
     id = serializers.CharField(source='_id', read_only=True)
-    member_count = serializers.SerializerMethodField()
     
     class Meta:
         model = Team
         fields = ['id', 'name', 'description', 'created_at', 'members', 'member_count']
-        read_only_fields = ['created_at']
-    
-    def get_member_count(self, obj):
-        """Return the count of members in the team"""
-        return len(obj.members) if obj.members else 0
+        read_only_fields = ['created_at', 'member_count']
+        # Team lists show member_count; members is loaded for ?fields=members or a single team
+        list_exclude = ['members']
 
 
-class ActivitySerializer(serializers.ModelSerializer):
+class ActivitySerializer(TimedMixin, SparseFieldsMixin, serializers.ModelSerializer):
     """Serializer for Activity model"""
     id = serializers.CharField(source='_id', read_only=True)
     
     class Meta:
         model = Activity
-        fields = ['id', 'user_id', 'user_name', 'user_alias', 'activity_type', 
+        fields = ['id', 'user_id', 'user_name', 'user_alias', 'team_id', 'activity_type', 
                   'duration_minutes', 'distance_km', 'calories_burned', 
-                  'points_earned', 'date', 'notes']
-        read_only_fields = ['id']
+                  'points_earned', 'date', 'notes', 'idempotency_key']
+        read_only_fields = ['id', 'team_id']
 
 
-class LeaderboardSerializer(serializers.ModelSerializer):
+class LeaderboardSerializer(TimedMixin, SparseFieldsMixin, serializers.ModelSerializer):
     """Serializer for Leaderboard model"""
     id = serializers.CharField(source='_id', read_only=True)
     
@@ -52,7 +167,7 @@ class LeaderboardSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'updated_at']
 
 
-class WorkoutSerializer(serializers.ModelSerializer):
+class WorkoutSerializer(TimedMixin, SparseFieldsMixin, serializers.ModelSerializer):
     """Serializer for Workout model"""
     id = serializers.CharField(source='_id', read_only=True)
     
@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/4.1/ref/settings/
 """
 
 import os
+from importlib.util import find_spec
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -54,6 +55,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'octofit_tracker.instrumentation.instrumentation_middleware',
     'django.middleware.security.SecurityMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -89,18 +91,74 @@ WSGI_APPLICATION = 'octofit_tracker.wsgi.application'
 # https://docs.djangoproject.com/en/4.1/ref/settings/#databases
 # Using djongo as the database engine to connect Django with MongoDB
 
+# The octofit_tracker.mongo engine is djongo sharing one pooled MongoClient
+# per process (see octofit_tracker/db.py); CLIENT holds its pool options.
+
 DATABASES = {
     'default': {
-        'ENGINE': 'djongo',
+        'ENGINE': 'octofit_tracker.mongo',
         'NAME': 'octofit_db',
         'ENFORCE_SCHEMA': False,
+        'CONN_MAX_AGE': None,
         'CLIENT': {
-            'host': 'localhost',
-            'port': 27017,
+            'host': os.getenv('MONGO_HOST', 'localhost'),
+            'port': int(os.getenv('MONGO_PORT', 27017)),
+            'maxPoolSize': int(os.getenv('MONGO_MAX_POOL_SIZE', 50)),
+            'minPoolSize': int(os.getenv('MONGO_MIN_POOL_SIZE', 0)),
+            'maxIdleTimeMS': int(os.getenv('MONGO_MAX_IDLE_TIME_MS', 60000)),
+            'waitQueueTimeoutMS': int(os.getenv('MONGO_WAIT_QUEUE_TIMEOUT_MS', 5000)),
+            'serverSelectionTimeoutMS': int(os.getenv('MONGO_SERVER_SELECTION_TIMEOUT_MS', 5000)),
+            'connectTimeoutMS': int(os.getenv('MONGO_CONNECT_TIMEOUT_MS', 5000)),
         }
     }
 }
 
+# Read preference per collection for native (pymongo) reads. Leaderboard and
+# workout reads tolerate slight replica lag, so they may go to secondaries.
+MONGO_READ_PREFERENCES = {
+    'leaderboard': os.getenv('MONGO_LEADERBOARD_READ_PREFERENCE', 'SECONDARY_PREFERRED'),
+    'workouts': os.getenv('MONGO_WORKOUTS_READ_PREFERENCE', 'SECONDARY_PREFERRED'),
+}
+
+
+# Cache
+# https://docs.djangoproject.com/en/4.1/topics/cache/
+# The 'api' cache holds rendered leaderboard and workout responses. Each
+# process keeps its own LRU unless API_CACHE_URL points at Redis (or any
+# Redis-protocol compatible server), which shares it across workers and
+# requires the redis package.
+
+API_CACHE_URL = os.getenv('API_CACHE_URL')
+API_CACHE_TIMEOUT = int(os.getenv('API_CACHE_TIMEOUT', 300))
+# Conditional GET (octofit_tracker/conditional.py) validates on the api
+# cache's namespace versions, which a per-process cache keeps apart from the
+# other workers' writes. It is on with a shared cache, or where one process
+# serves the API (API_CACHE_SHARED=true), and off otherwise.
+API_CACHE_SHARED = bool(API_CACHE_URL) or os.getenv('API_CACHE_SHARED', 'false').lower() == 'true'
+# Without a shared cache the in-process workout recommendation index cannot
+# see other workers' writes, so it is rebuilt once this old
+RECOMMENDATION_INDEX_SECONDS = int(os.getenv('RECOMMENDATION_INDEX_SECONDS', 60))
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'api': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'octofit-api',
+        'TIMEOUT': API_CACHE_TIMEOUT,
+        'OPTIONS': {
+            'MAX_ENTRIES': 1024,
+        },
+    },
+}
+if API_CACHE_URL:
+    CACHES['api'] = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': API_CACHE_URL,
+        'TIMEOUT': API_CACHE_TIMEOUT,
+    }
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
@@ -143,6 +201,112 @@ STATIC_URL = 'static/'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Django REST Framework
+# Every list endpoint is cursor-paginated; clients may pick a page size with
+# ?page_size= but never above API_MAX_PAGE_SIZE.
+
+API_MAX_PAGE_SIZE = int(os.getenv('API_MAX_PAGE_SIZE', 500))
+
+# JSON is encoded with orjson (octofit_tracker/renderers.py); MessagePack is
+# offered to clients that ask for it when the msgpack package is installed.
+REST_FRAMEWORK = {
+    'DEFAULT_PAGINATION_CLASS': 'octofit_tracker.pagination.BoundedCursorPagination',
+    'PAGE_SIZE': int(os.getenv('API_PAGE_SIZE', 50)),
+    'DEFAULT_RENDERER_CLASSES': [
+        'octofit_tracker.renderers.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ] + (['octofit_tracker.renderers.MessagePackRenderer'] if find_spec('msgpack') else []),
+}
+
+# Compression of API responses (octofit_tracker/compression.py): brotli when
+# the brotli package is installed and accepted, else gzip. Smaller bodies
+# are sent uncompressed.
+COMPRESS_MIN_SIZE = int(os.getenv('COMPRESS_MIN_SIZE', 1024))
+COMPRESS_GZIP_LEVEL = int(os.getenv('COMPRESS_GZIP_LEVEL', 6))
+COMPRESS_BROTLI_QUALITY = int(os.getenv('COMPRESS_BROTLI_QUALITY', 4))
+
+# Serve list/retrieve reads straight from pymongo instead of through djongo
+API_NATIVE_READS = os.getenv('API_NATIVE_READS', 'false').lower() == 'true'
+
+# Most ranked matches a text search returns (see octofit_tracker/search.py)
+SEARCH_MAX_RESULTS = int(os.getenv('SEARCH_MAX_RESULTS', 1000))
+
+# Admin changelists (octofit_tracker/changelist.py). A filtered changelist
+# counts at most ADMIN_MAX_COUNT rows; field filters list at most
+# ADMIN_FILTER_MAX_CHOICES values and are cached ADMIN_FILTER_CACHE_SECONDS.
+ADMIN_MAX_COUNT = int(os.getenv('ADMIN_MAX_COUNT', 10000))
+ADMIN_FILTER_MAX_CHOICES = int(os.getenv('ADMIN_FILTER_MAX_CHOICES', 100))
+ADMIN_FILTER_CACHE_SECONDS = int(os.getenv('ADMIN_FILTER_CACHE_SECONDS', 300))
+
+# Activity storage (octofit_tracker/timeseries.py): 'collection', or
+# 'timeseries' for a MongoDB time-series collection (MongoDB 7.0+) bucketed by
+# ACTIVITY_TIMESERIES_GRANULARITY ('seconds', 'minutes' or 'hours'). Move
+# existing activities with the migrate_activity_storage command.
+ACTIVITY_STORAGE = os.getenv('ACTIVITY_STORAGE', 'collection')
+ACTIVITY_TIMESERIES_GRANULARITY = os.getenv('ACTIVITY_TIMESERIES_GRANULARITY', 'hours')
+# Age after which a claimed idempotency key with no stored activity (its
+# writer died before inserting) may be claimed again
+ACTIVITY_KEY_CLAIM_SECONDS = int(os.getenv('ACTIVITY_KEY_CLAIM_SECONDS', 60))
+
+# Largest batch accepted by POST /api/activities/bulk/
+ACTIVITY_BULK_MAX_BATCH = int(os.getenv('ACTIVITY_BULK_MAX_BATCH', 1000))
+
+# Leaderboard writers in every process take a lease of at most
+# LEADERBOARD_LOCK_SECONDS; a rebuild holds a lease of
+# LEADERBOARD_REBUILD_LEASE_SECONDS, renewed with every batch it writes, so
+# one that died stops blocking the next within that time.
+LEADERBOARD_LOCK_SECONDS = int(os.getenv('LEADERBOARD_LOCK_SECONDS', 30))
+LEADERBOARD_REBUILD_LEASE_SECONDS = int(os.getenv('LEADERBOARD_REBUILD_LEASE_SECONDS', 60))
+
+# Live leaderboard stream (octofit_tracker/live.py). Bursts of writes are
+# coalesced into at most one update per LIVE_LEADERBOARD_INTERVAL seconds.
+# Writers notify streams through PUBSUB_BACKEND; the in-memory backend only
+# reaches streams in the same process, so set PUBSUB_URL to a Redis server
+# (requires the redis package) when writes and streams run in separate
+# processes.
+
+LIVE_LEADERBOARD_INTERVAL = float(os.getenv('LIVE_LEADERBOARD_INTERVAL', 1.0))
+LIVE_LEADERBOARD_SIZE = int(os.getenv('LIVE_LEADERBOARD_SIZE', 10))
+LIVE_KEEPALIVE = float(os.getenv('LIVE_KEEPALIVE', 15))
+PUBSUB_URL = os.getenv('PUBSUB_URL')
+PUBSUB_BACKEND = (
+    'octofit_tracker.pubsub.RedisPubSub' if PUBSUB_URL else 'octofit_tracker.pubsub.InMemoryPubSub'
+)
+
+# Fraction of sync requests run under cProfile (octofit_tracker/instrumentation.py);
+# the aggregate is served at /metrics/profile/
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', 0))
+
+# Background jobs (octofit_tracker/jobs.py), run by `manage.py run_jobs`.
+# Retries back off from JOB_RETRY_DELAY seconds, doubling each attempt;
+# writes that queue a recompute wait JOB_COALESCE_SECONDS so a burst of them
+# shares one run.
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', 5))
+JOB_RETRY_DELAY = float(os.getenv('JOB_RETRY_DELAY', 10))
+JOB_LEASE_SECONDS = int(os.getenv('JOB_LEASE_SECONDS', 600))
+JOB_POLL_INTERVAL = float(os.getenv('JOB_POLL_INTERVAL', 1.0))
+JOB_COALESCE_SECONDS = float(os.getenv('JOB_COALESCE_SECONDS', 5))
+
+# Rows read from MongoDB and encoded per chunk of a streaming export
+EXPORT_BATCH_SIZE = int(os.getenv('EXPORT_BATCH_SIZE', 1000))
+
+# Cache-Control on successful GETs, keyed by route name ('<basename>-<action>',
+# e.g. 'leaderboard-top-ten') or basename, else 'default'. List, retrieve and
+# the cached leaderboard/workout actions also answer If-None-Match and
+# If-Modified-Since (octofit_tracker/conditional.py) when API_CACHE_SHARED is
+# on, so no-cache costs a cheap revalidation rather than a full response.
+CACHE_CONTROL = {
+    'default': 'no-cache',
+    'leaderboard': 'public, max-age=10, stale-while-revalidate=60',
+    'leaderboard-export': 'no-store',
+    'activity-export': 'no-store',
+    'workout': 'public, max-age=300, stale-while-revalidate=3600',
+    'workout-recommend': 'private, no-cache',
+}
+
+# Longest date range, in days, the rollup stats endpoints answer
+STATS_MAX_DAYS = int(os.getenv('STATS_MAX_DAYS', 731))
+
 # CORS Configuration
 CORS_ALLOW_ALL_ORIGINS = True
 CORS_ALLOW_CREDENTIALS = True
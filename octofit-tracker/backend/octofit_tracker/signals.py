@@ -0,0 +1,163 @@
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import IntegrityError
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+
+from . import jobs, leaderboard, membership, response_cache, rollups, timeseries
+from .db import get_db
+from .models import Activity, Team, User
+
+
+@receiver(pre_save, sender=Activity)
+def denormalize_activity_team(sender, instance, raw=False, **kwargs):
+    """Copy the user's team onto a new activity so team queries skip users"""
+    if raw or instance.team_id:
+        return
+    user = get_db().users.find_one(
+        {'_id': {'$in': leaderboard.id_variants(instance.user_id)}}, {'team': 1}
+    )
+    instance.team_id = (user or {}).get('team') or ''
+
+
+@receiver(pre_save, sender=Activity)
+def claim_idempotency_key(sender, instance, raw=False, **kwargs):
+    """Claim a new activity's key where no unique index guards it (see timeseries.py)"""
+    key = instance.idempotency_key
+    if raw or instance.pk is not None or not key:
+        return
+    db = get_db()
+    if not timeseries.is_timeseries(db.activities):
+        return
+    if db.activities.find_one({'idempotency_key': key}, {'_id': 1}) or not timeseries.claim_keys(db, [key]):
+        raise IntegrityError(f'Duplicate idempotency_key {key!r}')
+
+
+@receiver(pre_save, sender=Activity)
+def remember_previous(sender, instance, raw=False, **kwargs):
+    """Stash the stored values of an activity about to be updated"""
+    instance._previous = None
+    if raw or instance.pk is None:
+        return
+    instance._previous = Activity.objects.filter(pk=instance.pk).values(*rollups.FIELDS).first()
+
+
+@receiver(post_save, sender=Activity)
+def update_leaderboard_on_save(sender, instance, created, raw=False, **kwargs):
+    """Move the activity's points onto the user and leaderboard"""
+    if raw:
+        return
+    deltas = defaultdict(int)
+    previous = getattr(instance, '_previous', None)
+    if previous is not None:
+        deltas[str(previous['user_id'])] -= previous['points_earned'] or 0
+    deltas[str(instance.user_id)] += instance.points_earned or 0
+    leaderboard.apply_deltas(deltas)
+
+
+@receiver(post_delete, sender=Activity)
+def update_leaderboard_on_delete(sender, instance, **kwargs):
+    """Take a deleted activity's points back off the user and leaderboard"""
+    leaderboard.apply_deltas({instance.user_id: -(instance.points_earned or 0)})
+
+
+@receiver(post_delete, sender=Activity)
+def release_idempotency_key(sender, instance, **kwargs):
+    """Free a deleted activity's key, as dropping it from a unique index would"""
+    if instance.idempotency_key:
+        timeseries.release_keys(get_db(), [instance.idempotency_key])
+
+
+def rollup_fields(instance):
+    return {field: getattr(instance, field) for field in rollups.FIELDS}
+
+
+@receiver(post_save, sender=Activity)
+def update_rollups_on_save(sender, instance, raw=False, **kwargs):
+    """Move the activity's totals onto its user, team and type rollups"""
+    if raw:
+        return
+    previous = getattr(instance, '_previous', None)
+    rollups.apply(added=[rollup_fields(instance)], removed=[previous] if previous else [])
+
+
+@receiver(post_delete, sender=Activity)
+def update_rollups_on_delete(sender, instance, **kwargs):
+    """Take a deleted activity's totals back off its rollups"""
+    rollups.apply(removed=[rollup_fields(instance)])
+
+
+# Changes apply_deltas() cannot express (a user changing team, points edited
+# by hand, users or teams removed or renamed) queue a leaderboard rebuild.
+# The delay coalesces a burst of such writes into one rebuild.
+RANKED_USER_FIELDS = ('team', 'total_points', 'name', 'alias')
+
+
+@receiver(pre_save, sender=User)
+def remember_previous_ranking(sender, instance, raw=False, **kwargs):
+    """Stash the stored ranking fields of a user about to be updated"""
+    instance._previous = None
+    if raw or instance.pk is None:
+        return
+    instance._previous = User.objects.filter(pk=instance.pk).values(*RANKED_USER_FIELDS).first()
+
+
+def queue_leaderboard_rebuild():
+    jobs.enqueue('rebuild_leaderboard', delay=settings.JOB_COALESCE_SECONDS)
+
+
+@receiver(post_save, sender=User)
+def rerank_on_user_change(sender, instance, created, raw=False, **kwargs):
+    """Rebuild the boards when a user's team, name or points were edited"""
+    previous = getattr(instance, '_previous', None)
+    if raw or previous is None:
+        return
+    if any(previous[field] != getattr(instance, field) for field in RANKED_USER_FIELDS):
+        queue_leaderboard_rebuild()
+
+
+@receiver(post_save, sender=User)
+def update_membership_on_save(sender, instance, created, raw=False, **kwargs):
+    """Move a new or re-teamed user between teams' member lists"""
+    if raw:
+        return
+    previous = getattr(instance, '_previous', None)
+    if created or previous is None:
+        membership.join(instance.team, instance._id)
+    else:
+        membership.move(instance._id, previous['team'], instance.team)
+
+
+@receiver(post_delete, sender=User)
+def update_membership_on_delete(sender, instance, **kwargs):
+    membership.leave(instance.team, instance._id)
+
+
+@receiver(pre_save, sender=Team)
+def count_members(sender, instance, raw=False, **kwargs):
+    """Keep member_count in step with a members list written through the ORM"""
+    instance.member_count = len(instance.members or [])
+
+
+@receiver(post_save, sender=Team)
+def rerank_on_team_change(sender, instance, created, raw=False, **kwargs):
+    """Rebuild the boards when a team is edited (e.g. renamed)"""
+    if not raw and not created:
+        queue_leaderboard_rebuild()
+
+
+@receiver(post_delete, sender=User)
+@receiver(post_delete, sender=Team)
+def rerank_on_delete(sender, instance, **kwargs):
+    """Rebuild the boards without a deleted user or team"""
+    queue_leaderboard_rebuild()
+
+
+# Registered last so caches are invalidated after the leaderboard has moved
+@receiver(post_save)
+@receiver(post_delete)
+def invalidate_response_cache(sender, **kwargs):
+    """Bump the cached-response namespaces a model write makes stale"""
+    for namespace in response_cache.INVALIDATES.get(sender, ()):
+        response_cache.invalidate(namespace)
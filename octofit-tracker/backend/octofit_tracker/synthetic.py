@@ -0,0 +1,215 @@
+"""
+Synthetic data generator for performance testing.
+
+Users are generated in fixed-size chunks spread over worker processes. Each
+chunk is seeded from the global seed and its first user index, so a given set
+of options produces the same users and activities (apart from their ObjectIds)
+however many workers run it. Activities are
+streamed to MongoDB in fixed-size ``insert_many`` batches and each user's
+total points are summed while their activities are generated, so memory stays
+bounded by the batch size and no second pass over activities is needed.
+"""
+import random
+from datetime import timedelta
+
+from bson import ObjectId
+from django.db import connection
+from django.utils import timezone
+from pymongo import UpdateOne
+
+from . import merge
+from .db import get_client
+from .models import DIFFICULTY_LEVELS
+
+FIRST_NAMES = [
+    'Ada', 'Alan', 'Grace', 'Linus', 'Margaret', 'Dennis', 'Barbara', 'Ken',
+    'Radia', 'Guido', 'Frances', 'Tim', 'Katherine', 'Edsger', 'Hedy', 'John',
+]
+LAST_NAMES = [
+    'Lovelace', 'Turing', 'Hopper', 'Torvalds', 'Hamilton', 'Ritchie', 'Liskov',
+    'Thompson', 'Perlman', 'Rossum', 'Allen', 'Berners-Lee', 'Johnson', 'Dijkstra',
+]
+ALIAS_WORDS = [
+    'Swift', 'Iron', 'Silent', 'Crimson', 'Cosmic', 'Atomic', 'Shadow', 'Storm',
+    'Falcon', 'Titan', 'Phantom', 'Comet', 'Viper', 'Blaze', 'Nova', 'Quake',
+]
+
+# activity type -> (minutes range, calories per minute, km per minute or None, points per minute)
+ACTIVITY_PROFILES = {
+    'running': ((15, 90), 11, 0.17, 1.2),
+    'cycling': ((20, 180), 9, 0.4, 1.0),
+    'swimming': ((15, 75), 10, 0.04, 1.3),
+    'weightlifting': ((20, 90), 6, None, 0.9),
+    'yoga': ((15, 75), 4, None, 0.6),
+    'martial arts': ((30, 120), 10, None, 1.1),
+    'flying': ((10, 60), 8, 2.0, 1.5),
+    'web-slinging': ((10, 60), 12, 0.5, 1.4),
+}
+ACTIVITY_TYPES = list(ACTIVITY_PROFILES)
+
+CHUNK_USERS = 1000
+
+# User fields populate_db --merge sets only on insert: derived or per-write
+USER_INSERT_ONLY = ('_id', 'total_points', 'created_at', 'last_active')
+
+
+def make_teams(count):
+    """Team documents team-001 .. team-<count>"""
+    now = timezone.now()
+    return [
+        {
+            '_id': f'team-{index:03d}',
+            'name': f'Team {ALIAS_WORDS[index % len(ALIAS_WORDS)]} {index}',
+            'description': f'Synthetic team {index}',
+            'created_at': now,
+            'members': [],
+            'member_count': 0,
+        }
+        for index in range(1, count + 1)
+    ]
+
+
+def make_activity(rng, user, now, days):
+    """One activity for a user with type-consistent duration, distance and points"""
+    activity_type = rng.choice(ACTIVITY_TYPES)
+    (low, high), calories_per_minute, km_per_minute, points_per_minute = ACTIVITY_PROFILES[activity_type]
+    minutes = rng.randint(low, high)
+    intensity = rng.uniform(0.7, 1.3)
+    return {
+        'user_id': str(user['_id']),
+        'user_name': user['name'],
+        'user_alias': user['alias'],
+        'team_id': user['team'],
+        'activity_type': activity_type,
+        'duration_minutes': minutes,
+        'distance_km': round(minutes * km_per_minute * intensity, 2) if km_per_minute else None,
+        'calories_burned': int(minutes * calories_per_minute * intensity),
+        'points_earned': max(1, int(minutes * points_per_minute * intensity)),
+        'date': now - timedelta(minutes=rng.randint(0, days * 24 * 60)),
+        'notes': '',
+    }
+
+
+def generate_users(options, rng, now):
+    """Yield (user, activities) for users [start, stop) of a chunk"""
+    for index in range(options['start'], options['stop']):
+        first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+        team_id = f"team-{index % options['teams'] + 1:03d}" if options['teams'] else ''
+        user = {
+            '_id': ObjectId(),
+            'name': f'{first} {last}',
+            'email': f'user{index}@octofit.test',
+            'alias': f'{rng.choice(ALIAS_WORDS)} {rng.choice(ALIAS_WORDS)} {index}',
+            'team': team_id,
+            'fitness_level': rng.choice(DIFFICULTY_LEVELS),
+            'total_points': 0,
+            'created_at': now - timedelta(days=rng.randint(options['days'], options['days'] * 2)),
+            'last_active': now,
+        }
+        # Vary volume per user around the requested mean
+        mean = options['activities_per_user']
+        activities = []
+        for number in range(rng.randint(mean // 2, mean + mean // 2) if mean > 1 else mean):
+            activity = make_activity(rng, user, now, options['days'])
+            # Natural key, so populate_db --merge can match reseeded activities
+            activity['idempotency_key'] = f"seed:{user['email']}:{number}"
+            user['total_points'] += activity['points_earned']
+            activities.append(activity)
+        yield user, activities
+
+
+def generate_chunk(options):
+    """
+    Generate and insert users [start, stop) with their activities.
+
+    Runs in a worker process; returns (users, activities) inserted.
+    """
+    rng = random.Random(f"{options['seed']}:{options['start']}")
+    db = get_client()[connection.settings_dict['NAME']]
+    batch_size = options['batch_size']
+
+    users, activities, members = [], [], {}
+    user_count = activity_count = 0
+
+    def flush_activities():
+        nonlocal activity_count
+        if activities:
+            db.activities.insert_many(activities, ordered=False)
+            activity_count += len(activities)
+            activities.clear()
+
+    def flush_users():
+        nonlocal user_count
+        if users:
+            db.users.insert_many(users, ordered=False)
+            user_count += len(users)
+            users.clear()
+        for team_id, ids in members.items():
+            db.teams.update_one(
+                {'_id': team_id}, {'$push': {'members': {'$each': ids}}, '$inc': {'member_count': len(ids)}}
+            )
+        members.clear()
+
+    for user, user_activities in generate_users(options, rng, timezone.now()):
+        for activity in user_activities:
+            activities.append(activity)
+            if len(activities) >= batch_size:
+                flush_activities()
+
+        users.append(user)
+        if user['team']:
+            members.setdefault(user['team'], []).append(user['_id'])
+        if len(users) >= batch_size:
+            flush_users()
+
+    flush_activities()
+    flush_users()
+    return user_count, activity_count
+
+
+def merge_chunk(options):
+    """
+    Upsert users [start, stop) with their activities (populate_db --merge).
+
+    Activity dates are anchored to the start of today (UTC), so reseeding
+    with the same seed on the same day matches every stored document. Runs
+    in a worker process; returns the chunk's merge.Summary.
+    """
+    rng = random.Random(f"{options['seed']}:{options['start']}")
+    db = get_client()[connection.settings_dict['NAME']]
+    batch_size = options['batch_size']
+    summary = merge.Summary(options['max_deltas'])
+    today = timezone.now().replace(hour=0, minute=0, second=0, microsecond=0)
+
+    users, activities = [], []
+
+    def flush():
+        result = merge.upsert_many(db.users, users, 'email', USER_INSERT_ONLY)
+        summary.users(result)
+        for activity in activities:
+            activity['user_id'] = str(result.ids[activity.pop('email')])
+        summary.activities(merge.upsert_many(db.activities, activities, 'idempotency_key'), db)
+        users.clear()
+        activities.clear()
+
+    for user, user_activities in generate_users(options, rng, today):
+        user['total_points'] = 0  # added back by the activity deltas
+        users.append(user)
+        for activity in user_activities:
+            activity['email'] = user['email']
+            activities.append(activity)
+        if len(users) >= batch_size or len(activities) >= batch_size:
+            flush()
+    flush()
+    return summary
+
+
+def chunks(options, size=CHUNK_USERS):
+    """Split the user range into chunk option dicts of `size` users"""
+    for start in range(0, options['users'], size):
+        yield {**options, 'start': start, 'stop': min(start + size, options['users'])}
+
+
+def total_points_updates(totals):
+    """UpdateOne operations setting total_points from a user id -> points mapping"""
+    return [UpdateOne({'_id': user_id}, {'$set': {'total_points': points}}) for user_id, points in totals.items()]
@@ -1,9 +1,24 @@
-from django.test import TestCase
+import asyncio
+from io import StringIO
+
+from asgiref.sync import sync_to_async
+
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
 from rest_framework.test import APITestCase, APIClient
 from rest_framework import status
 from django.urls import reverse
-from .models import User, Team, Activity, Leaderboard, Workout
-from datetime import datetime
+from . import benchmarks, indexes, jobs, leaderboard, live, renderers
+from .db import get_client, get_db
+from .models import User, Team, Activity, Leaderboard, Workout, Job
+from datetime import datetime, timezone
+from decimal import Decimal
+import gzip
+import json
+import re
+import time
 
 
 class UserModelTest(TestCase):
@@ -120,11 +135,23 @@ class APIEndpointTests(APITestCase):
         self.assertIn('leaderboard', response.data)
         self.assertIn('workouts', response.data)
     
+    def test_pool_stats(self):
+        """Test that the ORM borrows the shared client and pool stats are exposed to staff only"""
+        from django.contrib.auth import get_user_model
+        connection.ensure_connection()
+        self.assertIs(connection.client_connection, get_client())
+        response = self.client.get(reverse('pool-stats'))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.client.force_login(get_user_model().objects.create_user('staff', is_staff=True))
+        response = self.client.get(reverse('pool-stats'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('maxPoolSize', response.data['options'])
+    
     def test_user_list(self):
         """Test that the user list endpoint works"""
         response = self.client.get(reverse('user-list'))
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertGreater(len(response.data), 0)
+        self.assertGreater(len(response.data['results']), 0)
     
     def test_user_detail(self):
         """Test that the user detail endpoint works"""
@@ -136,7 +163,7 @@ class APIEndpointTests(APITestCase):
         """Test that the team list endpoint works"""
         response = self.client.get(reverse('team-list'))
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertGreater(len(response.data), 0)
+        self.assertGreater(len(response.data['results']), 0)
     
     def test_team_detail(self):
         """Test that the team detail endpoint works"""
@@ -185,6 +212,22 @@ class APIEndpointTests(APITestCase):
         }
         response = self.client.post(reverse('activity-list'), data, format='json')
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+    
+    def test_activity_list_is_cursor_paginated(self):
+        """Test that list pages are bounded and linked by cursor"""
+        for minutes in range(3):
+            Activity.objects.create(
+                user_id=str(self.user._id), user_name='API Test Hero',
+                user_alias='API Man', activity_type='running',
+                duration_minutes=minutes + 10, calories_burned=100, points_earned=10
+            )
+        response = self.client.get(reverse('activity-list'), {'page_size': 2})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['results']), 2)
+        self.assertIsNotNone(response.data['next'])
+        response = self.client.get(response.data['next'])
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertIsNone(response.data['next'])
 
 
 class LeaderboardTests(APITestCase):
@@ -216,12 +259,1234 @@ class LeaderboardTests(APITestCase):
         """Test the individual leaderboard endpoint"""
         response = self.client.get(reverse('leaderboard-individual'))
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
-        self.assertEqual(response.data[0]['type'], 'individual')
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertEqual(response.data['results'][0]['type'], 'individual')
     
     def test_leaderboard_teams(self):
         """Test the team leaderboard endpoint"""
         response = self.client.get(reverse('leaderboard-teams'))
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
-        self.assertEqual(response.data[0]['type'], 'team')
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertEqual(response.data['results'][0]['type'], 'team')
+
+
+class LeaderboardEngineTests(APITestCase):
+    """Test cases for incremental leaderboard maintenance"""
+    
+    def setUp(self):
+        self.client = APIClient()
+        
+        self.leader = User.objects.create(
+            name='Leader', email='leader@example.com', alias='Leader',
+            team='marvel', total_points=200
+        )
+        self.chaser = User.objects.create(
+            name='Chaser', email='chaser@example.com', alias='Chaser',
+            team='marvel', total_points=100
+        )
+        for rank, user in enumerate([self.leader, self.chaser], start=1):
+            Leaderboard.objects.create(
+                user_id=str(user._id), user_name=user.name, user_alias=user.alias,
+                team=user.team, total_points=user.total_points, rank=rank,
+                type='individual'
+            )
+    
+    def _rank(self, user):
+        return Leaderboard.objects.get(type='individual', user_id=str(user._id)).rank
+    
+    def test_activity_create_moves_ranks(self):
+        """Test that creating an activity updates points and swaps ranks"""
+        data = {
+            'user_id': str(self.chaser._id),
+            'user_name': 'Chaser',
+            'user_alias': 'Chaser',
+            'activity_type': 'running',
+            'duration_minutes': 30,
+            'calories_burned': 300,
+            'points_earned': 150
+        }
+        response = self.client.post(reverse('activity-list'), data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(User.objects.get(pk=self.chaser._id).total_points, 250)
+        self.assertEqual(self._rank(self.chaser), 1)
+        self.assertEqual(self._rank(self.leader), 2)
+        team_row = Leaderboard.objects.get(type='team', team_id='marvel')
+        self.assertEqual(team_row.total_points, 450)
+    
+    def test_rebuild_swaps_in_complete_board(self):
+        """Test that a rebuild replaces the board in one step and cleans up after itself"""
+        leaderboard.rebuild()
+        db = get_db()
+        rows = list(db.leaderboard.find({'type': 'individual'}).sort('rank'))
+        self.assertEqual([row['user_id'] for row in rows], [str(self.leader._id), str(self.chaser._id)])
+        self.assertEqual(db.leaderboard.find_one({'type': 'team'})['total_points'], 300)
+        self.assertFalse([
+            name for name in db.list_collection_names() if name.startswith(leaderboard.REBUILD_COLLECTION)
+        ])
+    
+    def test_writes_during_rebuild_are_noted(self):
+        """Test that writers note what they touch while a rebuild runs, and rebuilds do not overlap"""
+        from datetime import timedelta
+        from django.utils import timezone as django_timezone
+        db = get_db()
+        db[leaderboard.LOCKS].update_one(
+            {'_id': leaderboard.LOCK_ID},
+            {'$set': {'rebuilding_until': django_timezone.now() + timedelta(minutes=5)}}, upsert=True
+        )
+        try:
+            leaderboard.apply_deltas({str(self.chaser._id): 10})
+            touched = {(entry['type'], entry['key']) for entry in db[leaderboard.TOUCHED].find()}
+            self.assertEqual(touched, {('individual', self.chaser._id), ('team', 'marvel')})
+            with self.assertRaises(RuntimeError):
+                leaderboard.rebuild()
+        finally:
+            db[leaderboard.LOCKS].delete_many({})
+            db[leaderboard.TOUCHED].delete_many({})
+    
+    def test_dead_rebuild_does_not_block(self):
+        """Test that the expired lease of a rebuild whose process died lets the next one run"""
+        from datetime import timedelta
+        from django.utils import timezone as django_timezone
+        db = get_db()
+        db[leaderboard.LOCKS].update_one(
+            {'_id': leaderboard.LOCK_ID},
+            {'$set': {'rebuild_owner': 'dead', 'rebuilding_until': django_timezone.now() - timedelta(seconds=1)}},
+            upsert=True
+        )
+        db[f'{leaderboard.REBUILD_COLLECTION}_dead'].insert_one({'type': 'individual', 'rank': 1})
+        try:
+            self.assertEqual(leaderboard.rebuild(), 3)
+            lock = db[leaderboard.LOCKS].find_one({'_id': leaderboard.LOCK_ID})
+            self.assertIsNone(lock['rebuild_owner'])
+            self.assertNotIn(f'{leaderboard.REBUILD_COLLECTION}_dead', db.list_collection_names())
+        finally:
+            db[leaderboard.LOCKS].delete_many({})
+    
+    def test_missing_row_starts_from_real_total(self):
+        """Test that a user without a board row gets one with their full total and rank"""
+        newcomer = User.objects.create(
+            name='Newcomer', email='newcomer@example.com', alias='Newcomer', total_points=120
+        )
+        Activity.objects.create(
+            user_id=str(newcomer._id), user_name='Newcomer', user_alias='Newcomer',
+            activity_type='running', duration_minutes=30,
+            calories_burned=300, points_earned=30
+        )
+        row = Leaderboard.objects.get(type='individual', user_id=str(newcomer._id))
+        self.assertEqual((row.total_points, row.rank), (150, 2))
+        self.assertEqual(self._rank(self.leader), 1)
+        self.assertEqual(self._rank(self.chaser), 3)
+    
+    def test_activity_delete_restores_ranks(self):
+        """Test that deleting an activity takes its points back"""
+        activity = Activity.objects.create(
+            user_id=str(self.chaser._id), user_name='Chaser', user_alias='Chaser',
+            activity_type='running', duration_minutes=30,
+            calories_burned=300, points_earned=150
+        )
+        activity.delete()
+        self.assertEqual(User.objects.get(pk=self.chaser._id).total_points, 100)
+        self.assertEqual(self._rank(self.leader), 1)
+        self.assertEqual(self._rank(self.chaser), 2)
+
+
+class TeamAggregationTests(APITestCase):
+    """Test cases for team-level queries"""
+    
+    def setUp(self):
+        self.client = APIClient()
+        self.team = Team.objects.create(_id='agg_team', name='Aggregation Team')
+        self.user = User.objects.create(
+            name='Team Player', email='player@example.com', alias='Player', team='agg_team'
+        )
+        for activity_type, points in [('running', 30), ('running', 20), ('yoga', 10)]:
+            Activity.objects.create(
+                user_id=str(self.user._id), user_name='Team Player', user_alias='Player',
+                activity_type=activity_type, duration_minutes=30,
+                calories_burned=200, points_earned=points
+            )
+    
+    def test_activity_team_is_denormalized(self):
+        """Test that new activities carry the user's team"""
+        self.assertEqual(Activity.objects.filter(team_id='agg_team').count(), 3)
+    
+    def test_team_activities(self):
+        """Test that the team activity feed is served by team_id"""
+        response = self.client.get(reverse('team-activities', args=['agg_team']))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['results']), 3)
+
+    def test_nested_routes_use_their_own_ordering(self):
+        """Test that nested pages ignore the parent view's ordering, with or without ?fields="""
+        User.objects.create(name='Captain', email='captain@example.com', team='agg_team', total_points=100)
+        routes = [
+            (reverse('user-activities', args=[str(self.user._id)]), 'points_earned', [10, 20, 30]),
+            (reverse('team-activities', args=['agg_team']), 'points_earned', [10, 20, 30]),
+            (reverse('team-members', args=['agg_team']), 'name', ['Captain', 'Team Player']),
+        ]
+        for url, field, expected in routes:
+            for params in ({}, {'fields': f'id,{field}'}, {'ordering': 'name'}):
+                response = self.client.get(url, params)
+                self.assertEqual(response.status_code, status.HTTP_200_OK, (url, params))
+                self.assertEqual([row[field] for row in response.data['results']], expected, (url, params))
+    
+    def test_team_summary(self):
+        """Test the aggregated team summary"""
+        response = self.client.get(reverse('team-summary', args=['agg_team']))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['member_count'], 1)
+        self.assertEqual(response.data['total_points'], 60)
+        self.assertEqual(response.data['by_activity_type'][0]['activity_type'], 'running')
+        self.assertEqual(response.data['by_activity_type'][0]['total_points'], 50)
+
+
+class TeamMembershipTests(APITestCase):
+    """Test cases for the denormalised team member_count"""
+    
+    def setUp(self):
+        self.client = APIClient()
+        Team.objects.create(_id='red', name='Red Team')
+        Team.objects.create(_id='blue', name='Blue Team')
+    
+    def _team(self, team_id):
+        return get_db().teams.find_one({'_id': team_id})
+    
+    def _round_trips(self, response):
+        return int(re.search(r'(\d+) round trips', response['Server-Timing']).group(1))
+    
+    def test_counter_follows_membership(self):
+        """Test that joins, team changes and deletes move member_count atomically"""
+        first = User.objects.create(name='First', email='first@example.com', team='red')
+        second = User.objects.create(name='Second', email='second@example.com', team='red')
+        self.assertEqual(self._team('red')['member_count'], 2)
+        second.team = 'blue'
+        second.save()
+        second.save()
+        self.assertEqual(self._team('red')['member_count'], 1)
+        self.assertEqual(self._team('blue')['members'], [second._id])
+        self.assertEqual(self._team('blue')['member_count'], 1)
+        first.delete()
+        self.assertEqual(self._team('red')['members'], [])
+        self.assertEqual(self._team('red')['member_count'], 0)
+    
+    def test_list_leaves_out_members(self):
+        """Test that team lists show member_count without loading members"""
+        User.objects.create(name='Member', email='member@example.com', team='red')
+        response = self.client.get(reverse('team-list'))
+        team = next(row for row in response.data['results'] if row['id'] == 'red')
+        self.assertNotIn('members', team)
+        self.assertEqual(team['member_count'], 1)
+        response = self.client.get(reverse('team-list'), {'fields': 'id,members'})
+        self.assertEqual(len(next(row for row in response.data['results'] if row['id'] == 'red')['members']), 1)
+        response = self.client.get(reverse('team-detail', args=['red']))
+        self.assertEqual(len(response.data['members']), 1)
+    
+    def test_constant_round_trips(self):
+        """Test that list and member pages cost the same round trips however many rows"""
+        def measure():
+            urls = [
+                reverse('team-list'),
+                reverse('team-members', args=['red']),
+                reverse('user-activities', args=[str(user._id)]),
+            ]
+            responses = [self.client.get(url) for url in urls]
+            for url, response in zip(urls, responses):
+                self.assertEqual(response.status_code, status.HTTP_200_OK, url)
+            return [self._round_trips(response) for response in responses]
+        user = User.objects.create(name='Only', email='only@example.com', team='red')
+        before = measure()
+        for index in range(5):
+            Team.objects.create(_id=f'extra-{index}', name=f'Extra {index}')
+            User.objects.create(name=f'More {index}', email=f'more{index}@example.com', team='red')
+        self.assertEqual(measure(), before)
+    
+    def test_unknown_id_is_not_found(self):
+        """Test that detail actions answer 404 for an id that does not exist"""
+        for name in ('user-activities', 'user-stats'):
+            response = self.client.get(reverse(name, args=['000000000000000000000000']))
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND, name)
+        for name in ('team-members', 'team-activities', 'team-summary', 'team-stats'):
+            response = self.client.get(reverse(name, args=['no-such-team']))
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND, name)
+
+
+class ResponseCacheTests(APITestCase):
+    """Test cases for cached read endpoints"""
+    
+    def setUp(self):
+        self.client = APIClient()
+        caches['api'].clear()
+        Workout.objects.create(
+            name='Cached Workout', description='Served from cache',
+            difficulty='beginner', duration_minutes=20, category='cardio'
+        )
+    
+    def test_etag_revalidation(self):
+        """Test that a matching If-None-Match returns 304"""
+        response = self.client.get(reverse('workout-by-difficulty'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag = response['ETag']
+        response = self.client.get(reverse('workout-by-difficulty'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+    
+    def test_write_invalidates(self):
+        """Test that a workout write is visible on the next read"""
+        response = self.client.get(reverse('workout-by-difficulty'))
+        self.assertEqual(len(response.data['beginner']), 1)
+        Workout.objects.create(
+            name='Second Workout', description='New entry',
+            difficulty='beginner', duration_minutes=25, category='cardio'
+        )
+        response = self.client.get(reverse('workout-by-difficulty'))
+        self.assertEqual(len(response.data['beginner']), 2)
+
+
+@override_settings(API_CACHE_SHARED=True)
+class ConditionalGetTests(APITestCase):
+    """Test cases for ETag/Last-Modified revalidation and Cache-Control"""
+
+    def setUp(self):
+        self.client = APIClient()
+        caches['api'].clear()
+        self.workout = Workout.objects.create(
+            name='Conditional Workout', description='Revalidated',
+            difficulty='beginner', duration_minutes=20, category='cardio',
+            created_at=datetime(2024, 1, 1, tzinfo=timezone.utc)
+        )
+        # As if the last write were a minute ago: no Last-Modified within its second
+        self._changed(time.time() - 60)
+
+    def _changed(self, at):
+        from . import response_cache
+        caches['api'].set(response_cache._changed_key(response_cache.WORKOUTS), int(at), timeout=None)
+
+    def test_if_none_match(self):
+        """Test that list and retrieve answer a matching ETag with 304"""
+        for url in (reverse('workout-list'), reverse('workout-detail', args=[self.workout._id])):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertIn('Last-Modified', response)
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+            self.assertEqual(response.content, b'')
+
+    def test_if_modified_since(self):
+        """Test that an unchanged collection answers If-Modified-Since with 304"""
+        response = self.client.get(reverse('workout-list'))
+        response = self.client.get(reverse('workout-list'), HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_no_last_modified_in_the_second_of_a_write(self):
+        """Test that If-Modified-Since cannot validate a response whose last write shares its second"""
+        from django.utils.http import http_date
+        now = time.time() + 5  # stays "the current second" for the whole test
+        self._changed(now)
+        response = self.client.get(reverse('workout-list'))
+        self.assertNotIn('Last-Modified', response)
+        response = self.client.get(reverse('workout-list'), HTTP_IF_MODIFIED_SINCE=http_date(int(now)))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_write_changes_etag(self):
+        """Test that an update leaving created_at alone still changes the ETag"""
+        etag = self.client.get(reverse('workout-list'))['ETag']
+        self.workout.duration_minutes = 30
+        self.workout.save()
+        response = self.client.get(reverse('workout-list'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'][0]['duration_minutes'], 30)
+
+    def test_etag_varies_with_query(self):
+        """Test that another page or filter is not validated by this ETag"""
+        etag = self.client.get(reverse('workout-list'))['ETag']
+        response = self.client.get(reverse('workout-list') + '?difficulty=beginner', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    @override_settings(API_CACHE_SHARED=False)
+    def test_per_process_cache_skips_validation(self):
+        """Test that no 304 is answered from namespace versions other workers cannot see"""
+        response = self.client.get(reverse('workout-list'))
+        self.assertNotIn('ETag', response)
+        response = self.client.get(reverse('workout-list'), HTTP_IF_NONE_MATCH='*')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_cache_control(self):
+        """Test that routes get their configured Cache-Control policy"""
+        response = self.client.get(reverse('workout-list'))
+        self.assertEqual(response['Cache-Control'], 'public, max-age=300, stale-while-revalidate=3600')
+        response = self.client.get(reverse('user-list'))
+        self.assertEqual(response['Cache-Control'], 'no-cache')
+        response = self.client.post(reverse('workout-list'), {
+            'name': 'Posted', 'description': 'New', 'difficulty': 'beginner',
+            'duration_minutes': 10, 'category': 'cardio'
+        }, format='json')
+        self.assertNotIn('Cache-Control', response)
+
+
+class RendererCompressionTests(APITestCase):
+    """Test cases for the JSON/MessagePack renderers and response compression"""
+
+    def setUp(self):
+        self.client = APIClient()
+        for index in range(20):
+            Workout.objects.create(
+                name=f'Compressed Workout {index}', description='A description long enough to compress',
+                difficulty='beginner', duration_minutes=20, category='cardio'
+            )
+
+    def test_json_matches_drf(self):
+        """Test that the orjson renderer writes the same bytes as DRF's"""
+        from rest_framework.renderers import JSONRenderer
+        data = {'name': 'caf\u00e9 \u2028', 'when': datetime(2024, 1, 2, 3, 4, 5, 123456, tzinfo=timezone.utc),
+                'points': Decimal('1.5'), 'items': [1, None, True], 1: 'key'}
+        self.assertEqual(renderers.ORJSONRenderer().render(data), JSONRenderer().render(data))
+
+    def test_gzip_above_threshold(self):
+        """Test that a large response is gzipped for clients that accept it"""
+        response = self.client.get(reverse('workout-list'), HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(len(json.loads(gzip.decompress(response.content))['results']), 20)
+
+    def test_small_or_unaccepted_uncompressed(self):
+        """Test that small bodies and clients without Accept-Encoding get identity"""
+        response = self.client.get(reverse('workout-list'), {'page_size': 1}, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertNotIn('Content-Encoding', response)
+        response = self.client.get(reverse('workout-list'))
+        self.assertNotIn('Content-Encoding', response)
+
+    @override_settings(COMPRESS_MIN_SIZE=0)
+    def test_streaming_export_compressed(self):
+        """Test that a streaming export is compressed chunk by chunk"""
+        response = self.client.get(reverse('activity-export', args=['ndjson']), HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        gzip.decompress(b''.join(response.streaming_content))
+
+    def test_msgpack(self):
+        """Test that Accept: application/msgpack is served when msgpack is installed"""
+        response = self.client.get(reverse('workout-list'), HTTP_ACCEPT='application/msgpack')
+        if renderers.msgpack is None:
+            self.assertEqual(response.status_code, status.HTTP_406_NOT_ACCEPTABLE)
+            return
+        self.assertEqual(response['Content-Type'], 'application/msgpack')
+        self.assertEqual(len(renderers.msgpack.unpackb(response.content)['results']), 20)
+
+
+class WorkoutRecommendationTests(APITestCase):
+    """Test cases for workout grouping and recommendations"""
+    
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create(
+            name='Runner', email='runner@example.com', alias='Runner',
+            fitness_level='intermediate'
+        )
+        for name, difficulty, category in [
+            ('Easy Stretch', 'beginner', 'flexibility'),
+            ('Tempo Run', 'intermediate', 'cardio'),
+            ('Iron Circuit', 'intermediate', 'strength'),
+            ('Cosmic Gauntlet', 'super-hero', 'cardio'),
+        ]:
+            Workout.objects.create(
+                name=name, description=name, difficulty=difficulty,
+                duration_minutes=30, category=category
+            )
+        Activity.objects.create(
+            user_id=str(self.user._id), user_name='Runner', user_alias='Runner',
+            activity_type='running', duration_minutes=30,
+            calories_burned=300, points_earned=20
+        )
+    
+    def test_by_difficulty_groups(self):
+        """Test that every difficulty level is present in the grouping"""
+        response = self.client.get(reverse('workout-by-difficulty'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['intermediate']), 2)
+        self.assertEqual(len(response.data['advanced']), 0)
+        names = [workout['name'] for workout in response.data['intermediate']]
+        self.assertEqual(names, ['Iron Circuit', 'Tempo Run'])
+    
+    def test_recommend_uses_history(self):
+        """Test that recommendations follow the user's level and activity mix"""
+        response = self.client.get(reverse('workout-recommend'), {'user_id': str(self.user._id)})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        names = [workout['name'] for workout in response.data]
+        self.assertEqual(names[0], 'Tempo Run')
+        self.assertNotIn('Cosmic Gauntlet', names)
+    
+    @override_settings(API_CACHE_SHARED=False, RECOMMENDATION_INDEX_SECONDS=0)
+    def test_index_ages_out_without_shared_cache(self):
+        """Test that a workout written by another worker (no version bump here) is picked up"""
+        from . import recommendations
+        recommendations.get_index()
+        get_db().workouts.insert_one({
+            'name': 'Elsewhere Sprint', 'description': 'Written by another worker',
+            'difficulty': 'intermediate', 'duration_minutes': 30, 'exercises': [],
+            'category': 'cardio', 'created_at': datetime.now(timezone.utc),
+        })
+        names = [workout['name'] for workout in recommendations.recommend('intermediate', limit=10)]
+        self.assertIn('Elsewhere Sprint', names)
+
+
+class BulkIngestionTests(APITestCase):
+    """Test cases for bulk activity ingestion"""
+    
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create(
+            name='Wearer', email='wearer@example.com', alias='Wearer', team='marvel'
+        )
+    
+    def _activity(self, key, points=10):
+        return {
+            'user_id': str(self.user._id),
+            'user_name': 'Wearer',
+            'user_alias': 'Wearer',
+            'activity_type': 'running',
+            'duration_minutes': 15,
+            'calories_burned': 120,
+            'points_earned': points,
+            'idempotency_key': key
+        }
+    
+    def test_single_create_repeats_key(self):
+        """Test that posting a stored idempotency key returns the stored activity"""
+        indexes.ensure_indexes(get_db(), Activity)
+        response = self.client.post(reverse('activity-list'), self._activity('once'), format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        repeat = self.client.post(reverse('activity-list'), self._activity('once', points=99), format='json')
+        self.assertEqual(repeat.status_code, status.HTTP_200_OK)
+        self.assertEqual(repeat.data['id'], response.data['id'])
+        self.assertEqual(repeat.data['points_earned'], 10)
+        self.assertEqual(Activity.objects.filter(idempotency_key='once').count(), 1)
+    
+    def test_bulk_json_deduplicates(self):
+        """Test that repeated idempotency keys are stored once"""
+        batch = [self._activity('a'), self._activity('a'), self._activity('b')]
+        response = self.client.post(reverse('activity-bulk'), batch, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['created'], 2)
+        self.assertEqual(response.data['duplicates'], 1)
+        
+        response = self.client.post(reverse('activity-bulk'), batch, format='json')
+        self.assertEqual(response.data['created'], 0)
+        self.assertEqual(Activity.objects.filter(team_id='marvel').count(), 2)
+        self.assertEqual(User.objects.get(pk=self.user._id).total_points, 20)
+    
+    def test_bulk_ndjson(self):
+        """Test that an NDJSON body is accepted"""
+        body = '\n'.join(json.dumps(self._activity(key)) for key in ['x', 'y', 'z'])
+        response = self.client.post(
+            reverse('activity-bulk'), body, content_type='application/x-ndjson'
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['created'], 3)
+    
+    def test_bulk_rejects_invalid_rows(self):
+        """Test that a batch with an invalid row is rejected whole"""
+        batch = [self._activity('ok'), {'user_id': str(self.user._id)}]
+        response = self.client.post(reverse('activity-bulk'), batch, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Activity.objects.count(), 0)
+
+
+class NativeReadTests(APITestCase):
+    """Test cases for the pymongo repository read path"""
+    
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create(
+            name='Native Hero', email='native@example.com', alias='Native', team='dc'
+        )
+        for minutes in range(5):
+            Activity.objects.create(
+                user_id=str(self.user._id), user_name='Native Hero', user_alias='Native',
+                activity_type='swimming', duration_minutes=minutes + 10,
+                calories_burned=100, points_earned=5
+            )
+    
+    def _ids(self, params):
+        ids = []
+        response = self.client.get(reverse('activity-list'), params)
+        while True:
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            ids.extend(row['id'] for row in response.data['results'])
+            if not response.data['next']:
+                return ids
+            response = self.client.get(response.data['next'])
+    
+    def test_native_list_matches_orm(self):
+        """Test that native pages return the same rows in the same order"""
+        params = {'page_size': 2, 'ordering': 'duration_minutes'}
+        orm_ids = self._ids(params)
+        with self.settings(API_NATIVE_READS=True):
+            native_ids = self._ids(params)
+        self.assertEqual(native_ids, orm_ids)
+        self.assertEqual(len(native_ids), 5)
+    
+    def test_native_retrieve(self):
+        """Test that native retrieve serializes a record like the ORM"""
+        with self.settings(API_NATIVE_READS=True):
+            response = self.client.get(reverse('user-detail', args=[str(self.user._id)]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['alias'], 'Native')
+
+
+class PopulateDbTests(TestCase):
+    """Test cases for the synthetic populate_db mode"""
+    
+    def test_synthetic_generation(self):
+        """Test that synthetic users, activities and totals are consistent"""
+        call_command(
+            'populate_db', users=30, activities_per_user=4, teams=3,
+            seed=7, workers=1, batch_size=16, stdout=StringIO()
+        )
+        self.assertEqual(User.objects.count(), 30)
+        self.assertEqual(Team.objects.count(), 3)
+        self.assertEqual(Leaderboard.objects.filter(type='individual').count(), 30)
+        user = User.objects.order_by('-total_points').first()
+        points = sum(Activity.objects.filter(user_id=str(user._id)).values_list('points_earned', flat=True))
+        self.assertEqual(user.total_points, points)
+        self.assertEqual(Leaderboard.objects.get(type='individual', rank=1).user_id, str(user._id))
+    
+    def test_merge_mode(self):
+        """Test that --merge keeps unchanged data and only adds what changed"""
+        options = dict(activities_per_user=4, teams=3, seed=7, workers=1, batch_size=16, merge=True)
+        call_command('populate_db', users=30, stdout=StringIO(), **options)
+        first_ids = set(User.objects.values_list('_id', flat=True))
+        
+        out = StringIO()
+        call_command('populate_db', users=30, stdout=out, **options)
+        self.assertIn('users: 0 inserted, 0 changed, 30 unchanged', out.getvalue())
+        self.assertIn('leaderboard: unchanged', out.getvalue())
+        self.assertEqual(set(User.objects.values_list('_id', flat=True)), first_ids)
+        
+        call_command('populate_db', users=32, stdout=StringIO(), **options)
+        self.assertEqual(User.objects.count(), 32)
+        self.assertEqual(Leaderboard.objects.filter(type='individual').count(), 32)
+        for user in User.objects.exclude(_id__in=first_ids):
+            points = sum(Activity.objects.filter(user_id=str(user._id)).values_list('points_earned', flat=True))
+            self.assertEqual(user.total_points, points)
+            entry = Leaderboard.objects.get(type='individual', user_id=str(user._id))
+            self.assertEqual(entry.total_points, points)
+
+
+class BenchmarkHarnessTests(APITestCase):
+    """Test cases for the benchmark harness"""
+    
+    def test_measure_route(self):
+        """Test that a measured route reports latency and query counts"""
+        row = benchmarks.measure(
+            benchmarks.Route('user-list', reverse('user-list')), iterations=3, warmup=1
+        )
+        self.assertEqual(row['status'], status.HTTP_200_OK)
+        self.assertLessEqual(row['latency_ms']['p50'], row['latency_ms']['max'])
+        self.assertGreater(row['mongo_commands'], 0)
+    
+    def test_compare_flags_regressions(self):
+        """Test that p50 increases above the threshold are flagged"""
+        previous = {'results': [{'dataset': '10k', 'name': 'user-list', 'latency_ms': {'p50': 10.0}}]}
+        current = {'results': [{'dataset': '10k', 'name': 'user-list', 'latency_ms': {'p50': 12.0}}]}
+        (_dataset, _name, _old, _new, change, regressed), = benchmarks.compare(current, previous, 0.1)
+        self.assertAlmostEqual(change, 0.2)
+        self.assertTrue(regressed)
+    
+    def test_discover_routes(self):
+        """Test that every GET route, including actions taking URL arguments, is discovered"""
+        from .urls import router
+        user = User.objects.create(name='Bench', email='bench@example.com', alias='Bench')
+        Activity.objects.create(
+            user_id=str(user._id), user_name='Bench', user_alias='Bench',
+            activity_type='running', duration_minutes=30, calories_burned=300, points_earned=10
+        )
+        routes = {route.name: route for route in benchmarks.discover_routes(router.registry)}
+        for name in ('user-list', 'user-detail', 'user-activities', 'activity-export-ndjson', 'activity-export-csv'):
+            self.assertIn(name, routes)
+        route = routes['activity-export-csv']
+        response = self.client.get(route.path, route.params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+class SearchTests(APITestCase):
+    """Test cases for indexed search"""
+    
+    def setUp(self):
+        self.client = APIClient()
+        call_command('create_search_indexes', stdout=StringIO())
+        User.objects.create(name='Peter Parker', email='peter@example.com', alias='Spider-Man')
+        User.objects.create(name='Miles Morales', email='miles@example.com', alias='Spider-Verse')
+        User.objects.create(name='Bruce Banner', email='bruce@example.com', alias='Hulk')
+        for notes in ['Marathon training in the rain', 'Easy recovery jog']:
+            Activity.objects.create(
+                user_id='search-user', user_name='Searcher', user_alias='Searcher',
+                activity_type='running', duration_minutes=30,
+                calories_burned=300, points_earned=10, notes=notes
+            )
+    
+    def test_text_search_notes(self):
+        """Test that notes are matched through the text index"""
+        response = self.client.get(reverse('activity-list'), {'search': 'marathon'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertIn('Marathon', response.data['results'][0]['notes'])
+    
+    def test_alias_prefix_search(self):
+        """Test that a partial alias matches by prefix"""
+        response = self.client.get(reverse('user-list'), {'search': 'spid'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        aliases = {user['alias'] for user in response.data['results']}
+        self.assertEqual(aliases, {'Spider-Man', 'Spider-Verse'})
+    
+    def test_prefix_search_reads_only_matches(self):
+        """Test that a prefix in any case is answered from its collated index"""
+        from .search import PREFIX_COLLATION, prefix_index_name
+        response = self.client.get(reverse('user-list'), {'search': 'SPID'})
+        self.assertEqual({user['alias'] for user in response.data['results']}, {'Spider-Man', 'Spider-Verse'})
+        plan = get_db().users.find({'alias': {'$gte': 'SPID', '$lt': 'SPID\uffff'}}).collation(
+            PREFIX_COLLATION
+        ).hint(prefix_index_name('alias')).explain()
+        self.assertEqual(plan['executionStats']['totalDocsExamined'], 2)
+    
+    def test_search_with_ordering(self):
+        """Test that an explicit ordering still applies to search results"""
+        response = self.client.get(reverse('user-list'), {'search': 'spid', 'ordering': 'name'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        names = [user['name'] for user in response.data['results']]
+        self.assertEqual(names, ['Miles Morales', 'Peter Parker'])
+    
+    @override_settings(SEARCH_MAX_RESULTS=1)
+    def test_search_ranks_within_filters(self):
+        """Test that the capped ranking only considers rows the filters keep"""
+        User.objects.filter(alias='Spider-Verse').update(team='marvel')
+        response = self.client.get(reverse('user-list'), {'search': 'spid', 'ordering': 'name', 'team': 'marvel'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([user['alias'] for user in response.data['results']], ['Spider-Verse'])
+
+
+class AdminChangelistTests(TestCase):
+    """Test cases for the admin changelists on large collections"""
+    
+    def setUp(self):
+        from django.contrib.auth import get_user_model
+        caches['default'].clear()
+        call_command('create_search_indexes', stdout=StringIO())
+        admin_user = get_user_model().objects.create_superuser('admin', 'admin@example.com', 'secret')
+        self.client.force_login(admin_user)
+        for activity_type, notes in [('running', 'Marathon training'), ('cycling', 'Hill repeats')]:
+            Activity.objects.create(
+                user_id='admin-user', user_name='Admin', user_alias='Admin',
+                activity_type=activity_type, duration_minutes=30,
+                calories_burned=300, points_earned=10, notes=notes
+            )
+    
+    def test_changelist_counts_without_full_total(self):
+        """Test that the changelist loads with an estimated count and no full total"""
+        response = self.client.get(reverse('admin:octofit_tracker_activity_changelist'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['cl'].result_count, 2)
+        self.assertFalse(response.context['cl'].show_full_result_count)
+    
+    def test_search_uses_text_index(self):
+        """Test that admin search matches through the text index"""
+        response = self.client.get(reverse('admin:octofit_tracker_activity_changelist'), {'q': 'marathon'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([a.notes for a in response.context['cl'].result_list], ['Marathon training'])
+    
+    def test_filter_choices_cached_and_capped(self):
+        """Test that filter choices come from the cache and are hidden past the cap"""
+        from .changelist import distinct_values
+        self.assertEqual(distinct_values(Activity, 'activity_type'), ['cycling', 'running'])
+        Activity.objects.create(
+            user_id='admin-user', user_name='Admin', activity_type='swimming',
+            duration_minutes=30, calories_burned=300, points_earned=10
+        )
+        self.assertEqual(distinct_values(Activity, 'activity_type'), ['cycling', 'running'])
+        caches['default'].clear()
+        with override_settings(ADMIN_FILTER_MAX_CHOICES=2):
+            self.assertEqual(distinct_values(Activity, 'activity_type'), [])
+
+    
+    def test_job_actions_need_change_permission(self):
+        """Test that view-only staff cannot queue jobs from the admin"""
+        from django.contrib import admin
+        from django.contrib.auth import get_user_model
+        from django.contrib.auth.models import Permission
+        from django.test import RequestFactory
+        viewer = get_user_model().objects.create_user('viewer', 'viewer@example.com', 'secret', is_staff=True)
+        viewer.user_permissions.add(*Permission.objects.filter(codename__in=['view_job', 'view_user']))
+        request = RequestFactory().get('/admin/')
+        request.user = viewer
+        self.assertNotIn('retry', admin.site._registry[Job].get_actions(request))
+        self.assertNotIn('recalculate_points', admin.site._registry[User].get_actions(request))
+        request.user = get_user_model().objects.get(username='admin')
+        self.assertIn('retry', admin.site._registry[Job].get_actions(request))
+
+class SparseFieldsTests(APITestCase):
+    """Test cases for ?fields= and ?exclude="""
+    
+    def setUp(self):
+        self.client = APIClient()
+        User.objects.create(name='Sparse User', email='sparse@example.com', alias='Sparse', total_points=7)
+        Team.objects.create(name='Sparse Team', description='Few fields', members=['a', 'b'])
+        Activity.objects.create(
+            user_id='sparse-user', user_name='Sparse User', user_alias='Sparse',
+            activity_type='running', duration_minutes=30,
+            calories_burned=300, points_earned=10, notes='Long notes'
+        )
+    
+    def test_fields_limits_activity_keys(self):
+        """Test that only the requested fields are returned"""
+        response = self.client.get(reverse('activity-list'), {'fields': 'id,points_earned'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(set(response.data['results'][0]), {'id', 'points_earned'})
+        self.assertEqual(response.data['results'][0]['points_earned'], 10)
+    
+    def test_fields_limits_user_keys(self):
+        """Test that ?fields= applies to user lists"""
+        response = self.client.get(reverse('user-list'), {'fields': 'alias,total_points'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'][0], {'alias': 'Sparse', 'total_points': 7})
+    
+    def test_exclude_members(self):
+        """Test that excluded fields are dropped and the rest kept"""
+        response = self.client.get(reverse('team-list'), {'exclude': 'members'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        team = response.data['results'][0]
+        self.assertNotIn('members', team)
+        self.assertEqual(team['name'], 'Sparse Team')
+        self.assertEqual(team['member_count'], 2)
+    
+    def test_unknown_field_rejected(self):
+        """Test that an unknown field name is a 400"""
+        response = self.client.get(reverse('activity-list'), {'exclude': 'notes,bogus'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ExportTests(APITestCase):
+    """Test cases for streaming exports"""
+    
+    def setUp(self):
+        self.client = APIClient()
+        for points in range(3):
+            Activity.objects.create(
+                user_id=f'export-user-{points % 2}', user_name='Exporter', user_alias='Exporter',
+                activity_type='running', duration_minutes=30,
+                calories_burned=300, points_earned=points, notes='Export, "quoted"'
+            )
+    
+    def read(self, response):
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return b''.join(response.streaming_content).decode()
+    
+    @override_settings(EXPORT_BATCH_SIZE=1)
+    def test_ndjson_export(self):
+        """Test that every matching row is streamed as one JSON line"""
+        response = self.client.get(reverse('activity-export', args=['ndjson']), {'user_id': 'export-user-0'})
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        rows = [json.loads(line) for line in self.read(response).splitlines()]
+        self.assertEqual([row['points_earned'] for row in rows], [2, 0])
+    
+    def test_csv_export_fields(self):
+        """Test that CSV exports have a header row and honour ?fields="""
+        response = self.client.get(reverse('activity-export', args=['csv']), {'fields': 'points_earned,notes'})
+        self.assertIn('activities.csv', response['Content-Disposition'])
+        lines = self.read(response).splitlines()
+        self.assertEqual(lines[0], 'points_earned,notes')
+        self.assertEqual(lines[1], '2,"Export, ""quoted"""')
+        self.assertEqual(len(lines), 4)
+    
+    def test_unknown_format(self):
+        """Test that an unknown export format is a 404"""
+        response = self.client.get(reverse('leaderboard-export', args=['xml']))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class InstrumentationTests(APITestCase):
+    """Test cases for request instrumentation"""
+    
+    def setUp(self):
+        self.client = APIClient()
+        Workout.objects.create(
+            name='Timed Workout', description='Measured', difficulty='beginner',
+            duration_minutes=10, exercises=[], category='cardio'
+        )
+    
+    def test_server_timing_header(self):
+        """Test that responses report DB, serializer and total time"""
+        response = self.client.get(reverse('workout-list'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        timing = response['Server-Timing']
+        for phase in ('db;dur=', 'serialize;dur=', 'total;dur='):
+            self.assertIn(phase, timing)
+        self.assertNotIn('desc="0 round trips"', timing)
+    
+    def test_metrics_endpoint(self):
+        """Test that /metrics exposes per-view counters in Prometheus format"""
+        self.client.get(reverse('workout-list'))
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        body = response.content.decode()
+        self.assertIn('octofit_requests_total{view="workout-list",method="GET",status="200"}', body)
+        self.assertIn('octofit_db_commands_per_request_count{view="workout-list"}', body)
+    
+    @override_settings(PROFILE_SAMPLE_RATE=1.0)
+    def test_profile_dump_requires_staff(self):
+        """Test that sampled profiles are only shown to staff"""
+        self.client.get(reverse('workout-list'))
+        response = self.client.get(reverse('metrics-profile'))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class JobQueueTests(TestCase):
+    """Test cases for the background job queue"""
+    
+    def setUp(self):
+        self.db = get_db()
+        indexes.ensure_indexes(self.db, Job)
+        self.user = User.objects.create(name='Queued User', email='queued@example.com', total_points=999)
+        Activity.objects.create(
+            user_id=str(self.user._id), user_name='Queued User', activity_type='running',
+            duration_minutes=30, calories_burned=300, points_earned=40
+        )
+        User.objects.filter(pk=self.user.pk).update(total_points=999)
+    
+    def tearDown(self):
+        jobs.TASKS.pop('flaky', None)
+    
+    def test_enqueue_deduplicates(self):
+        """Test that queueing a job that is already waiting returns it"""
+        first = jobs.enqueue('rebuild_leaderboard', delay=60)
+        second = jobs.enqueue('rebuild_leaderboard', delay=60)
+        self.assertEqual(first, second)
+        self.assertEqual(jobs.queue_depth()[jobs.QUEUED], 1)
+    
+    def test_recalculate_user_points(self):
+        """Test that the recalculation job resets points and queues a rebuild"""
+        jobs.enqueue('recalculate_user_points', user_id=str(self.user._id))
+        jobs.run_pending()
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.total_points, 40)
+        self.assertEqual(
+            Leaderboard.objects.get(type='individual', user_id=str(self.user._id)).total_points, 40
+        )
+        self.assertEqual(jobs.queue_depth()[jobs.DONE], 2)
+    
+    @override_settings(JOB_RETRY_DELAY=0)
+    def test_retries_then_fails(self):
+        """Test that a failing job is retried up to max_attempts"""
+        calls = []
+        
+        @jobs.task('flaky')
+        def flaky(db):
+            calls.append(1)
+            raise RuntimeError('still failing')
+        
+        job_id = jobs.enqueue('flaky', max_attempts=3)
+        jobs.run_pending()
+        job = self.db[jobs.COLLECTION].find_one({'_id': job_id})
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(job['status'], jobs.FAILED)
+        self.assertIn('still failing', job['last_error'])
+
+
+    @override_settings(JOB_LEASE_SECONDS=0.3)
+    def test_lease_renewed_while_running(self):
+        """Test that a job running past its lease keeps it and is not claimed again"""
+        claimed = []
+        
+        @jobs.task('flaky')
+        def slow(db):
+            time.sleep(0.6)
+            claimed.append(jobs.claim('second worker', db))
+        
+        jobs.enqueue('flaky')
+        jobs.run_pending()
+        self.assertEqual(claimed, [None])
+        self.assertEqual(jobs.queue_depth()[jobs.DONE], 1)
+
+
+class IndexManagementTests(TestCase):
+    """Test cases for declared indexes and the query shape audit"""
+    
+    def test_sync_indexes_creates_declared_indexes(self):
+        """Test that every declared index exists after sync_indexes"""
+        call_command('sync_indexes', stdout=StringIO())
+        db = get_client()[connection.settings_dict['NAME']]
+        existing = db.activities.index_information()
+        for index in Activity.mongo_indexes:
+            self.assertIn(index.name, existing)
+    
+    def test_audit_covers_default_list_shapes(self):
+        """Test that default and filtered list queries all have a supporting index"""
+        from .indexes import audit, query_shapes
+        from .urls import router
+        defaults = {
+            basename: query_shapes(viewset)[0][1] for _prefix, viewset, basename in router.registry
+        }
+        for basename, _model, equality, sort, index in audit(router.registry):
+            if sort == defaults[basename]:
+                self.assertIsNotNone(index, f'{basename} {equality} {sort} has no supporting index')
+    
+    def test_activity_list_sort_uses_index(self):
+        """Test that the ordering pagination applies to activities needs no in-memory sort"""
+        from .indexes import explain, sort_keys
+        from .pagination import list_ordering
+        from .views import ActivityViewSet
+        call_command('sync_indexes', stdout=StringIO())
+        Activity.objects.create(
+            user_id='sort-user', user_name='Sorter', activity_type='running',
+            duration_minutes=30, calories_burned=300, points_earned=10
+        )
+        for param in (None, '-date'):
+            ordering = list_ordering(ActivityViewSet, param)
+            self.assertEqual(ordering, ('-date', '-_id'))
+            stats = explain(get_db().activities, {}, sort_keys(ordering), 10)
+            self.assertFalse(stats['in_memory_sort'], stats['plan'])
+    
+    def test_audit_only_builds_nothing(self):
+        """Test that --audit reports without creating indexes"""
+        out = StringIO()
+        call_command('sync_indexes', '--audit', stdout=out)
+        self.assertIn('Unsupported query shapes', out.getvalue())
+        self.assertNotIn('Indexes created', out.getvalue())
+
+
+class TimeSeriesStorageTests(APITestCase):
+    """Test cases for time-series activity storage and its migration"""
+    
+    def setUp(self):
+        self.db = get_db()
+        if get_client().server_info()['versionArray'] < [7]:
+            self.skipTest('time-series activity storage needs MongoDB 7.0')
+        for day in range(3):
+            Activity.objects.create(
+                user_id='ts-user', user_name='Series', user_alias='Series',
+                activity_type='running', duration_minutes=30, calories_burned=300,
+                points_earned=10, date=datetime(2024, 1, day + 1, tzinfo=timezone.utc)
+            )
+    
+    def tearDown(self):
+        if 'activities_plain' in self.db.list_collection_names():
+            self.db.activities.drop()
+            self.db.activities_plain.rename('activities')
+        self.db.activity_keys.drop()
+    
+    @override_settings(ACTIVITY_STORAGE='timeseries')
+    def test_migrate_moves_activities(self):
+        """Test that migrating keeps every activity readable and can be rerun"""
+        from .timeseries import is_timeseries
+        call_command('migrate_activity_storage', stdout=StringIO())
+        self.assertTrue(is_timeseries(self.db.activities))
+        self.assertEqual(self.db.activities.count_documents({'user_id': 'ts-user'}), 3)
+        
+        response = self.client.get(reverse('activity-list'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['results']), 3)
+        
+        out = StringIO()
+        call_command('migrate_activity_storage', stdout=out)
+        self.assertIn('Activities copied: 0 (3 already there)', out.getvalue())
+    
+    @override_settings(ACTIVITY_STORAGE='timeseries')
+    def test_keys_claimed_without_unique_index(self):
+        """Test that ingestion skips keys another writer has claimed"""
+        from .ingest import ingest_activities
+        from .timeseries import claim_keys
+        call_command('migrate_activity_storage', stdout=StringIO())
+        row = {
+            'user_id': 'ts-user', 'activity_type': 'cycling', 'duration_minutes': 20,
+            'points_earned': 5, 'date': datetime(2024, 1, 5, tzinfo=timezone.utc)
+        }
+        self.assertEqual(claim_keys(self.db, ['taken']), {'taken'})
+        ids, duplicates = ingest_activities([
+            {**row, 'idempotency_key': 'taken'}, {**row, 'idempotency_key': 'fresh'}
+        ])
+        self.assertEqual((len(ids), duplicates), (1, 1))
+        
+        ids, duplicates = ingest_activities([{**row, 'idempotency_key': 'fresh'}])
+        self.assertEqual((ids, duplicates), ([], 1))
+        self.assertEqual(self.db.activities.count_documents({'idempotency_key': {'$in': ['taken', 'fresh']}}), 1)
+    
+    @override_settings(ACTIVITY_STORAGE='timeseries')
+    def test_migrate_claims_existing_keys(self):
+        """Test that keys stored before the migration cannot be written again during the copy"""
+        from unittest import mock
+        from .ingest import ingest_activities
+        from .management.commands import migrate_activity_storage
+        self.db.activities.update_one({'user_id': 'ts-user'}, {'$set': {'idempotency_key': 'synced'}})
+        # Stop after the rename, before anything is copied
+        with mock.patch.object(migrate_activity_storage.Command, 'copy', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                call_command('migrate_activity_storage', stdout=StringIO())
+        ids, duplicates = ingest_activities([{
+            'user_id': 'ts-user', 'activity_type': 'running', 'duration_minutes': 30,
+            'points_earned': 10, 'idempotency_key': 'synced'
+        }])
+        self.assertEqual((ids, duplicates), ([], 1))
+    
+    def test_migrate_requires_setting(self):
+        """Test that migrating refuses to run while activities use a plain collection"""
+        from django.core.management.base import CommandError
+        with self.assertRaises(CommandError):
+            call_command('migrate_activity_storage', stdout=StringIO())
+
+
+class RollupTests(APITestCase):
+    """Test cases for pre-aggregated activity rollups"""
+    
+    def setUp(self):
+        self.client = APIClient()
+        self.team = Team.objects.create(_id='dc', name='DC')
+        self.user = User.objects.create(
+            name='Diana Prince', email='diana@example.com', alias='Wonder Woman', team='dc'
+        )
+        self.activity = Activity.objects.create(
+            user_id=str(self.user._id), user_name='Diana Prince', user_alias='Wonder Woman',
+            activity_type='running', duration_minutes=40, calories_burned=400,
+            points_earned=20, date=datetime(2024, 3, 4, 9, 30, tzinfo=timezone.utc)
+        )
+    
+    def _stats(self, name, pk, **params):
+        params = {'start': '2024-03-01', 'end': '2024-03-10', **params}
+        return self.client.get(reverse(name, args=[pk]), params)
+    
+    def test_user_stats_from_rollups(self):
+        """Test that user stats reflect activity writes"""
+        response = self._stats('user-stats', self.user._id)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['totals']['total_points'], 20)
+        self.assertEqual(len(response.data['series']), 10)
+        
+        self.activity.points_earned = 35
+        self.activity.save()
+        response = self._stats('user-stats', self.user._id)
+        self.assertEqual(response.data['totals']['total_points'], 35)
+        self.assertEqual(response.data['totals']['activity_count'], 1)
+        
+        self.activity.delete()
+        response = self._stats('user-stats', self.user._id)
+        self.assertEqual(response.data['totals']['activity_count'], 0)
+    
+    def test_team_weekly_stats(self):
+        """Test that team stats group days into ISO weeks"""
+        response = self._stats('team-stats', 'dc', period='week')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        weeks = {str(row['period_start']): row['total_minutes'] for row in response.data['series']}
+        self.assertEqual(weeks['2024-03-04'], 40)
+        self.assertEqual(weeks['2024-02-26'], 0)
+    
+    def test_invalid_range(self):
+        """Test that reversed ranges and unknown periods are rejected"""
+        response = self._stats('team-stats', 'dc', start='2024-03-10', end='2024-03-01')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self._stats('team-stats', 'dc', period='month')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+    
+    def test_rebuild_matches_incremental(self):
+        """Test that rebuilding from history gives the same totals"""
+        before = self._stats('user-stats', self.user._id).data['totals']
+        call_command('rebuild_rollups', stdout=StringIO())
+        after = self._stats('user-stats', self.user._id).data['totals']
+        self.assertEqual(before, after)
+    
+    def test_rebuild_repairs_in_place(self):
+        """Test that a rebuild corrects drifted rollups and drops ones with no activities left"""
+        from . import rollups
+        collection = get_db()[rollups.COLLECTION]
+        collection.update_one({'_id': f'user:{self.user._id}:2024-03-04'}, {'$inc': {'total_points': 99}})
+        collection.insert_one({
+            '_id': 'team:ghost:2024-03-05', 'scope': 'team', 'key': 'ghost',
+            'day': datetime(2024, 3, 5), 'activity_count': 1, 'total_points': 5,
+        })
+        self.assertEqual(rollups.rebuild(), 1)
+        self.assertEqual(self._stats('user-stats', self.user._id).data['totals']['total_points'], 20)
+        self.assertIsNone(collection.find_one({'_id': 'team:ghost:2024-03-05'}))
+
+
+class AsyncReadTests(TestCase):
+    """Test cases for the async read endpoints"""
+    
+    def setUp(self):
+        for rank, alias in enumerate(['Flash', 'Superman', 'Batman'], start=1):
+            Leaderboard.objects.create(
+                user_id=f'user-{rank}', user_alias=alias, total_points=100 - rank,
+                rank=rank, type='individual'
+            )
+        self.workout = Workout.objects.create(
+            name='Speed Drills', description='Sprints', difficulty='advanced',
+            duration_minutes=20, category='cardio'
+        )
+    
+    async def test_async_leaderboard_pages(self):
+        """Test that the async leaderboard pages in rank order like the DRF endpoint"""
+        response = await self.async_client.get(
+            reverse('async-leaderboard-list'), {'type': 'individual', 'page_size': 2}
+        )
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual([row['user_alias'] for row in data['results']], ['Flash', 'Superman'])
+        
+        response = await self.async_client.get(data['next'])
+        self.assertEqual([row['user_alias'] for row in response.json()['results']], ['Batman'])
+    
+    async def test_async_ordering_matches_drf(self):
+        """Test that async and DRF lists apply the same ordering for the same query"""
+        for params in ({}, {'ordering': '-total_points'}, {'ordering': 'bogus,-rank'}):
+            async_response = await self.async_client.get(reverse('async-leaderboard-list'), params)
+            response = await sync_to_async(self.client.get)(reverse('leaderboard-list'), params)
+            self.assertEqual(
+                [row['user_alias'] for row in async_response.json()['results']],
+                [row['user_alias'] for row in response.json()['results']],
+                params
+            )
+    
+    async def test_async_workout_detail(self):
+        """Test that async retrieve matches the serializer output"""
+        response = await self.async_client.get(reverse('async-workout-detail', args=[self.workout._id]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['name'], 'Speed Drills')
+        
+        response = await self.async_client.get(reverse('async-workout-detail', args=['000000000000000000000000']))
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(LIVE_LEADERBOARD_INTERVAL=0.05)
+class LiveLeaderboardTests(TestCase):
+    """Test cases for the live leaderboard stream"""
+    
+    def setUp(self):
+        self.leader = User.objects.create(name='Leader', email='leader@example.com', alias='Leader', total_points=200)
+        self.chaser = User.objects.create(name='Chaser', email='chaser@example.com', alias='Chaser', total_points=100)
+        for rank, user in enumerate([self.leader, self.chaser], start=1):
+            Leaderboard.objects.create(
+                user_id=str(user._id), user_name=user.name, user_alias=user.alias,
+                total_points=user.total_points, rank=rank, type='individual'
+            )
+    
+    async def test_stream_sends_snapshot_then_delta(self):
+        """Test that a write producing a rank change is pushed as a delta"""
+        inbox, sent = asyncio.Queue(), asyncio.Queue()
+        await inbox.put({'type': 'http.request'})
+        scope = {'type': 'http', 'path': live.PATH, 'query_string': b'board=individual'}
+        stream = asyncio.ensure_future(live.leaderboard_stream(scope, inbox.get, sent.put))
+        
+        self.assertEqual((await sent.get())['status'], 200)
+        self.assertIn(b'event: snapshot', (await sent.get())['body'])
+        
+        await sync_to_async(leaderboard.apply_deltas)({str(self.chaser._id): 150})
+        body = (await asyncio.wait_for(sent.get(), timeout=5))['body'].decode()
+        self.assertIn('event: delta', body)
+        delta = json.loads(body.split('data: ', 1)[1])
+        ranks = {row['name']: (row['previous_rank'], row['rank']) for row in delta['rows']}
+        self.assertEqual(ranks['Chaser'], (2, 1))
+        
+        await inbox.put({'type': 'http.disconnect'})
+        await stream
+    
+    def test_diff_reports_moves_and_drops(self):
+        """Test that diff() returns changed rows and ids that left the board"""
+        before = [{'id': 'a', 'name': 'A', 'rank': 1, 'total_points': 9}, {'id': 'b', 'name': 'B', 'rank': 2, 'total_points': 5}]
+        after = [{'id': 'c', 'name': 'C', 'rank': 1, 'total_points': 12}, {'id': 'a', 'name': 'A', 'rank': 2, 'total_points': 9}]
+        changed, removed = live.diff(before, after)
+        self.assertEqual([(row['id'], row['previous_rank']) for row in changed], [('c', None), ('a', 1)])
+        self.assertEqual(removed, ['b'])
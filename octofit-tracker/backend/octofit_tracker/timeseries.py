@@ -0,0 +1,124 @@
+"""
+Time-series storage for activities.
+
+With ACTIVITY_STORAGE = 'timeseries' the activities collection is a MongoDB
+time-series collection (MongoDB 7.0 or later), with ``date`` as its time
+field and ``user_id`` as its meta field. MongoDB packs each user's activities
+into column-compressed buckets spanning ACTIVITY_TIMESERIES_GRANULARITY, so a
+date range (ActivityViewSet.recent, rebuild_rollups --since) or one user's
+history reads a few buckets, pruned by their min/max dates, rather than a
+document page per activity, and the collection takes a fraction of the space.
+
+Documents keep the shape they have in a plain collection, so djongo, the
+native reads and the aggregations work unchanged on either storage.
+activity_type is an ordinary field with its own index, not part of the meta
+field: a per-type meta would split each user's buckets by type, and the
+per-user reads would then touch one bucket per type.
+
+A time-series collection differs from a plain one in these ways:
+
+- It has no _id index, so Activity declares one. On a plain collection that
+  index already exists.
+- Its indexes cannot be unique, so ensure_indexes() builds the
+  idempotency_key index without uniqueness, and that index alone does not
+  stop two writers storing the same key. Ingestion, merges and model saves
+  first claim each new key in the plain KEYS_COLLECTION, where the key is
+  the _id, and only insert the activities whose claim succeeded. Deleting an
+  activity releases its key. Keys stored before the migration have no claim
+  and are found by the lookup each writer makes before claiming.
+- It cannot take upserts, so merge.upsert_many() inserts new documents.
+- It has no text index, so activity search uses regexes.
+
+The migrate_activity_storage command moves an existing plain collection into
+this storage.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+from pymongo.errors import BulkWriteError
+
+TIMESERIES = 'timeseries'
+# Idempotency keys written to time-series activities, one document per key
+KEYS_COLLECTION = 'activity_keys'
+DUPLICATE_KEY = 11000
+
+
+def options(model):
+    """The create options for `model`'s collection if it is stored as time series, else None"""
+    declared = getattr(model, 'mongo_timeseries', None)
+    if declared is None or settings.ACTIVITY_STORAGE != TIMESERIES:
+        return None
+    return {**declared, 'granularity': settings.ACTIVITY_TIMESERIES_GRANULARITY}
+
+
+def is_timeseries(collection):
+    """Whether `collection` exists as a time-series collection"""
+    for info in collection.database.list_collections(filter={'name': collection.name}):
+        return info.get('type') == TIMESERIES
+    return False
+
+
+def ensure_collection(db, model):
+    """
+    Create `model`'s collection as a time-series collection if it should be
+    one and does not exist yet (a first write would create a plain one).
+    Returns whether the collection is a time-series collection.
+    """
+    name = model._meta.db_table
+    timeseries = options(model)
+    if timeseries is not None and name not in db.list_collection_names(filter={'name': name}):
+        db.create_collection(name, timeseries=timeseries)
+        return True
+    return is_timeseries(db[name])
+
+
+def claim_keys(db, keys):
+    """
+    Claim idempotency `keys` in KEYS_COLLECTION. Returns the set of keys this
+    call claimed; a key already claimed, by an earlier write or a concurrent
+    one, is left out.
+
+    Callers pass keys they found no stored activity for. A claim older than
+    ACTIVITY_KEY_CLAIM_SECONDS on such a key was left by a writer that died
+    before inserting, and is taken over.
+    """
+    keys = list(dict.fromkeys(keys))
+    if not keys:
+        return set()
+    claims = db[KEYS_COLLECTION]
+    now = timezone.now()
+    try:
+        claims.insert_many([{'_id': key, 'claimed_at': now} for key in keys], ordered=False)
+    except BulkWriteError as exc:
+        errors = exc.details.get('writeErrors', [])
+        if any(error['code'] != DUPLICATE_KEY for error in errors):
+            raise
+        failed = {error['index'] for error in errors}
+    else:
+        return set(keys)
+    stale = now - timedelta(seconds=settings.ACTIVITY_KEY_CLAIM_SECONDS)
+    return {
+        key for index, key in enumerate(keys)
+        if index not in failed
+        or claims.update_one({'_id': key, 'claimed_at': {'$lt': stale}}, {'$set': {'claimed_at': now}}).modified_count
+    }
+
+
+def release_keys(db, keys):
+    """Give up the claims on `keys`, once their activities are deleted"""
+    keys = list(keys)
+    if keys:
+        db[KEYS_COLLECTION].delete_many({'_id': {'$in': keys}})
+
+
+def release_unstored(collection, field, keys):
+    """
+    Give up the claims on those of `keys` that no document in `collection`
+    holds in `field`, after a failed insert, so that a retry can write them.
+    """
+    keys = list(keys)
+    if not keys:
+        return
+    stored = {document[field] for document in collection.find({field: {'$in': keys}}, {field: 1})}
+    release_keys(collection.database, [key for key in keys if key not in stored])
@@ -7,9 +7,14 @@ import os
 from django.contrib import admin
 from django.urls import path, include
 from rest_framework import routers
-from rest_framework.decorators import api_view
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAdminUser
 from rest_framework.response import Response
 from rest_framework.reverse import reverse
+from .async_views import AsyncReadView
+from .compression import compressed
+from .db import pool_statistics
+from .instrumentation import metrics_view, profile_view
 from .views import UserViewSet, TeamViewSet, ActivityViewSet, LeaderboardViewSet, WorkoutViewSet
 
 
@@ -37,6 +42,16 @@ def api_root(request, format=None):
     })
 
 
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def pool_stats(request, format=None):
+    """
+    MongoDB connection pool options and counters for the serving process
+    (staff only: the options include the server addresses)
+    """
+    return Response(pool_statistics())
+
+
 # Create a router and register our viewsets with it
 router = routers.DefaultRouter()
 router.register(r'users', UserViewSet, basename='user')
@@ -45,9 +60,23 @@ router.register(r'activities', ActivityViewSet, basename='activity')
 router.register(r'leaderboard', LeaderboardViewSet, basename='leaderboard')
 router.register(r'workouts', WorkoutViewSet, basename='workout')
 
+# Async (ASGI-native) read paths for the busiest endpoints
+async_urlpatterns = []
+for prefix, viewset, basename in router.registry:
+    if viewset in (LeaderboardViewSet, WorkoutViewSet, ActivityViewSet):
+        view = AsyncReadView.as_view(viewset=viewset)
+        async_urlpatterns += [
+            path(f'{prefix}/', view, name=f'async-{basename}-list'),
+            path(f'{prefix}/<str:pk>/', view, name=f'async-{basename}-detail'),
+        ]
+
 urlpatterns = [
     path('', api_root, name='api-root'),
-    path('api/', include(router.urls)),
+    path('api/pool-stats/', pool_stats, name='pool-stats'),
+    path('metrics', metrics_view, name='metrics'),
+    path('metrics/profile/', profile_view, name='metrics-profile'),
+    path('api/async/', include(compressed(async_urlpatterns))),
+    path('api/', include(compressed(router.urls))),
     path('admin/', admin.site.urls),
     path('api-auth/', include('rest_framework.urls', namespace='rest_framework')),
 ]
@@ -1,76 +1,381 @@
-from rest_framework import viewsets, filters
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DatabaseError, IntegrityError
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from rest_framework import viewsets, filters, status
 from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.parsers import JSONParser
 from rest_framework.response import Response
 from django_filters.rest_framework import DjangoFilterBackend
-from .models import User, Team, Activity, Leaderboard, Workout
+from pymongo import ASCENDING
+from pymongo.errors import DuplicateKeyError
+from . import exports, ingest, queries, recommendations, rollups
+from .parsers import NDJSONParser
+from .repositories import repository_for, decode_cursor
+from .search import TextSearchFilter, RelevanceSearchMixin, exact_lookups
+from .response_cache import cached_response, LEADERBOARD, WORKOUTS
+from .conditional import conditional, add_cache_headers
+from .models import User, Team, Activity, Leaderboard, Workout, DIFFICULTY_LEVELS
 from .serializers import (
     UserSerializer, TeamSerializer, ActivitySerializer,
-    LeaderboardSerializer, WorkoutSerializer
+    LeaderboardSerializer, WorkoutSerializer,
+    requested_fields, model_fields, lean_data
+)
+from .pagination import (
+    list_ordering, UserCursorPagination, TeamCursorPagination, ActivityCursorPagination,
+    LeaderboardCursorPagination, WorkoutCursorPagination
 )
 
 
-class UserViewSet(viewsets.ModelViewSet):
+def paginated_response(view, queryset, serializer_class, pagination_class):
+    """
+    Serialize one bounded page of a queryset from another model.
+
+    The page follows pagination_class's own ordering: the view's
+    OrderingFilter and ?ordering= name fields of the parent model, so the
+    paginator is never handed the view.
+    """
+    paginator = pagination_class()
+    names = view.load_fields(serializer_class, paginator.get_ordering(view.request, queryset, None))
+    if names is not None:
+        queryset = queryset.only(*names)
+    page = paginator.paginate_queryset(queryset, view.request, view=None)
+    return paginator.get_paginated_response(view.serialize_list(page, serializer_class))
+
+
+def is_duplicate_key(exc):
+    """
+    Whether a failed write hit a unique index or a taken idempotency claim.
+    djongo re-raises the driver's DuplicateKeyError as a DatabaseError.
+    """
+    while exc is not None:
+        if isinstance(exc, (IntegrityError, DuplicateKeyError)):
+            return True
+        exc = exc.__cause__ or exc.__context__
+    return False
+
+
+def require_object(view, pk):
+    """Raise NotFound unless the view's collection holds `pk`"""
+    if not repository_for(view.queryset.model).exists(pk):
+        raise NotFound()
+
+
+def rollup_stats(request, scope, key):
+    """
+    Daily or weekly totals from the activity rollups.
+
+    ?start= and ?end= are ISO dates (default: the 30 days up to today) and
+    ?period= is 'day' or 'week'.
+    """
+    def date_param(name, default):
+        value = request.query_params.get(name)
+        if value is None:
+            return default
+        try:
+            parsed = parse_date(value)
+        except ValueError:
+            parsed = None
+        if parsed is None:
+            raise ValidationError({name: 'Expected a date in YYYY-MM-DD format.'})
+        return parsed
+
+    end = date_param('end', timezone.now().date())
+    start = date_param('start', end - timedelta(days=29))
+    period = request.query_params.get('period', rollups.DAY)
+    if period not in (rollups.DAY, rollups.WEEK):
+        raise ValidationError({'period': f"Expected '{rollups.DAY}' or '{rollups.WEEK}'."})
+    if start > end:
+        raise ValidationError({'start': 'Must not be after end.'})
+    if (end - start).days >= settings.STATS_MAX_DAYS:
+        raise ValidationError({'start': f'Range exceeds {settings.STATS_MAX_DAYS} days.'})
+    return Response(rollups.series(scope, key, start, end, period))
+
+
+class SparseFieldsViewMixin:
+    """
+    Sparse reads and lean list pages.
+
+    ?fields= / ?exclude= narrow the serializer (see SparseFieldsMixin) and
+    the database query, which loads only the model fields those serializer
+    fields read plus the ones the cursor position needs. Non-detail routes
+    also drop the serializer's Meta.list_exclude. List pages are rendered
+    with serializers.lean_data().
+    """
+    sparse_actions = ('list', 'retrieve')
+
+    def get_serializer_context(self):
+        return {**super().get_serializer_context(), 'listing': not self.detail}
+
+    def load_fields(self, serializer_class, ordering=()):
+        """Model fields a read must load, or None when it needs all of them"""
+        selected = requested_fields(self.request, serializer_class, listing=not self.detail)
+        if selected is None:
+            return None
+        names = model_fields(serializer_class, selected)
+        names.update(name.lstrip('-') for name in ordering)
+        return names
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action in self.sparse_actions:
+            ordering = self.paginator.get_ordering(self.request, queryset, self) if self.paginator else ()
+            names = self.load_fields(self.get_serializer_class(), ordering)
+            if names is not None:
+                queryset = queryset.only(*names)
+        return queryset
+
+    def serialize_list(self, instances, serializer_class=None):
+        if serializer_class is None:
+            serializer = self.get_serializer(instances, many=True)
+        else:
+            serializer = serializer_class(instances, many=True, context=self.get_serializer_context())
+        return lean_data(serializer, instances)
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        if page is None:
+            return Response(self.serialize_list(queryset))
+        return self.get_paginated_response(self.serialize_list(page))
+
+
+class NativeReadMixin:
+    """
+    Serve list and retrieve from the pymongo repositories.
+
+    Enabled by the API_NATIVE_READS setting, and only for requests using
+    exact filterset fields, ordering and paging; anything else (search,
+    custom actions, writes) goes through the ORM as before.
+    """
+    native_params = {'ordering', 'cursor', 'page_size', 'fields', 'exclude'}
+
+    def use_native_reads(self, request):
+        if not settings.API_NATIVE_READS:
+            return False
+        allowed = self.native_params | set(getattr(self, 'filterset_fields', []))
+        return set(request.query_params) <= allowed
+
+    def list(self, request, *args, **kwargs):
+        if not self.use_native_reads(request):
+            return super().list(request, *args, **kwargs)
+
+        repository = repository_for(self.queryset.model)
+        lookups = exact_lookups(self, request)
+        ordering = list_ordering(self, request.query_params.get('ordering'))
+        token = request.query_params.get('cursor')
+        try:
+            cursor = decode_cursor(token) if token else None
+        except ValueError:
+            raise NotFound('Invalid cursor')
+
+        names = self.load_fields(self.get_serializer_class(), ordering)
+        records, has_more = repository.page(
+            lookups, ordering, cursor, self.paginator.get_page_size(request),
+            projection=dict.fromkeys(names, 1) if names else None
+        )
+        next_link, previous_link = repository.page_links(
+            request.build_absolute_uri(), records, ordering, cursor, has_more
+        )
+
+        return Response(OrderedDict([
+            ('next', next_link),
+            ('previous', previous_link),
+            ('results', self.serialize_list(records)),
+        ]))
+
+    def retrieve(self, request, *args, **kwargs):
+        if not settings.API_NATIVE_READS:
+            return super().retrieve(request, *args, **kwargs)
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        names = self.load_fields(self.get_serializer_class())
+        record = repository_for(self.queryset.model).get(
+            kwargs[lookup_url_kwarg], projection=dict.fromkeys(names, 1) if names else None
+        )
+        if record is None:
+            raise NotFound()
+        return Response(self.get_serializer(record).data)
+
+
+class ConditionalGetMixin:
+    """
+    ETag/Last-Modified revalidation for list and retrieve (see
+    conditional.py), and the route's Cache-Control policy on every
+    successful GET. Custom read actions opt in with @conditional.
+
+    `conditional_field` must be indexed and moved by every insert;
+    `conditional_namespaces` are the response_cache namespaces the model's
+    writes invalidate.
+    """
+    conditional_field = None
+    conditional_namespaces = ()
+
+    @conditional
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @conditional
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        return add_cache_headers(self, request, response)
+
+
+class ExportMixin:
+    """
+    GET <list>/export/<format>/ streams every row matching the exact
+    filterset fields as NDJSON, CSV or Parquet (see exports.py), in the
+    pagination ordering. ?fields= / ?exclude= select the columns.
+    """
+
+    @action(detail=False, methods=['get'], url_path=r'export/(?P<export_format>[a-z]+)')
+    def export(self, request, export_format=None):
+        """Stream all matching rows as NDJSON, CSV or Parquet"""
+        if export_format not in exports.FORMATS:
+            raise NotFound(f'Unknown export format. Expected one of: {", ".join(exports.FORMATS)}.')
+        content_type, _encoder, available = exports.FORMATS[export_format]
+        if not available():
+            raise ValidationError({'format': f'{export_format} export is not available on this server.'})
+
+        names = self.load_fields(self.get_serializer_class())
+        fields = {name: field for name, field in self.get_serializer().fields.items() if not field.write_only}
+        batches = repository_for(self.queryset.model).batches(
+            exact_lookups(self, request), self.pagination_class.ordering,
+            projection=dict.fromkeys(names, 1) if names else None,
+            batch_size=settings.EXPORT_BATCH_SIZE,
+        )
+        rows = (self.serialize_list(batch) for batch in batches)
+
+        response = StreamingHttpResponse(exports.stream(export_format, fields, rows), content_type=content_type)
+        response['Content-Disposition'] = (
+            f'attachment; filename="{self.queryset.model._meta.db_table}.{export_format}"'
+        )
+        return response
+
+
+class UserViewSet(ConditionalGetMixin, RelevanceSearchMixin, NativeReadMixin, SparseFieldsViewMixin, viewsets.ModelViewSet):
     """
     API endpoint for managing users
     """
     queryset = User.objects.all()
     serializer_class = UserSerializer
-    filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
+    pagination_class = UserCursorPagination
+    filter_backends = [DjangoFilterBackend, TextSearchFilter, filters.OrderingFilter]
     filterset_fields = ['team', 'fitness_level']
     search_fields = ['name', 'email', 'alias']
+    search_prefix_fields = ['alias', 'name']
+    search_weights = {'alias': 5, 'name': 3, 'email': 1}
     ordering_fields = ['total_points', 'created_at', 'name']
     ordering = ['-total_points']
+    conditional_field = 'last_active'
+    conditional_namespaces = (LEADERBOARD,)
+
+    # Detail actions here and on TeamViewSet query by pk rather than load
+    # the object with get_object(); an unknown id still gets a 404.
 
     @action(detail=True, methods=['get'])
     def activities(self, request, pk=None):
         """Get all activities for a specific user"""
-        user = self.get_object()
-        activities = Activity.objects.filter(user_id=str(user._id))
-        serializer = ActivitySerializer(activities, many=True)
-        return Response(serializer.data)
+        require_object(self, pk)
+        activities = Activity.objects.filter(user_id=pk)
+        return paginated_response(self, activities, ActivitySerializer, ActivityCursorPagination)
+
+    @action(detail=True, methods=['get'])
+    def stats(self, request, pk=None):
+        """Get daily or weekly activity totals for a user over a date range"""
+        require_object(self, pk)
+        return rollup_stats(request, rollups.USER, pk)
 
 
-class TeamViewSet(viewsets.ModelViewSet):
+class TeamViewSet(ConditionalGetMixin, RelevanceSearchMixin, NativeReadMixin, SparseFieldsViewMixin, viewsets.ModelViewSet):
     """
     API endpoint for managing teams
     """
     queryset = Team.objects.all()
     serializer_class = TeamSerializer
-    filter_backends = [filters.SearchFilter, filters.OrderingFilter]
+    pagination_class = TeamCursorPagination
+    filter_backends = [TextSearchFilter, filters.OrderingFilter]
     search_fields = ['name', 'description']
+    search_prefix_fields = ['name']
     ordering_fields = ['name', 'created_at']
     ordering = ['name']
+    conditional_field = 'created_at'
+    conditional_namespaces = (LEADERBOARD,)
 
     @action(detail=True, methods=['get'])
     def members(self, request, pk=None):
         """Get all members of a specific team"""
-        team = self.get_object()
+        require_object(self, pk)
         users = User.objects.filter(team=pk)
-        serializer = UserSerializer(users, many=True)
-        return Response(serializer.data)
+        return paginated_response(self, users, UserSerializer, UserCursorPagination)
 
     @action(detail=True, methods=['get'])
     def activities(self, request, pk=None):
         """Get all activities for a specific team"""
-        team = self.get_object()
-        users = User.objects.filter(team=pk)
-        user_ids = [str(user._id) for user in users]
-        activities = Activity.objects.filter(user_id__in=user_ids)
-        serializer = ActivitySerializer(activities, many=True)
-        return Response(serializer.data)
+        require_object(self, pk)
+        activities = Activity.objects.filter(team_id=pk)
+        return paginated_response(self, activities, ActivitySerializer, ActivityCursorPagination)
+
+    @action(detail=True, methods=['get'])
+    def summary(self, request, pk=None):
+        """Get points, member count and per-activity-type totals for a team"""
+        summary = queries.team_summary(pk)
+        if summary is None:
+            raise NotFound()
+        return Response(summary)
+
+    @action(detail=True, methods=['get'])
+    def stats(self, request, pk=None):
+        """Get daily or weekly activity totals for a team over a date range"""
+        require_object(self, pk)
+        return rollup_stats(request, rollups.TEAM, pk)
 
 
-class ActivityViewSet(viewsets.ModelViewSet):
+class ActivityViewSet(ConditionalGetMixin, ExportMixin, RelevanceSearchMixin, NativeReadMixin, SparseFieldsViewMixin, viewsets.ModelViewSet):
     """
     API endpoint for managing activities
     """
     queryset = Activity.objects.all()
     serializer_class = ActivitySerializer
-    filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
-    filterset_fields = ['user_id', 'activity_type', 'user_alias']
+    pagination_class = ActivityCursorPagination
+    filter_backends = [DjangoFilterBackend, TextSearchFilter, filters.OrderingFilter]
+    filterset_fields = ['user_id', 'team_id', 'activity_type', 'user_alias']
     search_fields = ['user_name', 'user_alias', 'activity_type', 'notes']
+    search_prefix_fields = ['user_alias']
+    search_weights = {'user_alias': 5, 'user_name': 3, 'activity_type': 3, 'notes': 1}
     ordering_fields = ['date', 'points_earned', 'duration_minutes', 'calories_burned']
     ordering = ['-date']
+    # Activity dates can be backdated, so inserts are tracked by _id
+    conditional_field = '_id'
+    conditional_namespaces = (LEADERBOARD,)
+
+    def create(self, request, *args, **kwargs):
+        """Create an activity, or answer with the stored one when its idempotency_key repeats"""
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        key = serializer.validated_data.get('idempotency_key')
+        try:
+            self.perform_create(serializer)
+        except DatabaseError as exc:
+            if not key or not is_duplicate_key(exc):
+                raise
+            existing = Activity.objects.filter(idempotency_key=key).first()
+            if existing is None:
+                # Claimed by a write still in flight (see timeseries.py)
+                return Response(
+                    {'idempotency_key': ['An activity with this key is being created.']},
+                    status=status.HTTP_409_CONFLICT
+                )
+            return Response(self.get_serializer(existing).data, status=status.HTTP_200_OK)
+        headers = self.get_success_headers(serializer.data)
+        return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
 
     @action(detail=False, methods=['get'])
     def recent(self, request):
@@ -79,70 +384,124 @@ class ActivityViewSet(viewsets.ModelViewSet):
         from datetime import timedelta
         thirty_days_ago = timezone.now() - timedelta(days=30)
         activities = Activity.objects.filter(date__gte=thirty_days_ago)
-        serializer = self.get_serializer(activities, many=True)
-        return Response(serializer.data)
+        page = self.paginate_queryset(activities)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+    @action(detail=False, methods=['get'])
+    def stats(self, request):
+        """Get daily or weekly totals for one activity type over a date range"""
+        activity_type = request.query_params.get('activity_type')
+        if not activity_type:
+            raise ValidationError({'activity_type': 'This parameter is required.'})
+        return rollup_stats(request, rollups.ACTIVITY_TYPE, activity_type)
+
+    @action(detail=False, methods=['post'], parser_classes=[JSONParser, NDJSONParser])
+    def bulk(self, request):
+        """Ingest a batch of activities (JSON array or NDJSON) in one write"""
+        if not isinstance(request.data, list):
+            raise ValidationError('Expected a list of activities.')
+        if len(request.data) > settings.ACTIVITY_BULK_MAX_BATCH:
+            raise ValidationError(f'Batch exceeds {settings.ACTIVITY_BULK_MAX_BATCH} items.')
+        serializer = self.get_serializer(data=request.data, many=True)
+        serializer.is_valid(raise_exception=True)
+        ids, duplicates = ingest.ingest_activities(serializer.validated_data)
+        return Response(
+            {'created': len(ids), 'duplicates': duplicates, 'ids': ids},
+            status=status.HTTP_201_CREATED
+        )
 
 
-class LeaderboardViewSet(viewsets.ReadOnlyModelViewSet):
+class LeaderboardViewSet(ConditionalGetMixin, ExportMixin, NativeReadMixin, SparseFieldsViewMixin, viewsets.ReadOnlyModelViewSet):
     """
     API endpoint for viewing leaderboard (read-only)
     """
     queryset = Leaderboard.objects.all()
     serializer_class = LeaderboardSerializer
+    pagination_class = LeaderboardCursorPagination
     filter_backends = [DjangoFilterBackend, filters.OrderingFilter]
     filterset_fields = ['type', 'team']
     ordering_fields = ['rank', 'total_points']
     ordering = ['rank']
+    conditional_field = 'updated_at'
+    conditional_namespaces = (LEADERBOARD,)
+    sparse_actions = ('list', 'retrieve', 'individual', 'teams', 'top_ten')
 
     @action(detail=False, methods=['get'])
+    @conditional
+    @cached_response(LEADERBOARD)
     def individual(self, request):
         """Get individual leaderboard only"""
-        leaderboard = Leaderboard.objects.filter(type='individual')
-        serializer = self.get_serializer(leaderboard, many=True)
-        return Response(serializer.data)
+        leaderboard = self.get_queryset().filter(type='individual')
+        page = self.paginate_queryset(leaderboard)
+        return self.get_paginated_response(self.serialize_list(page))
 
     @action(detail=False, methods=['get'])
+    @conditional
+    @cached_response(LEADERBOARD)
     def teams(self, request):
         """Get team leaderboard only"""
-        leaderboard = Leaderboard.objects.filter(type='team')
-        serializer = self.get_serializer(leaderboard, many=True)
-        return Response(serializer.data)
+        leaderboard = self.get_queryset().filter(type='team')
+        page = self.paginate_queryset(leaderboard)
+        return self.get_paginated_response(self.serialize_list(page))
 
     @action(detail=False, methods=['get'])
+    @conditional
+    @cached_response(LEADERBOARD)
     def top_ten(self, request):
         """Get top 10 individual rankings"""
-        leaderboard = Leaderboard.objects.filter(type='individual')[:10]
-        serializer = self.get_serializer(leaderboard, many=True)
-        return Response(serializer.data)
+        leaderboard = self.get_queryset().filter(type='individual')[:10]
+        return Response(self.serialize_list(leaderboard))
 
 
-class WorkoutViewSet(viewsets.ModelViewSet):
+class WorkoutViewSet(ConditionalGetMixin, RelevanceSearchMixin, NativeReadMixin, SparseFieldsViewMixin, viewsets.ModelViewSet):
     """
     API endpoint for managing workouts
     """
     queryset = Workout.objects.all()
     serializer_class = WorkoutSerializer
-    filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
+    pagination_class = WorkoutCursorPagination
+    filter_backends = [DjangoFilterBackend, TextSearchFilter, filters.OrderingFilter]
     filterset_fields = ['difficulty', 'category']
     search_fields = ['name', 'description', 'category']
+    search_prefix_fields = ['name']
     ordering_fields = ['name', 'difficulty', 'duration_minutes', 'created_at']
     ordering = ['difficulty', 'name']
+    conditional_field = 'created_at'
+    conditional_namespaces = (WORKOUTS,)
 
     @action(detail=False, methods=['get'])
+    @conditional
+    @cached_response(WORKOUTS)
     def by_difficulty(self, request):
         """Get workouts grouped by difficulty"""
-        difficulties = ['beginner', 'intermediate', 'advanced', 'super-hero']
-        result = {}
-        for difficulty in difficulties:
-            workouts = Workout.objects.filter(difficulty=difficulty)
-            serializer = self.get_serializer(workouts, many=True)
-            result[difficulty] = serializer.data
-        return Response(result)
+        repository = repository_for(Workout)
+        # One pipeline: the sort walks the difficulty/name/_id index, and each
+        # group is cut to a page before anything is returned or serialized
+        groups = repository.collection.aggregate([
+            {'$match': {'difficulty': {'$in': DIFFICULTY_LEVELS}}},
+            {'$sort': {'difficulty': ASCENDING, 'name': ASCENDING, '_id': ASCENDING}},
+            {'$group': {'_id': '$difficulty', 'workouts': {'$push': '$$ROOT'}}},
+            {'$project': {'workouts': {'$slice': ['$workouts', self.paginator.max_page_size]}}},
+        ])
+        workouts = {group['_id']: group['workouts'] for group in groups}
+        return Response({
+            difficulty: self.serialize_list([repository.record(doc) for doc in workouts.get(difficulty, [])])
+            for difficulty in DIFFICULTY_LEVELS
+        })
 
     @action(detail=False, methods=['get'])
     def recommend(self, request):
-        """Get workout recommendations based on fitness level"""
-        fitness_level = request.query_params.get('fitness_level', 'beginner')
-        workouts = Workout.objects.filter(difficulty=fitness_level)[:5]
-        serializer = self.get_serializer(workouts, many=True)
-        return Response(serializer.data)
+        """Get workout recommendations for a fitness level and activity history"""
+        user_id = request.query_params.get('user_id')
+        fitness_level = request.query_params.get('fitness_level')
+        if user_id and not fitness_level:
+            fitness_level = recommendations.user_fitness_level(user_id)
+            if fitness_level is None:
+                raise NotFound('User not found.')
+        try:
+            limit = min(int(request.query_params.get('limit', 5)), self.paginator.max_page_size)
+        except ValueError:
+            limit = 5
+        workouts = recommendations.recommend(fitness_level or 'beginner', user_id=user_id, limit=limit)
+        return Response(workouts)